@@ -0,0 +1,49 @@
+import os
+
+"""
+Writing files so that a crash leaves either their old or their new contents.
+
+write_atomically() writes to a temporary file next to the real one, fsyncs it
+and renames it over the real one. Windows won't rename over an existing file,
+so there the real file is removed first; a reader that finds it missing should
+read the temporary file instead, which is complete by then.
+
+    atomic_file.write_atomically(path, lambda file_: cPickle.dump(data, file_))
+"""
+
+TEMPORARY_SUFFIX = ".tmp"
+
+
+def write_atomically(path, write):
+    """ Replaces the file at path with what write(file_) writes. """
+    safe_mkdirs(os.path.dirname(path))
+    temporary_path = path + TEMPORARY_SUFFIX
+    with open(temporary_path, 'wb') as file_:
+        write(file_)
+        file_.flush()
+        os.fsync(file_.fileno())
+    replace(temporary_path, path)
+
+
+def replace(source, destination):
+    try:
+        os.rename(source, destination)
+    except OSError:
+        # Windows won't rename over an existing file. Readers fall back to the temporary file meanwhile.
+        os.remove(destination)
+        os.rename(source, destination)
+
+
+def safe_mkdirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError:  # Already exists
+        pass
+
+
+def safe_remove(path):
+    if path is not None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,192 @@
+import collections
+import os
+import subprocess
+import threading
+import time
+
+"""
+Sound playback for the check-in board.
+
+All sounds are read into memory when the AudioWorker is created, and are
+played one at a time by a single long-lived worker thread, so asking for a
+sound never touches the disk or starts a thread. Requests for a sound that is
+already waiting to be played are merged into it, and when more than
+max_pending sounds are waiting the oldest is dropped: by the time a backlog
+could be played it would no longer match what the board is doing.
+
+Backends:
+    - WinsoundBackend: winsound.PlaySound from memory (Windows).
+    - AlsaBackend: pipes the WAV data to ALSA's aplay (Linux).
+    - NullBackend: discards sounds, for machines without audio.
+"""
+
+DEFAULT_MAX_PENDING = 2
+PATH_SEPARATORS = ('\\', '/')
+
+
+class NullBackend(object):
+
+    def play(self, wav_data):
+        pass
+
+
+class WinsoundBackend(object):
+
+    def __init__(self):
+        import winsound
+        self._winsound = winsound
+
+    def play(self, wav_data):
+        self._winsound.PlaySound(wav_data, self._winsound.SND_MEMORY)
+
+
+class AlsaBackend(object):
+
+    APLAY_COMMAND = ['aplay', '-q', '-']
+
+    def play(self, wav_data):
+        player = subprocess.Popen(AlsaBackend.APLAY_COMMAND, stdin=subprocess.PIPE)
+        player.communicate(wav_data)
+
+
+def default_backend():
+    try:
+        return WinsoundBackend()
+    except ImportError:
+        pass
+    if _on_path('aplay'):
+        return AlsaBackend()
+    return NullBackend()
+
+
+def _on_path(program):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(directory, program), os.X_OK):
+            return True
+    return False
+
+
+def resolve_sound_path(sound, base_directory):
+    """ Finds sound, a relative path with either separator, under base_directory ignoring case.
+
+        Returns None if there is no such file.
+    """
+    path = base_directory
+    for component in _split_path(sound):
+        candidate = os.path.join(path, component)
+        if not os.path.exists(candidate):
+            try:
+                matches = [name for name in os.listdir(path) if name.lower() == component.lower()]
+            except OSError:
+                return None
+            if not matches:
+                return None
+            candidate = os.path.join(path, matches[0])
+        path = candidate
+    return path if os.path.isfile(path) else None
+
+
+def _split_path(sound):
+    for separator in PATH_SEPARATORS[1:]:
+        sound = sound.replace(separator, PATH_SEPARATORS[0])
+    return [component for component in sound.split(PATH_SEPARATORS[0]) if component]
+
+
+def load_sounds(sounds, base_directory):
+    """ Returns {sound: WAV data} for the sounds that exist under base_directory. """
+    sound_data = {}
+    for sound in sounds:
+        path = resolve_sound_path(sound, base_directory)
+        if path is None:
+            print "Sound %s not found; it will not be played." % sound
+            continue
+        with open(path, 'rb') as sound_file:
+            sound_data[sound] = sound_file.read()
+    return sound_data
+
+
+class AudioWorker(object):
+    """ Plays preloaded sounds on one worker thread from a small, bounded queue. """
+
+    def __init__(self, sound_data, backend=None, max_pending=DEFAULT_MAX_PENDING):
+        self._sound_data = sound_data
+        self._backend = backend if backend is not None else default_backend()
+        self._max_pending = max_pending
+        self._pending = collections.deque()
+        self._pending_changed = threading.Condition()
+        self._playing = False
+
+        self.played = 0
+        self.merged = 0
+        self.dropped = 0
+        self.missing = 0
+
+        worker = threading.Thread(target=self._play_pending)
+        worker.daemon = True
+        worker.start()
+
+    @staticmethod
+    def from_files(sounds, base_directory, backend=None, max_pending=DEFAULT_MAX_PENDING):
+        return AudioWorker(load_sounds(sounds, base_directory), backend, max_pending)
+
+    def play(self, sound):
+        """ Queues sound to be played; never blocks. """
+        with self._pending_changed:
+            if sound not in self._sound_data:
+                self.missing += 1
+            elif sound in self._pending:
+                self.merged += 1
+            else:
+                if len(self._pending) >= self._max_pending:
+                    self._pending.popleft()
+                    self.dropped += 1
+                self._pending.append(sound)
+                self._pending_changed.notify_all()
+
+    def wait_until_idle(self, timeout=None):
+        """ Waits until nothing is playing or waiting to be played. Returns False on timeout. """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._pending_changed:
+            while self._pending or self._playing:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._pending_changed.wait(remaining)
+            return True
+
+    def stats(self):
+        with self._pending_changed:
+            return {'played': self.played,
+                    'merged': self.merged,
+                    'dropped': self.dropped,
+                    'missing': self.missing,
+                    'pending': len(self._pending)}
+
+    def _play_pending(self):
+        while True:
+            with self._pending_changed:
+                while not self._pending:
+                    self._pending_changed.wait()
+                sound = self._pending.popleft()
+                self._playing = True
+            try:
+                self._backend.play(self._sound_data[sound])
+            except Exception as error:
+                print "Could not play %s: %s" % (sound, error)
+            with self._pending_changed:
+                self._playing = False
+                self.played += 1
+                self._pending_changed.notify_all()  # Wakes wait_until_idle().
+
+
+_default_worker = None
+_default_worker_lock = threading.Lock()
+
+
+def default_worker(sounds, base_directory):
+    """ The process-wide AudioWorker, created with sounds the first time this is called. """
+    global _default_worker
+    with _default_worker_lock:
+        if _default_worker is None:
+            _default_worker = AudioWorker.from_files(sounds, base_directory)
+        return _default_worker
@@ -0,0 +1,276 @@
+import binascii
+import collections
+import struct
+import time
+
+import serial_framing
+
+"""
+Protocols for the serial link between the computer and the check-in board.
+
+The legacy protocol is Interface.ino's: the board prints one ASCII line per
+event ("M15\r\n") and every byte sent to it is written to the LCD.
+
+The framed protocol wraps the same payloads in checksummed, sequence numbered
+frames:
+
+    0x7E | version | type | sequence | length | payload (length bytes) | CRC
+
+version, type, sequence and length are single bytes; the CRC is the big-endian
+CRC-16/CCITT (initial value 0xFFFF) of everything from version to the end of
+the payload. Each side numbers the EVENT or DISPLAY frames it sends from 0,
+wrapping at 256, and keeps the last RETRANSMIT_HISTORY of them. A receiver that
+sees a gap in the sequence sends a RETRANSMIT frame whose one byte payload is
+the missing sequence number, holding back later frames until the gap is filled
+or the reorder window overflows. Frames that fail their CRC are skipped by
+resynchronizing on the next 0x7E.
+
+At startup the computer sends a HELLO frame whose payload is the protocol
+version. A board that speaks the framed protocol answers with a HELLO of its
+own; if nothing answers within NEGOTIATION_TIMEOUT_SECONDS the link falls back
+to the legacy protocol. (Legacy firmware shows the HELLO bytes on the LCD
+until the first display message clears it.)
+"""
+
+PROTOCOL_VERSION = 1
+
+START_OF_FRAME = '\x7e'
+HEADER = struct.Struct('>BBBB')  # Version, type, sequence, payload length
+CHECKSUM = struct.Struct('>H')
+HEADER_START = len(START_OF_FRAME)
+PAYLOAD_START = HEADER_START + HEADER.size
+MAX_PAYLOAD_LENGTH = 255
+
+FRAME_HELLO = 1
+FRAME_EVENT = 2
+FRAME_DISPLAY = 3
+FRAME_RETRANSMIT = 4
+
+SEQUENCE_MODULUS = 256
+NO_SEQUENCE = 0  # Sequence number used for HELLO and RETRANSMIT frames, which are not numbered.
+RETRANSMIT_HISTORY = 16
+REORDER_WINDOW = 16
+
+NEGOTIATION_TIMEOUT_SECONDS = 0.5
+
+
+def checksum(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(frame_type, sequence, payload=''):
+    if len(payload) > MAX_PAYLOAD_LENGTH:
+        raise ValueError("Payload of %d bytes is too long for a frame" % len(payload))
+    body = HEADER.pack(PROTOCOL_VERSION, frame_type, sequence, len(payload)) + payload
+    return START_OF_FRAME + body + CHECKSUM.pack(checksum(body))
+
+
+class FrameDecoder(object):
+    """ Extracts (type, sequence, payload) frames from a byte stream, skipping corrupt data. """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+        self.frames_decoded = 0
+        self.checksum_errors = 0
+        self.bytes_discarded = 0
+
+    def feed(self, data):
+        self._buffer.extend(data)
+        frames = []
+        while True:
+            start = self._buffer.find(START_OF_FRAME)
+            if start == -1:
+                self._discard(len(self._buffer))
+                return frames
+            self._discard(start)
+
+            if len(self._buffer) < PAYLOAD_START:
+                return frames
+            version, frame_type, sequence, length = HEADER.unpack_from(str(self._buffer[HEADER_START:PAYLOAD_START]))
+            if version != PROTOCOL_VERSION:
+                self._discard(len(START_OF_FRAME))
+                continue
+
+            frame_end = PAYLOAD_START + length + CHECKSUM.size
+            if len(self._buffer) < frame_end:
+                return frames
+            body = str(self._buffer[HEADER_START:PAYLOAD_START + length])
+            received_checksum, = CHECKSUM.unpack(str(self._buffer[PAYLOAD_START + length:frame_end]))
+            if received_checksum != checksum(body):
+                self.checksum_errors += 1
+                self._discard(len(START_OF_FRAME))
+                continue
+
+            del self._buffer[:frame_end]
+            self.frames_decoded += 1
+            frames.append((frame_type, sequence, body[HEADER.size:]))
+
+    def _discard(self, byte_count):
+        if byte_count:
+            self.bytes_discarded += byte_count
+            del self._buffer[:byte_count]
+
+
+class LegacyLineProtocol(object):
+    """ Interface.ino's protocol: one ASCII line per event, raw bytes to the LCD. """
+
+    name = "legacy"
+    board_hellos = 0  # Legacy firmware never says when it has restarted.
+
+    def __init__(self, initial_data=''):
+        self._line_framer = serial_framing.LineFramer()
+        self._pending_messages = self.feed(initial_data) if initial_data else []
+
+    def read_messages(self, serial_port):
+        messages, self._pending_messages = self._pending_messages, []
+        return messages + [frame.tobytes() for frame in self._line_framer.read_frames(serial_port)]
+
+    def feed(self, data):
+        return [message.tobytes() for message in self._line_framer.feed(data)]
+
+    def write_display(self, serial_port, data):
+        serial_port.write(data)
+
+    def stats(self):
+        stats = self._line_framer.stats()
+        stats['protocol'] = self.name
+        return stats
+
+
+class FramedProtocol(object):
+    """ The framed protocol: checksummed, sequence numbered frames with retransmission. """
+
+    name = "framed"
+
+    def __init__(self, frame_decoder=None):
+        self._frame_decoder = frame_decoder if frame_decoder is not None else FrameDecoder()
+        self._expected_sequence = None
+        self._held_payloads = {}  # Sequence -> payload of frames received ahead of a gap
+        self._requested_sequences = set()
+        self._send_sequence = 0
+        self._sent_frames = collections.deque(maxlen=RETRANSMIT_HISTORY)  # (sequence, frame)
+        self._pending_messages = []
+
+        self.reads = 0
+        self.bytes_read = 0
+        self.duplicate_frames = 0
+        self.retransmits_requested = 0
+        self.retransmits_sent = 0
+        self.frames_lost = 0
+        self.board_hellos = 0  # HELLOs received after negotiation, i.e. board restarts
+
+    def read_messages(self, serial_port):
+        messages, self._pending_messages = self._pending_messages, []
+        bytes_waiting = serial_port.inWaiting()
+        if bytes_waiting:
+            messages += self.feed(serial_port.read(bytes_waiting), serial_port.write)
+        return messages
+
+    def feed(self, data, write):
+        """ Returns the event payloads that data completes, in sequence order. write sends control frames. """
+        self.reads += 1
+        self.bytes_read += len(data)
+        return self.receive_frames(self._frame_decoder.feed(data), write)
+
+    def receive_frames(self, frames, write):
+        messages = []
+        for frame_type, sequence, payload in frames:
+            if frame_type == FRAME_EVENT:
+                messages.extend(self._receive_event(sequence, payload, write))
+            elif frame_type == FRAME_RETRANSMIT and payload:
+                self._retransmit(ord(payload[0]), write)
+            elif frame_type == FRAME_HELLO:
+                self.board_hellos += 1
+                self._expected_sequence = None  # The board restarted its numbering.
+                self._held_payloads.clear()
+                self._requested_sequences.clear()
+        return messages
+
+    def write_display(self, serial_port, data):
+        frame = encode_frame(FRAME_DISPLAY, self._send_sequence, data)
+        self._sent_frames.append((self._send_sequence, frame))
+        self._send_sequence = (self._send_sequence + 1) % SEQUENCE_MODULUS
+        serial_port.write(frame)
+
+    def stats(self):
+        return {'protocol': self.name,
+                'reads': self.reads,
+                'bytes_read': self.bytes_read,
+                'frames_decoded': self._frame_decoder.frames_decoded,
+                'checksum_errors': self._frame_decoder.checksum_errors,
+                'bytes_discarded': self._frame_decoder.bytes_discarded,
+                'duplicate_frames': self.duplicate_frames,
+                'retransmits_requested': self.retransmits_requested,
+                'retransmits_sent': self.retransmits_sent,
+                'frames_lost': self.frames_lost,
+                'board_hellos': self.board_hellos}
+
+    def _receive_event(self, sequence, payload, write):
+        if self._expected_sequence is None:
+            self._expected_sequence = sequence
+
+        distance = (sequence - self._expected_sequence) % SEQUENCE_MODULUS
+        if distance >= SEQUENCE_MODULUS // 2 or sequence in self._held_payloads:
+            self.duplicate_frames += 1  # Already delivered or already held.
+            return []
+
+        self._held_payloads[sequence] = payload
+        if distance and len(self._held_payloads) <= REORDER_WINDOW:
+            self._request_missing(sequence, write)
+            return []
+        if distance:
+            self._skip_to_next_held()
+        return self._deliver_in_order()
+
+    def _request_missing(self, sequence, write):
+        missing = self._expected_sequence
+        while missing != sequence:
+            if missing not in self._held_payloads and missing not in self._requested_sequences:
+                self._requested_sequences.add(missing)
+                self.retransmits_requested += 1
+                write(encode_frame(FRAME_RETRANSMIT, NO_SEQUENCE, chr(missing)))
+            missing = (missing + 1) % SEQUENCE_MODULUS
+
+    def _skip_to_next_held(self):
+        # Too much is being held back waiting for the gap: give up on the missing frames.
+        while self._expected_sequence not in self._held_payloads:
+            self._requested_sequences.discard(self._expected_sequence)
+            self.frames_lost += 1
+            self._expected_sequence = (self._expected_sequence + 1) % SEQUENCE_MODULUS
+
+    def _deliver_in_order(self):
+        messages = []
+        while self._expected_sequence in self._held_payloads:
+            messages.append(self._held_payloads.pop(self._expected_sequence))
+            self._requested_sequences.discard(self._expected_sequence)
+            self._expected_sequence = (self._expected_sequence + 1) % SEQUENCE_MODULUS
+        return messages
+
+    def _retransmit(self, sequence, write):
+        for sent_sequence, frame in self._sent_frames:
+            if sent_sequence == sequence:
+                self.retransmits_sent += 1
+                write(frame)
+                return
+
+
+def negotiate(serial_port, timeout=NEGOTIATION_TIMEOUT_SECONDS, clock=time.time):
+    """ Offers the framed protocol to the board and returns the protocol to talk to it with. """
+    serial_port.write(encode_frame(FRAME_HELLO, NO_SEQUENCE, chr(PROTOCOL_VERSION)))
+
+    frame_decoder = FrameDecoder()
+    received = bytearray()
+    deadline = clock() + timeout
+    while clock() < deadline:
+        data = serial_port.read(max(1, serial_port.inWaiting()))  # Waits up to the port's timeout.
+        received.extend(data)
+        frames = frame_decoder.feed(data)
+        for index, (frame_type, unused_sequence, payload) in enumerate(frames):
+            if frame_type == FRAME_HELLO and payload[:1] == chr(PROTOCOL_VERSION):
+                protocol = FramedProtocol(frame_decoder)
+                protocol._pending_messages = protocol.receive_frames(frames[index + 1:], serial_port.write)
+                return protocol
+
+    # Whatever the board sent meanwhile was in the legacy protocol.
+    return LegacyLineProtocol(str(received))
@@ -0,0 +1,289 @@
+import argparse
+import datetime
+import os
+import pty
+import random
+import threading
+import time
+import tty
+import Queue as queue
+
+import board_protocol
+import event
+import event_loop
+import fsm
+import io_moderator
+import latency_metrics
+import shop_check_in_exceptions
+import shop_user
+import shop_user_database
+
+"""
+Simulates the check-in board on a Linux pseudo-terminal so that the real
+IoModerator and BoardFsm can be benchmarked without the hardware.
+
+The simulator speaks the board's line protocol (M0/M1 slot changes, S0/S1
+switch flips and B0..B4 buttons) over the pty, injects card swipes straight
+into the event queue as the IdLogger would, and records every display frame
+the moderator writes back. For each stimulus it measures the time until the
+LCD is written to, and reports p50/p99 latencies per kind of stimulus,
+followed by latency_metrics' breakdown of where that time went.
+
+With --framed the simulated board answers the protocol negotiation and
+speaks board_protocol's framed protocol instead. With --event-loop the
+moderator and FSM run on one event_loop.EventLoop, as main.py --event-loop does.
+
+    python board_simulator.py [--random N] [--seed S] [--interval SECONDS] [--framed] [--event-loop]
+"""
+
+FRAME_TIMEOUT_SECONDS = 0.5
+DEFAULT_INTERVAL_SECONDS = 0.05
+READ_SIZE = 1024
+
+SERIAL = "serial"
+SWIPE = "swipe"
+
+_TEST_DATE = str(datetime.date.today())
+_USER_DATA_POD = ["POD Joe", _TEST_DATE, "", "pod@example.com", "40000001", 0, shop_user.IS_PROCTOR]
+_USER_DATA_CERTIFIED = ["Joe Schmoe", _TEST_DATE, "", "joe@example.com", "40000002", 0, shop_user.IS_NOT_PROCTOR]
+POD_ID = _USER_DATA_POD[shop_user.ID]
+CERTIFIED_ID = _USER_DATA_CERTIFIED[shop_user.ID]
+
+# A full day in miniature: open, check a user in and out of a slot, close.
+DEFAULT_SCRIPT = [(SWIPE, POD_ID),
+                  (SERIAL, event.SWITCH_FLIP_ON),
+                  (SWIPE, POD_ID),
+                  (SWIPE, CERTIFIED_ID),
+                  (SERIAL, event.CARD_INSERT + "5"),
+                  (SWIPE, POD_ID),
+                  (SERIAL, event.CARD_REMOVE + "5"),
+                  (SERIAL, event.BUTTON_DISCHARGE_USER),
+                  (SWIPE, POD_ID),
+                  (SERIAL, event.SWITCH_FLIP_OFF)]
+
+_RANDOM_STIMULI = [(SWIPE, POD_ID),
+                   (SWIPE, CERTIFIED_ID),
+                   (SERIAL, event.SWITCH_FLIP_ON),
+                   (SERIAL, event.SWITCH_FLIP_OFF),
+                   (SERIAL, event.BUTTON_CANCEL),
+                   (SERIAL, event.BUTTON_CONFIRM),
+                   (SERIAL, event.BUTTON_MONEY),
+                   (SERIAL, event.BUTTON_CHANGE_POD),
+                   (SERIAL, event.BUTTON_DISCHARGE_USER)]
+_RANDOM_SLOTS = [1, 5, 10, 20]
+
+
+class SimulatedShopUserDatabase(object):
+    """ An in-memory stand-in for the ShopUserDatabase. """
+
+    def __init__(self, users):
+        self._users = {user.id_number: user for user in users}
+
+    def get_shop_user(self, id_number):
+        try:
+            return self._users[id_number]
+        except KeyError:
+            raise shop_check_in_exceptions.NonexistentUserError
+
+    def increase_debt(self, user):
+        user.debt += shop_user_database.DEBT_INCREMENT
+
+    def clear_debt(self, user):
+        user.debt = 0
+
+
+class NullMailer(object):
+
+    def _send_id_card_email_s(self, user_s):
+        pass
+
+
+class BoardSimulator(object):
+    """ The board's end of a pseudo-terminal; open port with pyserial to talk to it. """
+
+    def __init__(self, framed=False):
+        self._framed = framed
+        self._frame_decoder = board_protocol.FrameDecoder()
+        self._send_sequence = 0
+        self._master_fd, self._slave_fd = pty.openpty()
+        tty.setraw(self._master_fd)
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+
+        self.frames = []  # (arrival time, data written to the "LCD")
+        self._frames_changed = threading.Condition()
+
+        reader = threading.Thread(target=self._record_frames)
+        reader.daemon = True
+        reader.start()
+
+    def send_line(self, line):
+        if self._framed:
+            os.write(self._master_fd, board_protocol.encode_frame(board_protocol.FRAME_EVENT, self._send_sequence, line))
+            self._send_sequence = (self._send_sequence + 1) % board_protocol.SEQUENCE_MODULUS
+        else:
+            os.write(self._master_fd, line + "\r\n")
+
+    def frame_count(self):
+        with self._frames_changed:
+            return len(self.frames)
+
+    def wait_for_frame(self, index, timeout=FRAME_TIMEOUT_SECONDS):
+        """ Returns the index-th frame recorded, or None if it doesn't arrive within timeout. """
+        deadline = time.time() + timeout
+        with self._frames_changed:
+            while len(self.frames) <= index:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._frames_changed.wait(remaining)
+            return self.frames[index]
+
+    def _record_frames(self):
+        while True:
+            try:
+                data = os.read(self._master_fd, READ_SIZE)
+            except OSError:
+                return
+            arrival_time = time.time()
+            if self._framed:
+                self._record_display_frames(arrival_time, data)
+            else:
+                self._record_display_data(arrival_time, data)
+
+    def _record_display_frames(self, arrival_time, data):
+        for frame_type, unused_sequence, payload in self._frame_decoder.feed(data):
+            if frame_type == board_protocol.FRAME_HELLO:
+                hello = board_protocol.encode_frame(board_protocol.FRAME_HELLO, board_protocol.NO_SEQUENCE,
+                                                    chr(board_protocol.PROTOCOL_VERSION))
+                os.write(self._master_fd, hello)
+            elif frame_type == board_protocol.FRAME_DISPLAY:
+                self._record_display_data(arrival_time, payload)
+
+    def _record_display_data(self, arrival_time, data):
+        with self._frames_changed:
+            self.frames.append((arrival_time, data))
+            self._frames_changed.notify_all()
+
+
+class LatencyBenchmark(object):
+    """ Drives a schedule of stimuli through IoModerator + BoardFsm and times the display's response. """
+
+    def __init__(self, interval=DEFAULT_INTERVAL_SECONDS, frame_timeout=FRAME_TIMEOUT_SECONDS, framed=False,
+                 use_event_loop=False):
+        self._interval = interval
+        self._frame_timeout = frame_timeout
+        self._simulator = BoardSimulator(framed)
+
+        self._loop = event_loop.EventLoop() if use_event_loop else None
+        if self._loop is not None:
+            self._event_q = event_loop.LoopEventQueue(self._loop)
+            message_q = event_loop.LoopMessageQueue(self._loop)
+        else:
+            self._event_q = queue.Queue()
+            message_q = io_moderator.MessageQueue()
+        shop_user_db = SimulatedShopUserDatabase([shop_user.ShopUser(_USER_DATA_POD),
+                                                  shop_user.ShopUser(_USER_DATA_CERTIFIED)])
+        self._board = fsm.BoardFsm(self._event_q, message_q, shop_user_db, NullMailer())
+        self._moderator = io_moderator.IoModerator(self._event_q, message_q, port=self._simulator.port,
+                                                   negotiate=framed)
+        self._moderator.daemon = True
+
+        self.latencies = {}  # Stimulus name -> [seconds]
+        self.unanswered = {}  # Stimulus name -> count of stimuli the LCD didn't change for
+
+    def run(self, schedule):
+        if self._loop is not None:
+            self._moderator.attach(self._loop)
+        else:
+            self._moderator.start()
+        board_thread = threading.Thread(target=self._board.run_fsm)
+        board_thread.daemon = True
+        board_thread.start()
+        self._simulator.wait_for_frame(0, self._frame_timeout)  # The initial state frame.
+
+        for kind, payload in schedule:
+            self._stimulate(kind, payload)
+            time.sleep(self._interval)
+
+        self._event_q.put(event.Event(event.TERMINATE_PROGRAM))
+        board_thread.join(self._frame_timeout)
+
+    def frames(self):
+        return [data for unused_time, data in self._simulator.frames]
+
+    def report(self):
+        lines = ["%-24s %6s %9s %9s %9s %10s" % ("stimulus", "count", "p50 ms", "p99 ms", "max ms", "unanswered")]
+        for name in sorted(set(self.latencies) | set(self.unanswered)):
+            latencies = sorted(self.latencies.get(name, []))
+            lines.append("%-24s %6d %9.3f %9.3f %9.3f %10d" % (name,
+                                                              len(latencies),
+                                                              1000 * percentile(latencies, 0.50),
+                                                              1000 * percentile(latencies, 0.99),
+                                                              1000 * (latencies[-1] if latencies else 0.0),
+                                                              self.unanswered.get(name, 0)))
+        all_latencies = sorted(sum(self.latencies.values(), []))
+        lines.append("%-24s %6d %9.3f %9.3f" % ("all", len(all_latencies),
+                                                1000 * percentile(all_latencies, 0.50),
+                                                1000 * percentile(all_latencies, 0.99)))
+        return "\n".join(lines)
+
+    def _stimulate(self, kind, payload):
+        next_frame = self._simulator.frame_count()
+        start_time = time.time()
+        if kind == SWIPE:
+            name = event.EVENT_CODE_TO_NAME_MAP[event.CARD_SWIPE]
+            self._event_q.put(event.Event(event.CARD_SWIPE, payload))
+        else:
+            name = event.EVENT_CODE_TO_NAME_MAP[payload[:2]]
+            self._simulator.send_line(payload)
+
+        frame = self._simulator.wait_for_frame(next_frame, self._frame_timeout)
+        if frame is None:
+            self.unanswered[name] = self.unanswered.get(name, 0) + 1
+        else:
+            arrival_time, unused_data = frame
+            self.latencies.setdefault(name, []).append(arrival_time - start_time)
+
+
+def random_schedule(length, seed=None):
+    generator = random.Random(seed)
+    schedule = []
+    for unused_index in xrange(length):
+        if generator.random() < 0.3:
+            key = generator.choice([event.CARD_INSERT, event.CARD_REMOVE])
+            schedule.append((SERIAL, key + str(generator.choice(_RANDOM_SLOTS))))
+        else:
+            schedule.append(generator.choice(_RANDOM_STIMULI))
+    return schedule
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the board pipeline against a simulated board.')
+    parser.add_argument('--random', type=int, default=0, metavar='N',
+                        help='Run N random stimuli instead of the scripted day.')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=1, help='Times to run the scripted day.')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL_SECONDS,
+                        help='Seconds between stimuli.')
+    parser.add_argument('--framed', action='store_true', help='Simulate a board that speaks the framed protocol.')
+    parser.add_argument('--event-loop', action='store_true', help='Run the moderator and FSM on an event loop.')
+    args = parser.parse_args()
+
+    schedule = random_schedule(args.random, args.seed) if args.random else DEFAULT_SCRIPT * args.repeat
+    benchmark = LatencyBenchmark(args.interval, framed=args.framed, use_event_loop=args.event_loop)
+    benchmark.run(schedule)
+    print benchmark.report()
+    print
+    print latency_metrics.dump()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import time
+
+CLEAR = '\0'
+LINE_SEPARATOR = '\n\r'
+NEXT_LINE = '\n'
+LINE_START = '\r'
+
+LCD_WIDTH = 16
+LCD_HEIGHT = 2
+LCD_CURSOR_LIMIT = LCD_WIDTH * LCD_HEIGHT  # Interface.ino clears the LCD before writing past this.
+
+UNKNOWN_CURSOR = None
+FULL_REWRITE_SECONDS = 30  # In case the LCD got garbled or the board reset without saying so.
+
+
+class DisplayFrameFilter(object):
+    """ Decides what actually has to be written to the LCD for a batch of display frames.
+
+        Only the newest of the frames waiting to be written is sent, and not
+        at all if it is what the LCD already shows. With send_changed_line_only,
+        a frame whose first line matches the one shown is sent as just its
+        second line, overwriting the old one in place.
+
+        Interface.ino has no cursor addressing, so the filter tracks the LCD
+        cursor the same way the firmware does to know when a partial write
+        is possible.
+
+        What the LCD shows is only trusted for full_rewrite_seconds after a
+        full write; after that the next frame is written in full whatever it is.
+    """
+
+    def __init__(self, send_changed_line_only=False, full_rewrite_seconds=FULL_REWRITE_SECONDS, clock=time.time):
+        self._send_changed_line_only = send_changed_line_only
+        self._full_rewrite_seconds = full_rewrite_seconds
+        self._clock = clock
+        self._shown_frame = None
+        self._shown_lines = None
+        self._cursor = UNKNOWN_CURSOR
+        self._full_write_time = None
+
+        self.frames_received = 0
+        self.frames_coalesced = 0
+        self.frames_deduplicated = 0
+        self.partial_writes = 0
+        self.writes = 0
+
+    def next_write(self, frames):
+        """ Returns the data to write for the newest of frames, or None if nothing needs writing. """
+        if not frames:
+            return None
+        self.frames_received += len(frames)
+        self.frames_coalesced += len(frames) - 1
+
+        now = self._clock()
+        if self._full_write_time is not None and now - self._full_write_time >= self._full_rewrite_seconds:
+            self.forget_shown_frame()
+
+        frame = frames[-1]
+        if frame == self._shown_frame:
+            self.frames_deduplicated += 1
+            return None
+
+        lines = DisplayFrameFilter._split_lines(frame)
+        data = self._changed_line_write(lines) if self._send_changed_line_only else None
+        if data is None:
+            data = frame
+            self._full_write_time = now
+        else:
+            self.partial_writes += 1
+
+        # Frames that don't clear the LCD add to whatever it showed, so what it shows is no longer known.
+        self._shown_frame = frame if lines is not None else None
+        self._shown_lines = lines
+        self._cursor = DisplayFrameFilter._advance_cursor(self._cursor, data)
+        self.writes += 1
+        return data
+
+    def forget_shown_frame(self):
+        """ Forces the next frame to be written in full, e.g. after the board resets. """
+        self._shown_frame = None
+        self._shown_lines = None
+        self._cursor = UNKNOWN_CURSOR
+        self._full_write_time = None
+
+    def writes_saved(self):
+        return self.frames_received - self.writes
+
+    def stats(self):
+        return {'frames_received': self.frames_received,
+                'frames_coalesced': self.frames_coalesced,
+                'frames_deduplicated': self.frames_deduplicated,
+                'partial_writes': self.partial_writes,
+                'writes': self.writes,
+                'writes_saved': self.writes_saved()}
+
+    def _changed_line_write(self, lines):
+        if lines is None or self._shown_lines is None or len(lines) != LCD_HEIGHT \
+                or len(self._shown_lines) != LCD_HEIGHT or lines[0] != self._shown_lines[0]:
+            return None
+        if self._cursor is UNKNOWN_CURSOR or not LCD_WIDTH <= self._cursor < LCD_CURSOR_LIMIT:
+            return None  # Only the second line can be rewritten without clearing, and only from that line.
+
+        new_line, old_line = lines[1], self._shown_lines[1]
+        return LINE_START + new_line.ljust(len(old_line))  # Blank out what is left of the old line.
+
+    @staticmethod
+    def _split_lines(frame):
+        if frame[0:1] != CLEAR:
+            return None
+        return frame[1:].split(LINE_SEPARATOR)
+
+    @staticmethod
+    def _advance_cursor(cursor, data):
+        """ Follows Interface.ino's lcdScroll() to find where the cursor ends up after data. """
+        if cursor is UNKNOWN_CURSOR:
+            if data[0:1] != CLEAR:
+                return UNKNOWN_CURSOR
+            cursor = LCD_CURSOR_LIMIT
+        for char in data:
+            if cursor >= LCD_CURSOR_LIMIT:
+                cursor = 0
+            if char == CLEAR:
+                cursor = LCD_CURSOR_LIMIT
+            elif char == NEXT_LINE:
+                cursor += LCD_WIDTH
+            elif char == LINE_START:
+                cursor = (cursor // LCD_WIDTH) * LCD_WIDTH
+            else:
+                cursor += 1
+        return cursor
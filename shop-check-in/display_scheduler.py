@@ -0,0 +1,164 @@
+import collections
+import math
+import time
+
+"""
+Timed display frames for the FSM and ErrorHandler.
+
+Some frames are only meant to be on the LCD for a while ("USER CHARGED" for a
+second, a no-confirm error for NO_CONFIRM_DELAY) before the board goes back to
+showing its state. Instead of sleeping through that time, the FSM asks a
+DisplayScheduler to show the frame for N seconds and carries on reading
+events with a timeout of time_until_next(); whenever that times out it calls
+tick(), and once is_showing() is False it shows its state frame again.
+
+The FSM handles events that arrive during the delay straight away: the next
+event, or any other frame shown meanwhile, cuts the timed frames short.
+
+Timers are kept in a hashed timer wheel, which keeps scheduling, cancelling
+and expiring a timer constant time whatever the number of timers (cancelling
+looks through the timers in the timer's own slot). The wheel remembers the
+earliest deadline, so time_until_next() is constant time too, except after
+the earliest timer has gone, when it looks through the timers that are left
+once.
+"""
+
+DEFAULT_TICK_SECONDS = 0.05
+DEFAULT_SLOT_COUNT = 64
+
+
+class WheelTimer(object):
+
+    def __init__(self, deadline_tick, callback, wheel=None):
+        self.deadline_tick = deadline_tick
+        self.callback = callback
+        self.cancelled = False
+        self._wheel = wheel  # While the timer is waiting in one of its slots
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            if self._wheel is not None:
+                self._wheel._remove(self)
+
+
+class TimerWheel(object):
+    """ Runs callbacks after a delay, to a resolution of tick_seconds, when advance() is called. """
+
+    def __init__(self, tick_seconds=DEFAULT_TICK_SECONDS, slot_count=DEFAULT_SLOT_COUNT, clock=time.time):
+        self._tick_seconds = tick_seconds
+        self._slots = [[] for ignored in xrange(slot_count)]
+        self._clock = clock
+        self._current_tick = self._tick_at(clock())
+        self._timer_count = 0
+        self._next_deadline_tick = None  # None with no timers; stale once the earliest timer goes.
+        self._next_deadline_stale = False
+
+    def call_later(self, delay, callback):
+        deadline_tick = max(self._current_tick + 1,
+                            int(math.ceil((self._clock() + delay) / self._tick_seconds)))
+        timer = WheelTimer(deadline_tick, callback, self)
+        self._slots[deadline_tick % len(self._slots)].append(timer)
+        self._timer_count += 1
+        if not self._next_deadline_stale and (self._next_deadline_tick is None or
+                                              deadline_tick < self._next_deadline_tick):
+            self._next_deadline_tick = deadline_tick
+        return timer
+
+    def advance(self):
+        """ Runs the callbacks of every timer that is due. """
+        target_tick = self._tick_at(self._clock())
+        if target_tick - self._current_tick > len(self._slots):
+            self._current_tick = target_tick - len(self._slots)  # Every slot gets visited anyway.
+        while self._current_tick < target_tick:
+            self._current_tick += 1
+            self._expire_slot(self._current_tick % len(self._slots), target_tick)
+
+    def time_until_next(self):
+        """ Seconds until the next timer is due (0 if one is overdue), or None if there are no timers. """
+        if self._next_deadline_stale:
+            deadlines = [timer.deadline_tick for slot in self._slots for timer in slot]
+            self._next_deadline_tick = min(deadlines) if deadlines else None
+            self._next_deadline_stale = False
+        if self._next_deadline_tick is None:
+            return None
+        return max(0.0, self._next_deadline_tick * self._tick_seconds - self._clock())
+
+    def __len__(self):
+        return self._timer_count
+
+    def _expire_slot(self, slot_index, target_tick):
+        due = []
+        remaining = []
+        for timer in self._slots[slot_index]:
+            if timer.deadline_tick <= target_tick:
+                due.append(timer)
+                timer._wheel = None
+                self._timer_count -= 1
+                self._forget_deadline(timer.deadline_tick)
+            else:
+                remaining.append(timer)  # Due on a later turn of the wheel.
+        self._slots[slot_index] = remaining
+        for timer in due:
+            if not timer.cancelled:  # By an earlier callback
+                timer.callback()
+
+    def _remove(self, timer):
+        self._slots[timer.deadline_tick % len(self._slots)].remove(timer)
+        timer._wheel = None
+        self._timer_count -= 1
+        self._forget_deadline(timer.deadline_tick)
+
+    def _forget_deadline(self, deadline_tick):
+        if deadline_tick == self._next_deadline_tick:
+            self._next_deadline_stale = True
+
+    def _tick_at(self, now):
+        return int(now / self._tick_seconds)
+
+
+class DisplayScheduler(object):
+    """ Puts display frames on the message queue, holding timed frames on the LCD for their duration. """
+
+    def __init__(self, message_q, timer_wheel=None):
+        self._message_q = message_q
+        self._timer_wheel = timer_wheel if timer_wheel is not None else TimerWheel()
+        self._timed_frames = collections.deque()  # (frame, seconds) waiting for the current one to expire
+        self._timer = None
+
+    def show(self, frame):
+        """ Shows frame now, cutting short any timed frames. """
+        self.cancel()
+        self._message_q.put(frame)
+
+    def show_for(self, frame, seconds):
+        """ Shows frame for seconds, after any timed frames already showing or waiting. """
+        self._timed_frames.append((frame, seconds))
+        if self._timer is None:
+            self._show_next_timed_frame()
+
+    def is_showing(self):
+        """ Whether a timed frame is still on the LCD. """
+        return self._timer is not None
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._timed_frames.clear()
+
+    def time_until_next(self):
+        return self._timer_wheel.time_until_next()
+
+    def tick(self):
+        self._timer_wheel.advance()
+
+    def _show_next_timed_frame(self):
+        frame, seconds = self._timed_frames.popleft()
+        self._message_q.put(frame)
+        self._timer = self._timer_wheel.call_later(seconds, self._on_timed_frame_expired)
+
+    def _on_timed_frame_expired(self):
+        self._timer = None
+        if self._timed_frames:
+            self._show_next_timed_frame()
@@ -1,3 +1,5 @@
+import time
+
 import shop
 import fsm
 import shop_user
@@ -5,23 +7,73 @@ import shop_user_database
 import shop_check_in_exceptions
 import event
 import io_moderator
+import display_scheduler
+import latency_metrics
+import logger.all_events as event_logger
 from mailer import Mailer
-import winsound
-import time
 
 DEFAULT_ERROR_MESSAGE = "\0ACTION NOT REC-\n\rOGNIZED. CNFM"
 DEFAULT_ERROR_MESSAGE_NO_CONFIRM = "\0ACTION NOT\n\rRECOGNIZED."
 ERROR_RESOLVED = "error_resolved"
 ERROR_NOT_RESOLVED = "error_not_resolved"
 NO_CONFIRM_DELAY = 1.5 # Second
+MAX_ERROR_STACK_DEPTH = 8  # Beyond this, a new error replaces the top one of its kind, or is dropped.
+
+
+class ErrorPolicy(object):
+    """ What the ErrorHandler does about an error in a state, worked out once and cached. """
+
+    __slots__ = ('is_real', 'requires_confirmation', 'message', 'frame', 'actions')
+
+    def __init__(self, is_real, requires_confirmation, message, actions):
+        self.is_real = is_real  # Some events are expected, and ignored, in some states.
+        self.requires_confirmation = requires_confirmation
+        self.message = message  # Error data, if any, is appended to this.
+        self.frame = io_moderator.safe_format_msg(message)  # For errors without data.
+        self.actions = actions  # Indexed by event type
+
+
+class ErrorFrame(object):
+    """ An error being resolved. """
+
+    __slots__ = ('return_state', 'error', 'policy', 'error_data')
+
+    def __init__(self, return_state, error, policy, error_data):
+        self.return_state = return_state
+        self.error = error
+        self.policy = policy
+        self.error_data = error_data
+
 
 class ErrorHandler(object):
-    def __init__(self, event_q, message_q, shop_, shop_user_db):
+    """ Resolves the errors the FSM runs into.
+
+        An error that needs confirming is pushed on a stack of ErrorFrames
+        and handle_error() returns straight away. While is_resolving(), the
+        FSM shows report_error() instead of its state's frame and passes its
+        events to handle_event(), which runs the top error's action for them.
+        Actions that run into another error (a card inserted into the wrong
+        slot while fixing a removed one, say) push it on top, and an error is
+        popped once resolved, uncovering the one beneath.
+
+        The stack holds at most MAX_ERROR_STACK_DEPTH errors. When it is
+        full, an error of the same kind as the top one replaces it, so the
+        board asks about the latest; any other error is dropped. Either way
+        the dropped error is logged and counted in latency_metrics.
+    """
+
+    def __init__(self, event_q, message_q, shop_, shop_user_db, mailer=None, display=None, name=None):
+        """ name is the station's, which its error stack is reported under in latency_metrics. """
         self._event_q = event_q
         self._message_q = message_q
+        self._display = display if display is not None else display_scheduler.DisplayScheduler(message_q)
         self._shop = shop_
         self._shop_user_db = shop_user_db
-        self._mailer = Mailer()
+        self._mailer = mailer if mailer is not None else Mailer()
+        self._error_stack = []
+        self._resolution_start_time = None
+        self._name = name
+        latency_metrics.error_stack_changed(0, name)
 
         # Messages can have 15 characters on the first line, 16 on the second
         self._messages_to_display = {
@@ -36,6 +88,7 @@ class ErrorHandler(object):
             shop_check_in_exceptions.PodRequiredError: "\0ERR - ONLY POD\n\rCANNOT SIGN OUT",
             shop_check_in_exceptions.PodCannotWorkError: "\0ERR - POD CAN\n\rNOT WORK",
             shop_check_in_exceptions.UserAlreadySwipedError: "\0ERR - USER\n\rALREADY SWIPED",
+            shop_check_in_exceptions.UserAlreadyCheckedInError: "\0ERR - USER\n\rALREADY IN SLOT",
             shop_user.DEFAULT_NAME: "\0ERR - LACK\n\r PERMISSIONS",
             event.CARD_SWIPE:  "\0ERR - IGNORING\n\r SWIPE, CONFIRM",
             event.CARD_REMOVE: "\0ERR- RENSRT/POD\n\rSWIPE, SLOT: ",
@@ -54,12 +107,14 @@ class ErrorHandler(object):
             fsm.UNLOCKED:
                 (shop_check_in_exceptions.ShopUserError,
                 shop_check_in_exceptions.NonexistentUserError,
-                shop_check_in_exceptions.PodCannotWorkError),
+                shop_check_in_exceptions.PodCannotWorkError,
+                shop_check_in_exceptions.UserAlreadyCheckedInError),
             fsm.ADDING_USER:
                 (shop_check_in_exceptions.ShopUserError,
                 shop_check_in_exceptions.NonexistentUserError,
                 shop_check_in_exceptions.PodCannotWorkError,
-                shop_check_in_exceptions.UserAlreadySwipedError)
+                shop_check_in_exceptions.UserAlreadySwipedError,
+                shop_check_in_exceptions.UserAlreadyCheckedInError)
         }
 
         self._not_actual_error_combos = {
@@ -112,39 +167,48 @@ class ErrorHandler(object):
 
         }
 
-    def _requires_no_confirmation(self, state, error):
-        return ErrorHandler._is_in_combination_dict(state,
-                                                    error,
-                                                    self._no_confirm_state_error_combos)
-
-    def _is_real_error(self, state, error, error_data):
-        is_real_error = not ErrorHandler._is_in_combination_dict(state,
-                                                        error,
-                                                        self._not_actual_error_combos)
-
-        is_empty_slot = error == event.CARD_REMOVE \
-                        and not self._shop.is_machine_in_use(error_data)
-
-        return is_real_error and not is_empty_slot
+        # Error -> actions indexed by event type, falling back to the defaults.
+        default_actions = event.make_dispatch_table(self._default_event_to_action_map,
+                                                    self._handle_unrecognized_event)
+        self._default_actions = default_actions
+        self._error_specific_actions = {}
+        for error, actions in self._error_specific_event_to_action_map.iteritems():
+            error_actions = list(default_actions)
+            for key, action in actions.iteritems():
+                error_actions[event.decode_key(key)] = action
+            self._error_specific_actions[error] = error_actions
+
+        # (state, error) pairs, where an error class also covers its subclasses.
+        self._no_confirm_pairs = ErrorHandler._state_error_pairs(self._no_confirm_state_error_combos)
+        self._not_actual_error_pairs = ErrorHandler._state_error_pairs(self._not_actual_error_combos)
+
+        # (state, error class or event key) -> ErrorPolicy. Other subclasses are added as they come up.
+        self._policies = {}
+        for state in [state for state, unused_message, unused_transitions in fsm.TRANSITION_TABLE] + [None]:
+            for error in self._messages_to_display.keys() + self._error_specific_event_to_action_map.keys():
+                self._policy(state, error)
 
     @staticmethod
-    def _is_in_combination_dict(state, error, dict):
-        if state not in dict:
-            return False
-        for no_confirm_error in dict[state]:
-            if ErrorHandler._same_error(error, no_confirm_error):
-                return True
-        return False
+    def _state_error_pairs(combination_dict):
+        return frozenset((state, error) for state, errors in combination_dict.iteritems() for error in errors)
+
+    def _policy(self, state, error):
+        policy = self._policies.get((state, error))
+        if policy is None:
+            requires_confirmation = not self._matches(state, error, self._no_confirm_pairs)
+            message = self._messages_to_display.get(error, DEFAULT_ERROR_MESSAGE if requires_confirmation
+                                                    else DEFAULT_ERROR_MESSAGE_NO_CONFIRM)
+            policy = ErrorPolicy(not self._matches(state, error, self._not_actual_error_pairs),
+                                 requires_confirmation, message,
+                                 self._error_specific_actions.get(error, self._default_actions))
+            self._policies[(state, error)] = policy
+        return policy
 
     @staticmethod
-    def _same_error(e, template_e):
-        """
-        Determines if e is an instance of error class template_e OR if e equals template_e
-        """
-        try:
-            return e == template_e or issubclass(e, template_e)
-        except:
-            return False
+    def _matches(state, error, state_error_pairs):
+        """ Whether (state, error), or (state, any of error's base classes), is one of state_error_pairs. """
+        candidates = error.__mro__ if isinstance(error, type) else (error,)
+        return any((state, candidate) in state_error_pairs for candidate in candidates)
 
     def handle_error(self, return_state, error, error_data=None):
         # winsound.PlaySound('SystemExclamation', winsound.SND_ALIAS)
@@ -153,56 +217,61 @@ class ErrorHandler(object):
 
         # print "Error handler, <State: %s, Error: %s, Data: %s>" % (return_state, error, error_data)
 
-        if not self._is_real_error(return_state, error, error_data):
-            return return_state
-
-        while True:
-
-            self._report_error(return_state, error, error_data)
+        policy = self._policy(return_state, error)
 
-            if self._requires_no_confirmation(return_state, error):
-                time.sleep(NO_CONFIRM_DELAY)
-                return return_state
-
-            next_event = self._event_q.get()
-            if next_event.key == event.TERMINATE_PROGRAM:
-                # TODO: Find better way to terminate prgm from error, currently need 2 signals
-                self._event_q.put(event.Event(event.TERMINATE_PROGRAM))
-                return return_state
-
-            action = self._get_action(error, next_event)
+        if not policy.is_real or (error == event.CARD_REMOVE and not self._shop.is_machine_in_use(error_data)):
+            return return_state
 
-            result = action(next_event.data, error_data)
+        if not policy.requires_confirmation:
+            # Shown while the FSM carries on; it goes back to the state's frame afterwards.
+            self._display.show_for(self._error_message(policy, error_data), NO_CONFIRM_DELAY)
+            return return_state
 
-            if result == ERROR_RESOLVED:
-                return return_state
+        if len(self._error_stack) >= MAX_ERROR_STACK_DEPTH:
+            top = self._error_stack[-1]
+            if top.error == error:
+                self._error_stack[-1] = ErrorFrame(top.return_state, error, policy, error_data)
+                error_data = top.error_data  # It's the replaced error that's dropped.
+            print "Dropping %s (%s): already resolving %d errors" % (error, error_data, len(self._error_stack))
+            event_logger.log_error_dropped(_error_name(error), error_data, len(self._error_stack))
+            latency_metrics.error_dropped(self._name)
+            return return_state
 
-    def _store_error_frame(self, return_state, error, error_data):
-        self._return_state = return_state
-        self._error = error
-        self._error_data = error_data
+        if not self._error_stack:
+            self._resolution_start_time = time.time()
+        self._error_stack.append(ErrorFrame(return_state, error, policy, error_data))
+        latency_metrics.error_stack_changed(len(self._error_stack), self._name)
+        return return_state
+
+    def is_resolving(self):
+        return bool(self._error_stack)
+
+    def depth(self):
+        return len(self._error_stack)
+
+    def report_error(self):
+        """ Shows the error being resolved. """
+        frame = self._error_stack[-1]
+        self._display.show(self._error_message(frame.policy, frame.error_data))
+
+    def handle_event(self, next_event):
+        """ Passes an event to the error being resolved. """
+        frame = self._error_stack[-1]
+        result = frame.policy.actions[next_event.type](next_event.data, frame.error_data)
+        if result == ERROR_RESOLVED:
+            self._error_stack.remove(frame)
+            latency_metrics.error_stack_changed(len(self._error_stack), self._name)
+            if not self._error_stack:
+                latency_metrics.error_resolved(frame.return_state, time.time() - self._resolution_start_time)
 
-    def _report_error(self, return_state, error, error_data):
-        if self._requires_no_confirmation(return_state, error):
-            error_msg = self._messages_to_display.get(error, DEFAULT_ERROR_MESSAGE_NO_CONFIRM)
-        else:
-            error_msg = self._messages_to_display.get(error, DEFAULT_ERROR_MESSAGE)
-        error_msg += str(error_data) if error_data else ""
-        self._send_message_format_safe(error_msg)
+    @staticmethod
+    def _error_message(policy, error_data):
+        if not error_data:
+            return policy.frame
+        return io_moderator.safe_format_msg(policy.message + str(error_data))
 
     def _send_message_format_safe(self, msg):
-        self._message_q.put(io_moderator.safe_format_msg(msg))
-
-    def _get_action(self, error, next_event):
-        try:
-            action = self._error_specific_event_to_action_map[error][next_event.key]
-        except KeyError:
-            try:
-                action = self._default_event_to_action_map[next_event.key]
-            except KeyError:
-                action = self._handle_unrecognized_event
-
-        return action
+        self._display.show(io_moderator.safe_format_msg(msg))
 
     def _handle_card_reinsert(self, new_slot, old_slot):
         if new_slot == old_slot:
@@ -257,3 +326,10 @@ class ErrorHandler(object):
 
     def _handle_switch_off_when_switch_was_on(self, unused_date=None, unused_error_data=None):
         return ERROR_NOT_RESOLVED if self._shop.is_open() else ERROR_RESOLVED
+
+
+def _error_name(error):
+    """ Errors are event keys or exception classes. """
+    if isinstance(error, type):
+        return error.__name__
+    return event.EVENT_CODE_TO_NAME_MAP.get(error, error)
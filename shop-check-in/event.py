@@ -1,3 +1,5 @@
+import time
+
 CARD_SWIPE = "card_swipe"
 CARD_INSERT = "M1"
 CARD_REMOVE = "M0"
@@ -29,13 +31,52 @@ EVENT_CODE_TO_NAME_MAP = {
     TERMINATE_PROGRAM : "Terminate Program Signal",
 }
 
+# Small integer codes for the keys above, so dispatch tables can be indexed by event.
+TYPE_CARD_SWIPE = 0
+TYPE_CARD_INSERT = 1
+TYPE_CARD_REMOVE = 2
+TYPE_SWITCH_FLIP_ON = 3
+TYPE_SWITCH_FLIP_OFF = 4
+TYPE_BUTTON_CANCEL = 5
+TYPE_BUTTON_CONFIRM = 6
+TYPE_BUTTON_MONEY = 7
+TYPE_BUTTON_CHANGE_POD = 8
+TYPE_BUTTON_DISCHARGE_USER = 9
+TYPE_TERMINATE_PROGRAM = 10
+TYPE_UNKNOWN = 11  # Any other key; no state handles it.
+
+EVENT_KEYS = (CARD_SWIPE, CARD_INSERT, CARD_REMOVE,
+              SWITCH_FLIP_ON, SWITCH_FLIP_OFF,
+              BUTTON_CANCEL, BUTTON_CONFIRM, BUTTON_MONEY, BUTTON_CHANGE_POD, BUTTON_DISCHARGE_USER,
+              TERMINATE_PROGRAM)
+EVENT_KEY_TO_TYPE_MAP = {key: type_ for type_, key in enumerate(EVENT_KEYS)}
+EVENT_TYPE_COUNT = TYPE_UNKNOWN + 1
+
+
+def decode_key(key):
+    """ Returns the type code for one of the string event keys, or TYPE_UNKNOWN. """
+    return EVENT_KEY_TO_TYPE_MAP.get(key, TYPE_UNKNOWN)
+
+
+def make_dispatch_table(actions_by_key, default=None):
+    """ Compiles a {key: action} dict into a list indexed by event type code. """
+    table = [default] * EVENT_TYPE_COUNT
+    for key, action in actions_by_key.iteritems():
+        table[decode_key(key)] = action
+    return table
+
+
+class Event(object):
+    __slots__ = ('key', 'type', 'data', 'timestamp', 'user_lookup')
 
-class Event():
     def __init__(self,
                  key="",
-                 data=[]):
+                 data=None):
         self.key = key
+        self.type = decode_key(key)
         self.data = data
+        self.timestamp = time.time()
+        self.user_lookup = None  # Set on card swipes whose user is being prefetched.
 
     def __repr__(self):
-        return "Key is: %s; data is %s." % (self.key, self.data)
\ No newline at end of file
+        return "Key is: %s; data is %s." % (self.key, self.data)
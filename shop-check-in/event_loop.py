@@ -0,0 +1,320 @@
+import collections
+import errno
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+import Queue as queue
+
+"""
+A single threaded, select() based event loop for running the check-in board.
+
+Python 2 has no asyncio, so this is the small subset the board needs: file
+descriptor readers (the serial port and the card reader), timers, callbacks
+scheduled from other threads, and an executor that runs blocking calls
+(database round trips, mail) on worker threads and hands their results back
+to the loop thread.
+
+The BoardFsm stays a plain blocking loop: it runs on the loop thread and its
+event queue is a LoopEventQueue, whose get() runs the loop until an event
+arrives (or a timed display frame expires; see display_scheduler).
+Everything else happens in loop callbacks, so serial input, swipes and
+display writes are all handled between two FSM steps without any locks.
+
+    loop = EventLoop()
+    event_q = LoopEventQueue(loop)
+    ...
+    board.run_fsm()  # Drives the loop until TERMINATE_PROGRAM.
+"""
+
+DEFAULT_EXECUTOR_WORKER_COUNT = 4
+WAKEUP_READ_SIZE = 4096
+
+
+class TimerHandle(object):
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self._callback = callback
+        self._args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        self._callback(*self._args)
+
+
+class Future(object):
+    """ The result of a call run on the loop's executor. Resolved on the loop thread. """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise RuntimeError("Future is not done yet")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def add_done_callback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def set_result(self, result):
+        self._result = result
+        self._set_done()
+
+    def set_error(self, error):
+        self._error = error
+        self._set_done()
+
+    def _set_done(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class EventLoop(object):
+
+    def __init__(self, executor_worker_count=DEFAULT_EXECUTOR_WORKER_COUNT, clock=time.time):
+        self._clock = clock
+        self._readers = {}  # File descriptor -> callback
+        self._timers = []  # Heap of (when, tie breaker, TimerHandle)
+        self._timer_counter = itertools.count()
+        self._ready = collections.deque()
+        self._running_callbacks = False
+        self._running_thread = None
+
+        self._wakeup_read_fd, self._wakeup_write_fd = os.pipe()
+        import fcntl
+        for fd in (self._wakeup_read_fd, self._wakeup_write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._executor_q = queue.Queue()
+        for ignored in xrange(executor_worker_count):
+            worker = threading.Thread(target=self._run_executor_jobs)
+            worker.daemon = True
+            worker.start()
+
+    def time(self):
+        return self._clock()
+
+    def is_loop_thread(self):
+        """ Whether the calling thread is the one running the loop right now. """
+        return threading.current_thread() is self._running_thread
+
+    def add_reader(self, fd, callback):
+        """ Calls callback() on the loop thread whenever fd is readable. """
+        self._readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def call_soon(self, callback, *args):
+        """ Schedules callback(*args) for the next loop iteration. Only call from the loop thread. """
+        self._ready.append((callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        self._ready.append((callback, args))
+        try:
+            os.write(self._wakeup_write_fd, '\0')
+        except OSError as error:
+            if error.errno != errno.EAGAIN:  # Pipe full means a wake-up is already pending.
+                raise
+
+    def call_later(self, delay, callback, *args):
+        timer = TimerHandle(self._clock() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._timer_counter), timer))
+        return timer
+
+    def run_in_executor(self, function, *args):
+        """ Runs function(*args) on a worker thread; returns a Future resolved on the loop thread. """
+        future = Future()
+        self._executor_q.put((future, function, args))
+        return future
+
+    def run_until(self, predicate, timeout=None):
+        """ Runs the loop until predicate() is true. Returns False if timeout seconds pass first. """
+        if self._running_callbacks:
+            raise RuntimeError("run_until() can't be called from a loop callback")
+        deadline = None if timeout is None else self._clock() + timeout
+        previous_running_thread, self._running_thread = self._running_thread, threading.current_thread()
+        try:
+            while not predicate():
+                if deadline is None:
+                    self.run_once()
+                else:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        return False
+                    self.run_once(remaining)
+            return True
+        finally:
+            self._running_thread = previous_running_thread
+
+    def wait_for(self, future, timeout=None):
+        """ Runs the loop until future is done and returns its result. """
+        if not self.run_until(future.done, timeout):
+            raise queue.Empty
+        return future.result()
+
+    def sleep(self, seconds):
+        """ A time.sleep() that keeps handling I/O and timers while it waits. """
+        self.run_until(lambda: False, seconds)
+
+    def run_once(self, timeout=None):
+        """ Waits up to timeout seconds for I/O or a timer, then runs every callback that is due. """
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            until_next_timer = max(0, self._timers[0][0] - self._clock())
+            timeout = until_next_timer if timeout is None else min(timeout, until_next_timer)
+
+        readable = self._select(timeout)
+
+        self._running_callbacks = True
+        try:
+            for fd in readable:
+                if fd == self._wakeup_read_fd:
+                    self._clear_wakeups()
+                elif fd in self._readers:
+                    self._readers[fd]()
+
+            now = self._clock()
+            while self._timers and self._timers[0][0] <= now:
+                unused_when, unused_counter, timer = heapq.heappop(self._timers)
+                if not timer.cancelled:
+                    self._ready.append((timer.run, ()))
+
+            for ignored in xrange(len(self._ready)):  # Callbacks scheduled by these run next time.
+                callback, args = self._ready.popleft()
+                callback(*args)
+        finally:
+            self._running_callbacks = False
+
+    def _select(self, timeout):
+        fds = [self._wakeup_read_fd] + list(self._readers)
+        try:
+            readable, unused_writable, unused_exceptional = select.select(fds, [], [], timeout)
+        except select.error as error:
+            if error.args[0] != errno.EINTR:
+                raise
+            return []
+        return readable
+
+    def _clear_wakeups(self):
+        try:
+            while os.read(self._wakeup_read_fd, WAKEUP_READ_SIZE):
+                pass
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def _run_executor_jobs(self):
+        while True:
+            future, function, args = self._executor_q.get()
+            try:
+                result = function(*args)
+            except Exception as error:
+                self.call_soon_threadsafe(future.set_error, error)
+            else:
+                self.call_soon_threadsafe(future.set_result, result)
+
+
+class LoopEventQueue(object):
+    """ The FSM's event queue on an EventLoop: get() runs the loop until an event is put.
+
+        put() may be called from any thread.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._events = collections.deque()
+
+    def put(self, item, block=True, timeout=None):
+        if self._loop.is_loop_thread():
+            self._events.append(item)
+        else:
+            self._loop.call_soon_threadsafe(self._events.append, item)
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def get(self, block=True, timeout=None):
+        if not block:
+            timeout = 0
+        if not self._events and not self._loop.run_until(lambda: self._events, timeout):
+            raise queue.Empty
+        return self._events.popleft()
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return len(self._events)
+
+    def empty(self):
+        return not self._events
+
+
+class LoopMessageQueue(queue.Queue):
+    """ A display message queue whose consumer is called on the loop once messages are waiting.
+
+        The consumer is expected to drain the queue, so one call per empty ->
+        non-empty transition is enough.
+    """
+
+    def __init__(self, loop, maxsize=0):
+        queue.Queue.__init__(self, maxsize)
+        self._loop = loop
+        self._consumer = None
+
+    def set_consumer(self, consumer):
+        self._consumer = consumer
+        if self.qsize():
+            self._loop.call_soon_threadsafe(consumer)
+
+    def _put(self, item):
+        queue.Queue._put(self, item)
+        if self._consumer is not None and self._qsize() == 1:
+            self._loop.call_soon_threadsafe(self._consumer)
+
+
+class ExecutorProxy(object):
+    """ Forwards method calls to target, running them on the loop's executor.
+
+        With wait, each call runs the loop until the executor is done and
+        returns the result (or raises the error), so it blocks its caller but
+        not the loop. Without, calls are fire and forget.
+    """
+
+    def __init__(self, loop, target, wait=True):
+        self._loop = loop
+        self._target = target
+        self._wait = wait
+
+    def __getattr__(self, name):
+        method = getattr(self._target, name)
+        if not callable(method):
+            return method
+
+        def call_in_executor(*args):
+            future = self._loop.run_in_executor(method, *args)
+            return self._loop.wait_for(future) if self._wait else None
+
+        return call_in_executor
+
@@ -1,21 +1,19 @@
 import Queue as queue
-import threading
-import sys
+import os
 import time
 
-import winsound
-
+import audio
+import display_scheduler
 import error_handler
 import event
 import shop
 import shop_user
 import shop_user_database
 import io_moderator
+import latency_metrics
 import shop_check_in_exceptions
 import logger.all_events as event_logger
 
-MESSAGE = 0
-ACTIONS_DICT = 1
 
 CLOSED = "closed"
 OPENING = "opening"
@@ -33,6 +31,56 @@ NOISE_SUCCESS = "resources\\sounds\\success_ding.wav"
 NOISE_ERROR = "resources\\sounds\\error_buzz.wav"
 NOISE_CLEARING_DEBT = "resources\\sounds\\cha_ching.wav"
 NOISE_CHARGING_USER = "resources\\sounds\\sad_trombone.wav"
+CHARGED_USER_DISPLAY_SECONDS = 1
+
+NOISES = (NOISE_OPENING, NOISE_CLOSING, NOISE_SUCCESS, NOISE_ERROR, NOISE_CLEARING_DEBT, NOISE_CHARGING_USER)
+SOUND_DIRECTORY = os.path.dirname(os.path.abspath(__file__))  # NOISE_* paths are relative to this.
+
+INITIAL_STATE = CLOSED
+
+# (state, message, ((event key, handler, states the handler can go to besides staying put), ...)).
+# Events a state has no handler for go to the ErrorHandler.
+TRANSITION_TABLE = (
+    (CLOSED, "\0SHOP CLOSED.\n\rPROCTOR SWIPE",
+     ((event.CARD_SWIPE, '_closed_process_card_swipe', (OPENING,)),)),
+
+    (OPENING, "\0STARTING UP!\n\rFLIP SWITCH",
+     ((event.BUTTON_CANCEL, '_go_to_closed_state', (CLOSED,)),
+      (event.SWITCH_FLIP_ON, '_opening_process_switch_flip', (STANDBY,)))),
+
+    (STANDBY, "\0BOARD LOCKED.\n\rPOD SWIPE",
+     ((event.CARD_SWIPE, '_standby_process_card_swipe', (UNLOCKED,)),)),
+
+    (UNLOCKED, "\0BOARD UNLOCKED.\n\rTAKE ANY ACTION",
+     ((event.BUTTON_CANCEL, '_go_to_standby_state', (STANDBY,)),
+      (event.CARD_SWIPE, '_unlocked_process_card_swipe', (ADDING_USER,)),
+      (event.CARD_REMOVE, '_go_to_remove_user_state', (REMOVING_USER,)),
+      (event.BUTTON_MONEY, '_go_to_clear_money_state', (CLEARING_DEBT,)),
+      (event.BUTTON_CHANGE_POD, '_go_to_change_pod_state', (CHANGING_POD,)),
+      (event.SWITCH_FLIP_OFF, '_unlocked_process_closing_shop', (CLOSED,)))),
+
+    (ADDING_USER, "\0ADDING USER.\n\rSWIPE/INSRT CARD",
+     ((event.CARD_SWIPE, '_adding_user_process_card_swipe', (ADDING_USERS,)),
+      (event.CARD_INSERT, '_adding_user_s_process_slot', (STANDBY,)),
+      (event.BUTTON_CANCEL, '_go_to_standby_state', (STANDBY,)))),
+
+    (ADDING_USERS, "\0ADDING USERS.\n\rINSERT CARDS",
+     ((event.CARD_INSERT, '_adding_user_s_process_slot', (STANDBY,)),
+      (event.BUTTON_CANCEL, '_go_to_standby_state', (STANDBY,)))),
+
+    (REMOVING_USER, "\0REMOVING USER_S\n\r(R)NSRT/CLR/CHRG",
+     ((event.CARD_INSERT, '_removing_user_process_slot', (STANDBY,)),
+      (event.BUTTON_DISCHARGE_USER, '_removing_user_process_discharge', (STANDBY,)),
+      (event.BUTTON_MONEY, '_removing_user_process_charge', ()))),
+
+    (CLEARING_DEBT, "\0CLEARING DEBT.\n\rSWIPE CARD",
+     ((event.CARD_SWIPE, '_clearing_debt_process_card_swipe', (STANDBY,)),
+      (event.BUTTON_CANCEL, '_go_to_standby_state', (STANDBY,)))),
+
+    (CHANGING_POD, "\0CHANGING POD.\n\rSWIPE CARD",
+     ((event.CARD_SWIPE, '_changing_pod_process_card_swipe', (STANDBY,)),
+      (event.BUTTON_CANCEL, '_go_to_standby_state', (STANDBY,)))),
+)
 
 # TODO: any clean way to avoid unused function parameters?
 
@@ -40,7 +88,7 @@ NOISE_CHARGING_USER = "resources\\sounds\\sad_trombone.wav"
 def _process_card_swipe(function_to_decorate):
         def card_swipe_processor(self, id_number, cargo):
             try:
-                user = self._shop_user_database.get_shop_user(id_number)
+                user = self._get_shop_user(id_number)
             except shop_check_in_exceptions.NonexistentUserError as error:
                 return self._error_handler.handle_error(self._state, error), cargo
             else:
@@ -51,89 +99,134 @@ def _process_card_swipe(function_to_decorate):
 
 class BoardFsm(object):
 
-    def __init__(self, event_q, message_q, shop_user_db):
-        self._state = CLOSED
-        self._shop = shop.Shop()
+    def __init__(self, event_q, message_q, shop_user_db, mailer=None, audio_worker=None, display=None,
+                 journal=None, shop_=None, name=None):
+        """ With a state_journal.StateJournal, the FSM starts where the last one recorded there left off,
+            and records every change of state there.
+
+            shop_ is the Shop the board looks after (by default all of it), and
+            name tells the boards of a multi-station shop apart in metrics.
+        """
+        self._state = INITIAL_STATE
+        self._cargo = None  # run_fsm's initial cargo
+        self._shop = shop_ if shop_ is not None else shop.Shop()
         self._shop_user_database = shop_user_db
         self._event_q = event_q
         self._message_q = message_q
-        self._error_handler = error_handler.ErrorHandler(event_q, message_q, self._shop, shop_user_db)
-
-        self._state_data = {
-            CLOSED: ("\0SHOP CLOSED.\n\rPROCTOR SWIPE",
-                     {event.CARD_SWIPE: self._closed_process_card_swipe}),
-
-            OPENING: ("\0STARTING UP!\n\rFLIP SWITCH",
-                      {event.BUTTON_CANCEL: self._go_to_closed_state,
-                       event.SWITCH_FLIP_ON: self._opening_process_switch_flip}),
-
-            STANDBY: ("\0BOARD LOCKED.\n\rPOD SWIPE",
-                      {event.CARD_SWIPE: self._standby_process_card_swipe}),
-
-            UNLOCKED: ("\0BOARD UNLOCKED.\n\rTAKE ANY ACTION",
-                       {event.BUTTON_CANCEL: self._go_to_standby_state,
-                        event.CARD_SWIPE: self._unlocked_process_card_swipe,
-                        event.CARD_REMOVE: self._go_to_remove_user_state,
-                        event.BUTTON_MONEY: self._go_to_clear_money_state,
-                        event.BUTTON_CHANGE_POD: self._go_to_change_pod_state,
-                        event.SWITCH_FLIP_OFF: self._unlocked_process_closing_shop}),
-
-            ADDING_USER: ("\0ADDING USER.\n\rSWIPE/INSRT CARD",
-                          {event.CARD_SWIPE: self._adding_user_process_card_swipe,
-                           event.CARD_INSERT: self._adding_user_s_process_slot,
-                           event.BUTTON_CANCEL: self._go_to_standby_state}),
-
-            ADDING_USERS: ("\0ADDING USERS.\n\rINSERT CARDS",
-                           {event.CARD_INSERT: self._adding_user_s_process_slot,
-                            event.BUTTON_CANCEL: self._go_to_standby_state}),
-
-            REMOVING_USER: ("\0REMOVING USER_S\n\r(R)NSRT/CLR/CHRG",
-                            {event.CARD_INSERT: self._removing_user_process_slot,
-                             event.BUTTON_DISCHARGE_USER: self._removing_user_process_discharge,
-                             event.BUTTON_MONEY: self._removing_user_process_charge}),
-
-            CLEARING_DEBT: ("\0CLEARING DEBT.\n\rSWIPE CARD",
-                            {event.CARD_SWIPE: self._clearing_debt_process_card_swipe,
-                             event.BUTTON_CANCEL: self._go_to_standby_state}),
-
-            CHANGING_POD: ("\0CHANGING POD.\n\rSWIPE CARD",
-                           {event.CARD_SWIPE: self._changing_pod_process_card_swipe,
-                            event.BUTTON_CANCEL: self._go_to_standby_state})
-            }
+        self._last_event = None
+        self._display = display if display is not None else display_scheduler.DisplayScheduler(message_q)
+        self._audio = audio_worker if audio_worker is not None else audio.default_worker(NOISES, SOUND_DIRECTORY)
+        queue_name_prefix = "%s " % name if name is not None else ""
+        latency_metrics.watch_queue(queue_name_prefix + 'event_q', event_q)
+        latency_metrics.watch_queue(queue_name_prefix + 'message_q', message_q)
+        self._error_handler = error_handler.ErrorHandler(event_q, message_q, self._shop, shop_user_db, mailer,
+                                                         self._display, name)
+
+        # State -> (frame, actions indexed by event type), bound to this FSM.
+        self._compiled_states = {}
+        for state, (frame, handler_names) in _COMPILED_TRANSITIONS.iteritems():
+            actions = [self._handle_unexpected_event if handler_name is None else getattr(self, handler_name)
+                       for handler_name in handler_names]
+            self._compiled_states[state] = (frame, actions)
+
+        self._journal = journal
+        self._recorded = None  # (state, shop version, cargo) last recorded in the journal
+        if journal is not None:
+            self._restore(journal.load())
 
     def run_fsm(self):
 
-        cargo = None
+        cargo = self._cargo
         
         while True:
-            state_message = self._state_data[self._state][MESSAGE]
-            state_actions = self._state_data[self._state][ACTIONS_DICT]
+            state_frame, state_actions = self._compiled_states[self._state]
 
-            self._send_message(state_message)
+            if self._error_handler.is_resolving():
+                self._error_handler.report_error()
+            elif not self._display.is_showing():
+                self._send_frame(state_frame)
             
             next_event = self._get_event()
 
-            if next_event.key == event.TERMINATE_PROGRAM:
+            if next_event.type == event.TYPE_TERMINATE_PROGRAM:
                 return self._state
             
-            try:
-                self._state, cargo = state_actions[next_event.key](next_event.data, cargo)
-            except KeyError:
-                self._state = self._error_handler.handle_error(self._state, next_event.key, next_event.data)
-
+            handling_state = self._state
+            if self._error_handler.is_resolving():
+                self._error_handler.handle_event(next_event)  # The state carries on once it's resolved.
+            else:
+                self._state, cargo = state_actions[next_event.type](next_event.data, cargo)
+            latency_metrics.event_handled(next_event, handling_state, time.time())
+            self._record_state(cargo)
+
+
+    def _record_state(self, cargo):
+        if self._journal is None:
+            return
+        recorded = (self._state, self._shop.version(), cargo)
+        if recorded == self._recorded:
+            return
+        self._journal.record({'state': self._state, 'cargo': cargo, 'shop': self._shop.get_state()})
+        self._recorded = recorded
+
+    def _restore(self, snapshot):
+        if snapshot is None or snapshot['state'] not in self._compiled_states:
+            return
+        self._shop.set_state(snapshot['shop'], self._current_user)
+        self._state = snapshot['state']
+        cargo = snapshot['cargo']
+        if isinstance(cargo, shop_user.ShopUser):
+            cargo = self._current_user(cargo)
+        elif isinstance(cargo, list):
+            cargo = [self._current_user(user) for user in cargo]
+        self._cargo = cargo
+        print "Restored the board: %s, shop %s" % (self._state, "open" if self._shop.is_open() else "closed")
+
+    def _current_user(self, user):
+        """ The database's copy of a restored user, whose debt may have changed since. """
+        try:
+            return self._shop_user_database.get_shop_user(user.id_number)
+        except shop_check_in_exceptions.NonexistentUserError:
+            return user
 
     def _send_message_format_safe(self, msg):
-        self._message_q.put(io_moderator.safe_format_msg(msg))
+        self._display.show(io_moderator.safe_format_msg(msg))
 
     def _get_event(self):
-        next_event = self._event_q.get()
+        while True:
+            try:
+                next_event = self._event_q.get(timeout=self._display.time_until_next())
+            except queue.Empty:
+                # A timed frame is due to expire.
+                self._display.tick()
+                if not self._display.is_showing():
+                    if self._error_handler.is_resolving():
+                        self._error_handler.report_error()
+                    else:
+                        self._send_frame(self._compiled_states[self._state][0])
+            else:
+                break
+        self._display.cancel()  # The board responds to the event instead.
+        latency_metrics.event_dequeued(next_event, time.time(), self._message_q)
 
         event_logger.log_event_dequeue(next_event)
+        self._last_event = next_event
         return next_event
 
-    def _send_message(self, message):
-        event_logger.log_send_message(message)
-        self._send_message_format_safe(message)
+    def _get_shop_user(self, id_number):
+        # Swipes usually arrive with the user already looked up by the IdLogger.
+        lookup = self._last_event.user_lookup if self._last_event is not None else None
+        if lookup is not None and lookup.id_number == id_number:
+            return lookup.get_shop_user()
+        return self._shop_user_database.get_shop_user(id_number)
+
+    def _send_frame(self, frame):
+        """ Shows a frame that is already safe_format_msg formatted. """
+        event_logger.log_send_message(frame)
+        self._display.show(frame)
+
+    def _handle_unexpected_event(self, event_data, cargo):
+        return self._error_handler.handle_error(self._state, self._last_event.key, event_data), cargo
 
     def _go_to_closed_state(self, ignored_event_data, ignored_cargo):
         self._play_noise(NOISE_CLOSING)
@@ -196,6 +289,10 @@ class BoardFsm(object):
             if self._shop.is_pod(user):
                 return self._error_handler.handle_error(self._state,
                                                         shop_check_in_exceptions.PodCannotWorkError), ignored_cargo
+            if self._shop.slot_of(user) is not None:
+                self._play_noise(NOISE_ERROR)
+                error = shop_check_in_exceptions.UserAlreadyCheckedInError
+                return self._error_handler.handle_error(self._state, error), ignored_cargo
             self._play_noise(NOISE_SUCCESS)
             return ADDING_USER, [user]
 
@@ -226,6 +323,10 @@ class BoardFsm(object):
             if first_user[0] == second_user:
                 return self._error_handler.handle_error(self._state,
                                                         shop_check_in_exceptions.UserAlreadySwipedError), first_user
+            if self._shop.slot_of(second_user) is not None:
+                self._play_noise(NOISE_ERROR)
+                error = shop_check_in_exceptions.UserAlreadyCheckedInError
+                return self._error_handler.handle_error(self._state, error), first_user
             self._play_noise(NOISE_SUCCESS)
             return ADDING_USERS, first_user + [second_user]
 
@@ -248,12 +349,13 @@ class BoardFsm(object):
         user_s = self._shop.get_user_s(slot)
 
         for user in user_s:
-            self._send_message_format_safe("\0CHARGING USER:\n\r%s" % user.name)
+            if not self._display.is_showing():  # Otherwise the last user charged is still being shown.
+                self._send_message_format_safe("\0CHARGING USER:\n\r%s" % user.name)
             self._shop_user_database.increase_debt(user)
 
             self._play_noise(NOISE_CHARGING_USER)
-            self._send_message_format_safe("\0USER CHARGED:\n\r%s" % user.name[:16])
-            time.sleep(1)
+            self._display.show_for(io_moderator.safe_format_msg("\0USER CHARGED:\n\r%s" % user.name[:16]),
+                                   CHARGED_USER_DISPLAY_SECONDS)
 
         return REMOVING_USER, slot
 
@@ -282,6 +384,55 @@ class BoardFsm(object):
 
 
     def _play_noise(self, noise):
-        thread_play_noise = threading.Thread(target=winsound.PlaySound, args=(noise, winsound.SND_FILENAME))
-        thread_play_noise.daemon = True
-        thread_play_noise.start()
+        self._audio.play(noise)
+
+
+def compile_transition_table(transition_table, fsm_class, initial_state=INITIAL_STATE):
+    """ Checks a transition table and compiles it to {state: (frame, handler names indexed by event type)}.
+
+        Each frame is safe_format_msg formatted, and event types a state has
+        no handler for map to None. Raises TransitionTableError for unknown
+        events or handlers, transitions to undefined states and states that
+        can't be reached from initial_state.
+    """
+    compiled = {}
+    next_states = {}
+    for state, message, transitions in transition_table:
+        if state in compiled:
+            raise shop_check_in_exceptions.TransitionTableError("State %s is defined twice" % state)
+        handler_names = [None] * event.EVENT_TYPE_COUNT
+        next_states[state] = set()
+        for event_key, handler_name, transition_states in transitions:
+            event_type = event.decode_key(event_key)
+            if event_type == event.TYPE_UNKNOWN:
+                raise shop_check_in_exceptions.TransitionTableError("State %s handles unknown event %r"
+                                                                    % (state, event_key))
+            if not callable(getattr(fsm_class, handler_name, None)):
+                raise shop_check_in_exceptions.TransitionTableError("State %s has no handler %s for %s"
+                                                                    % (state, handler_name, event_key))
+            handler_names[event_type] = handler_name
+            next_states[state].update(transition_states)
+        compiled[state] = (io_moderator.safe_format_msg(message), handler_names)
+
+    for state, transition_states in next_states.iteritems():
+        for next_state in transition_states - set(compiled):
+            raise shop_check_in_exceptions.TransitionTableError("State %s goes to undefined state %s"
+                                                                % (state, next_state))
+    if initial_state not in compiled:
+        raise shop_check_in_exceptions.TransitionTableError("Initial state %s is not defined" % initial_state)
+
+    reachable = set()
+    unvisited = [initial_state]
+    while unvisited:
+        state = unvisited.pop()
+        if state not in reachable:
+            reachable.add(state)
+            unvisited.extend(next_states[state])
+    unreachable = set(compiled) - reachable
+    if unreachable:
+        raise shop_check_in_exceptions.TransitionTableError("Unreachable states: %s" % ", ".join(sorted(unreachable)))
+
+    return compiled
+
+
+_COMPILED_TRANSITIONS = compile_transition_table(TRANSITION_TABLE, BoardFsm)
@@ -1,64 +1,96 @@
-import re  # Regular expressions
+import argparse
 import threading
 import Queue as queue
-import collections
-
-import pyHook  # Callbacks for keyboard events
-import pythoncom  # Tie in to Windows events
 
 import event
+import id_logger_backends
+import swipe_parser
 
 import logger.all_events as event_logger
 
-ID_READ_LENGTH = 12
-ID_REGEX = ";[0-9]{10}\x00"
-
 
 class IdLogger(threading.Thread):
     """ Listens to keyboard input and reports any properly formatted
         IDs that it finds.
 
         Input is done by swiping a ID card (or otherwise inputting a
-        valid sequence). 
+        valid sequence). Keystrokes come from a backend, which defaults
+        to the Windows keyboard hook.
 
-        Output is done by spawning a shop user database lookup.
+        Output is done by spawning a shop user database lookup, when a
+        lookup pool is given, and queueing a card swipe event that
+        carries it.
     """
 
-    def __init__(self, event_q):
+    def __init__(self, event_q, backend=None, user_lookup_pool=None):
         super(IdLogger, self).__init__()
 
         self._event_q = event_q
-        self._id_buffer = collections.deque(maxlen=ID_READ_LENGTH)
-        
+        self._backend = backend if backend is not None else id_logger_backends.PyHookBackend()
+        self._user_lookup_pool = user_lookup_pool
+        self._swipe_parser = swipe_parser.SwipeParser()
+
     def run(self):
-        hook_manager = pyHook.HookManager()
-        hook_manager.KeyDown = self._on_keyboard_event
-        hook_manager.HookKeyboard()
-        pythoncom.PumpMessages()
+        self._backend.run(self._on_character)
 
-    def _on_keyboard_event(self, event_data):
-        buffer_as_string = self._update_buffer(chr(event_data.Ascii))
+    def attach(self, loop):
+        """ Runs the IdLogger on an event_loop.EventLoop, or on its own thread if the backend can't be. """
+        if hasattr(self._backend, 'attach'):
+            self._backend.attach(loop, self._on_character)
+        else:
+            self.daemon = True
+            self.start()
 
-        search_result = re.search(ID_REGEX, buffer_as_string)
+    def parse_stats(self):
+        return self._swipe_parser.stats()
 
-        if search_result is not None:
-            id_number = search_result.group()[2:-2]
+    def _on_character(self, char):
+        id_number = self._swipe_parser.feed(char)
 
+        if id_number is not None:
             new_event = event.Event(event.CARD_SWIPE, id_number)
+            if self._user_lookup_pool is not None:
+                new_event.user_lookup = self._user_lookup_pool.submit(id_number)
             event_logger.log_event_enqueue(new_event)
             self._event_q.put(new_event)
 
-        return True  # Need to return true or HookManager will throw a fit.
 
-    def _update_buffer(self, char):
-        self._id_buffer.append(char)
+BACKENDS = ('pyhook', 'evdev', 'tty', 'stdin', 'replay')
 
-        return ''.join(self._id_buffer)
+
+def make_backend(backend, path=None, speed=1.0):
+    """ The backend called backend (one of BACKENDS), reading from path. """
+    if backend == 'evdev':
+        return id_logger_backends.EvdevBackend(path)
+    elif backend == 'tty':
+        return id_logger_backends.TtyBackend(path)
+    elif backend == 'stdin':
+        return id_logger_backends.StreamBackend()
+    elif backend == 'replay':
+        return id_logger_backends.ReplayBackend.from_file(path, speed)
+    else:
+        return id_logger_backends.PyHookBackend()
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Print the IDs swiped on the card reader.')
+    parser.add_argument('backend', nargs='?', default='pyhook',
+                        choices=BACKENDS)
+    parser.add_argument('path', nargs='?', help='Input device, terminal or keystroke recording.')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier; 0 for no delays.')
+    args = parser.parse_args()
+
     event_q = queue.Queue()
-    IdLogger(event_q).run()
+    id_logger = IdLogger(event_q, make_backend(args.backend, args.path, args.speed))
+    id_logger.daemon = True
+    id_logger.start()
+
+    while id_logger.is_alive() or not event_q.empty():
+        try:
+            print event_q.get(timeout=0.5)
+        except queue.Empty:
+            pass
+    print id_logger.parse_stats()
 
 
 if __name__ == "__main__":
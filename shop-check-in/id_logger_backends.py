@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+
+"""
+Input backends for the IdLogger.
+
+Each backend turns some source of keystrokes into single characters and hands
+them to the on_character callback passed to run(). run() blocks for as long as
+the source produces input, so it is meant to be called from the IdLogger thread.
+Backends that can be driven by an event_loop.EventLoop also have attach(),
+which registers them with the loop and returns immediately.
+
+    - PyHookBackend: Windows global keyboard hook (the original input path).
+    - EvdevBackend: a Linux input device, e.g. /dev/input/by-id/...-kbd.
+    - TtyBackend: a raw-mode serial or virtual terminal, e.g. /dev/ttyUSB0.
+    - StreamBackend: any readable file descriptor, e.g. stdin or a pty.
+    - ReplayBackend: a recorded keystroke stream, played back at N times speed.
+"""
+
+NO_ASCII = '\x00'  # What pyHook reports for keys with no ASCII value.
+READ_SIZE = 1024
+REPLAY_AS_FAST_AS_POSSIBLE = None
+
+
+class IdLoggerBackend(object):
+
+    def run(self, on_character):
+        raise NotImplementedError
+
+
+class PyHookBackend(IdLoggerBackend):
+
+    def run(self, on_character):
+        import pyHook  # Callbacks for keyboard events
+        import pythoncom  # Tie in to Windows events
+
+        def on_keyboard_event(event_data):
+            on_character(chr(event_data.Ascii))
+            return True  # Need to return true or HookManager will throw a fit.
+
+        hook_manager = pyHook.HookManager()
+        hook_manager.KeyDown = on_keyboard_event
+        hook_manager.HookKeyboard()
+        pythoncom.PumpMessages()
+
+
+class EvdevBackend(IdLoggerBackend):
+    """ Reads key presses from a Linux input device.
+
+        Keys without an ASCII equivalent are reported as NUL, the same as
+        pyHook does, so the card reader's terminator decodes identically.
+    """
+
+    def __init__(self, device_path, grab=True):
+        self._device_path = device_path
+        self._grab = grab
+
+    def run(self, on_character):
+        import evdev
+
+        key_to_char = EvdevBackend._key_to_char_map(evdev.ecodes)
+        device = evdev.InputDevice(self._device_path)
+        if self._grab:
+            device.grab()  # Keep swipes from being typed into other programs.
+        try:
+            for input_event in device.read_loop():
+                if input_event.type == evdev.ecodes.EV_KEY and input_event.value == 1:  # Key down
+                    on_character(key_to_char.get(input_event.code, NO_ASCII))
+        finally:
+            if self._grab:
+                device.ungrab()
+
+    @staticmethod
+    def _key_to_char_map(ecodes):
+        key_to_char = {ecodes.KEY_SEMICOLON: ';',
+                       ecodes.KEY_SPACE: ' ',
+                       ecodes.KEY_ENTER: '\r'}
+        for digit in '0123456789':
+            key_to_char[ecodes.ecodes['KEY_' + digit]] = digit
+            key_to_char[ecodes.ecodes['KEY_KP' + digit]] = digit
+        for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+            key_to_char[ecodes.ecodes['KEY_' + letter]] = letter.lower()
+        return key_to_char
+
+
+class StreamBackend(IdLoggerBackend):
+    """ Reads characters from a file descriptor, putting it in raw mode if it is a terminal. """
+
+    def __init__(self, stream=None):
+        self._stream = stream if stream is not None else sys.stdin
+
+    def fileno(self):
+        return self._stream.fileno()
+
+    def run(self, on_character):
+        fd = self.fileno()
+        saved_attributes = StreamBackend._set_raw(fd)
+        try:
+            while True:
+                data = os.read(fd, READ_SIZE)
+                if not data:
+                    return
+                for char in data:
+                    on_character(char)
+        finally:
+            StreamBackend._restore(fd, saved_attributes)
+
+    def attach(self, loop, on_character):
+        fd = self.fileno()
+        saved_attributes = StreamBackend._set_raw(fd)
+
+        def read_characters():
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                loop.remove_reader(fd)
+                StreamBackend._restore(fd, saved_attributes)
+            for char in data:
+                on_character(char)
+
+        loop.add_reader(fd, read_characters)
+
+    @staticmethod
+    def _set_raw(fd):
+        if not os.isatty(fd):
+            return None
+        import termios
+        import tty
+        saved_attributes = termios.tcgetattr(fd)
+        tty.setraw(fd)
+        return saved_attributes
+
+    @staticmethod
+    def _restore(fd, saved_attributes):
+        if saved_attributes is not None:
+            import termios
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved_attributes)
+
+
+class TtyBackend(StreamBackend):
+
+    def __init__(self, device_path):
+        super(TtyBackend, self).__init__(os.fdopen(os.open(device_path, os.O_RDONLY | os.O_NOCTTY), 'rb', 0))
+
+
+class ReplayBackend(IdLoggerBackend):
+    """ Plays back (seconds, character) keystrokes, speed times faster than they were recorded.
+
+        With a speed of REPLAY_AS_FAST_AS_POSSIBLE there is no delay between keystrokes.
+    """
+
+    def __init__(self, keystrokes, speed=1.0, sleep=time.sleep):
+        self._keystrokes = keystrokes
+        self._speed = speed
+        self._sleep = sleep
+
+    @staticmethod
+    def from_file(recording_path, speed=1.0):
+        return ReplayBackend(load_keystroke_recording(recording_path), speed)
+
+    @staticmethod
+    def from_string(chars):
+        return ReplayBackend([(0.0, char) for char in chars], REPLAY_AS_FAST_AS_POSSIBLE)
+
+    def run(self, on_character):
+        previous_seconds = None
+        for seconds, char in self._keystrokes:
+            if self._speed and previous_seconds is not None and seconds > previous_seconds:
+                self._sleep((seconds - previous_seconds) / self._speed)
+            previous_seconds = seconds
+            on_character(char)
+
+    def attach(self, loop, on_character):
+        delay = 0.0
+        previous_seconds = None
+        for seconds, char in self._keystrokes:
+            if self._speed and previous_seconds is not None and seconds > previous_seconds:
+                delay += (seconds - previous_seconds) / self._speed
+            previous_seconds = seconds
+            loop.call_later(delay, on_character, char)  # Equal delays run in the order they were scheduled.
+
+
+class RecordingBackend(IdLoggerBackend):
+    """ Passes keystrokes through from another backend while recording them for the ReplayBackend. """
+
+    def __init__(self, backend, recording_path, clock=time.time):
+        self._backend = backend
+        self._recording_path = recording_path
+        self._clock = clock
+
+    def run(self, on_character):
+        start_time = self._clock()
+        with open(self._recording_path, 'w') as recording:
+            def record_character(char):
+                recording.write('%.6f %d\n' % (self._clock() - start_time, ord(char)))
+                recording.flush()
+                on_character(char)
+
+            self._backend.run(record_character)
+
+
+def load_keystroke_recording(recording_path):
+    """ Each line of a recording is '<seconds since start> <ASCII code>'. """
+    keystrokes = []
+    with open(recording_path, 'r') as recording:
+        for line in recording:
+            if line.strip():
+                seconds, code = line.split()
+                keystrokes.append((float(seconds), chr(int(code))))
+    return keystrokes
@@ -1,9 +1,17 @@
+import errno
+import os
+import select
 import threading
+import time
 import Queue
 
 import serial
 
+import board_protocol
+import display_frames
 import event
+import latency_metrics
+import slots
 
 COM_PORT = 'COM4'
 import logger.all_events as event_logger
@@ -15,40 +23,198 @@ EVENT_KEY_START_INDEX = 0
 EVENT_KEY_END_INDEX = 2
 EVENT_DATA_START_INDEX = EVENT_KEY_END_INDEX
 
+BOARD_EVENT_KEYS = frozenset([event.CARD_INSERT, event.CARD_REMOVE,
+                              event.SWITCH_FLIP_ON, event.SWITCH_FLIP_OFF,
+                              event.BUTTON_CANCEL, event.BUTTON_CONFIRM, event.BUTTON_MONEY,
+                              event.BUTTON_CHANGE_POD, event.BUTTON_DISCHARGE_USER])
+SLOT_EVENT_KEYS = frozenset([event.CARD_INSERT, event.CARD_REMOVE])
+
+WAKEUP_READ_SIZE = 4096
+
+
+class MessageQueue(Queue.Queue):
+    """ A display message queue that an IoModerator can select() on.
+
+        Putting a message into an empty queue makes fileno() readable, so the
+        IoModerator can sleep until there is either a message or serial input.
+        Wake-ups are only available where pipes can be selected (not Windows).
+    """
+
+    def __init__(self, maxsize=0):
+        Queue.Queue.__init__(self, maxsize)
+        self._wakeup_read_fd = None
+        self._wakeup_write_fd = None
+        if os.name == 'posix':
+            import fcntl
+            self._wakeup_read_fd, self._wakeup_write_fd = os.pipe()
+            for fd in (self._wakeup_read_fd, self._wakeup_write_fd):
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def supports_wakeup(self):
+        return self._wakeup_read_fd is not None
+
+    def fileno(self):
+        return self._wakeup_read_fd
+
+    def clear_wakeups(self):
+        try:
+            while os.read(self._wakeup_read_fd, WAKEUP_READ_SIZE):
+                pass
+        except OSError as error:
+            if error.errno != errno.EAGAIN:
+                raise
+
+    def _put(self, item):
+        Queue.Queue._put(self, item)
+        # The reader empties the queue after clearing wake-ups, so one wake-up per empty -> non-empty is enough.
+        if self._wakeup_write_fd is not None and self._qsize() == 1:
+            try:
+                os.write(self._wakeup_write_fd, '\0')
+            except OSError as error:
+                if error.errno != errno.EAGAIN:  # Pipe full means a wake-up is already pending.
+                    raise
+
 
 class IoModerator(threading.Thread):
+    """ Relays display messages to the check-in board and board input to the event queue.
+
+        If the message queue is a MessageQueue with wake-up support, the
+        moderator blocks in select() on the serial port and the queue, so it
+        handles either as soon as it is ready and does no work while idle.
+        Otherwise it polls both every TIMEOUT_SECONDS.
+
+        Display messages that are waiting together are coalesced, and only
+        written if they change the LCD (see display_frames.DisplayFrameFilter).
+        The next message is written in full whatever it is after the link
+        starts and whenever the board says it has restarted.
+
+        With negotiate, the link protocol is negotiated with the board when
+        the port is opened (see board_protocol). Interface.ino doesn't speak
+        the framed protocol, so by default, or if the board doesn't answer,
+        the legacy line protocol is used.
 
-    def __init__(self, event_q, message_q):
+        Instead of being started as a thread, the moderator can be attached
+        to an event_loop.EventLoop, given an event_loop.LoopMessageQueue.
+    """
+
+    def __init__(self, event_q, message_q, multiplexed=None, send_changed_line_only=False, port=COM_PORT,
+                 negotiate=False, slots_=slots.SLOTS):
         super(IoModerator, self).__init__()
 
         self._event_q = event_q
         self._message_q = message_q
+        self._port = port
+        self._slots = frozenset(slots_)  # Card events for other slots are ignored as malformed.
+        self._negotiate = negotiate
+        self._protocol = board_protocol.LegacyLineProtocol()
+        self.malformed_messages = 0
+        self._display_filter = display_frames.DisplayFrameFilter(send_changed_line_only)
+        self._board_hellos = 0
+        if multiplexed is None:
+            multiplexed = isinstance(message_q, MessageQueue) and message_q.supports_wakeup()
+        self._multiplexed = multiplexed
 
     def run(self):
-        with serial.Serial(COM_PORT, BAUD_RATE, timeout=TIMEOUT_SECONDS) as serial_port:
-            while True:
-                try:
-                    message = self._message_q.get(timeout=TIMEOUT_SECONDS)
-                except Queue.Empty:
-                    continue
-                else:
-                    event_logger.log_display_message(message)
-                    serial_port.write(message)
-                finally:
-                    self._enqueue_events(serial_port)
+        with serial.Serial(self._port, BAUD_RATE, timeout=TIMEOUT_SECONDS) as serial_port:
+            self._start_link(serial_port)
+            if self._multiplexed:
+                self._run_multiplexed(serial_port)
+            else:
+                self._run_polling(serial_port)
+
+    def attach(self, loop):
+        serial_port = serial.Serial(self._port, BAUD_RATE, timeout=TIMEOUT_SECONDS)
+        self._start_link(serial_port)
+        loop.add_reader(serial_port.fileno(), lambda: self._enqueue_events(serial_port))
+        self._message_q.set_consumer(lambda: self._write_pending_messages(serial_port))
+        return serial_port
+
+    def _start_link(self, serial_port):
+        if self._negotiate:
+            self._protocol = board_protocol.negotiate(serial_port)
+            print "Board link protocol: %s" % self._protocol.name
+        # The board resets when the port opens, and legacy firmware shows a HELLO on the LCD.
+        self._display_filter.forget_shown_frame()
+        self._board_hellos = self._protocol.board_hellos
+        self._enqueue_events(serial_port)  # Anything the board sent while negotiating.
+
+    def _run_polling(self, serial_port):
+        while True:
+            try:
+                message = self._message_q.get(timeout=TIMEOUT_SECONDS)
+            except Queue.Empty:
+                continue
+            else:
+                self._write_pending_messages(serial_port, [message])
+            finally:
+                self._enqueue_events(serial_port)
+
+    def _run_multiplexed(self, serial_port):
+        serial_fd = serial_port.fileno()
+        wakeup_fd = self._message_q.fileno()
+        while True:
+            readable, unused_writable, unused_exceptional = select.select([serial_fd, wakeup_fd], [], [])
+            if wakeup_fd in readable:
+                self._message_q.clear_wakeups()
+                self._write_pending_messages(serial_port)
+            if serial_fd in readable:
+                self._enqueue_events(serial_port)
+
+    def _write_pending_messages(self, serial_port, messages=None):
+        messages = messages if messages is not None else []
+        while True:
+            try:
+                messages.append(self._message_q.get_nowait())
+            except Queue.Empty:
+                break
+
+        data = self._display_filter.next_write(messages)
+        if data is not None:
+            event_logger.log_display_message(data)
+            self._protocol.write_display(serial_port, data)
+        if messages:  # Written, or already on the LCD.
+            latency_metrics.display_settled(time.time(), self._message_q)
+
+    def read_stats(self):
+        stats = self._protocol.stats()
+        stats['malformed_messages'] = self.malformed_messages
+        return stats
+
+    def display_stats(self):
+        return self._display_filter.stats()
 
     def _enqueue_events(self, serial_port):
-        while serial_port.inWaiting():
-            message = serial_port.readline()
-            new_event = self._convert_message_to_event(message)
+        messages = self._protocol.read_messages(serial_port)
+        if self._protocol.board_hellos != self._board_hellos:
+            self._board_hellos = self._protocol.board_hellos
+            self._display_filter.forget_shown_frame()  # The board restarted with a blank LCD.
+        for new_event in self._convert_messages_to_events(messages):
             event_logger.log_event_enqueue(new_event)
             self._event_q.put(new_event)
 
+    def _convert_messages_to_events(self, messages):
+        events = []
+        for message in messages:
+            new_event = self._convert_message_to_event(message)
+            if new_event is None:
+                self.malformed_messages += 1
+                print "Ignoring malformed board message: %r" % message
+            else:
+                events.append(new_event)
+        return events
+
     def _convert_message_to_event(self, message):
+        """ Returns the event for a board message, or None if the message is garbled. """
         event_key = message[EVENT_KEY_START_INDEX:EVENT_KEY_END_INDEX]
-        event_data = message[EVENT_DATA_START_INDEX:]  # Empty list if index is out of bounds.
-        if event_key == event.CARD_INSERT or event_key == event.CARD_REMOVE:
+        event_data = message[EVENT_DATA_START_INDEX:]  # Empty string if index is out of bounds.
+        if event_key not in BOARD_EVENT_KEYS:
+            return None
+        if event_key in SLOT_EVENT_KEYS:
+            if not event_data.isdigit() or int(event_data) not in self._slots:
+                return None
             event_data = int(event_data)
+        elif event_data:
+            return None  # Probably two messages run together.
         return event.Event(event_key, event_data)
 
 
@@ -69,7 +235,7 @@ def safe_format_msg(msg):
 
 def main():
     event_q = Queue.Queue()
-    message_q = Queue.Queue()
+    message_q = MessageQueue()
     message_q.put("\0TESTING")
     IoModerator(event_q, message_q).run()
 
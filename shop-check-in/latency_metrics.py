@@ -0,0 +1,284 @@
+import bisect
+import signal
+import threading
+
+import event
+
+"""
+In-memory latency histograms for the path from a board action or card swipe
+to the LCD update it causes.
+
+Events are stamped when they are created (Event.timestamp), when BoardFsm
+dequeues them, when their handler returns and when the display next settles
+after that: when the IoModerator has written the frame the FSM sent, or found
+the LCD already showing it. Each board's events are matched with its own
+display, identified by its message queue. From those stamps:
+
+    queue     created -> dequeued, per event type
+    handler   dequeued -> handler returned, per event type and per state
+    display   handler returned -> display settled, per event type
+    response  created -> display first settled after dequeuing, per event type
+    error     first error pushed on the ErrorHandler's stack -> stack empty
+              again, per state the error happened in
+    mail      Mailer.send() called -> message accepted by the SMTP server,
+              by whether it opened a new SMTP session or reused one
+
+The current depths of the queues registered with watch_queue() are sampled
+whenever a report is made, along with each station's current and deepest
+ErrorHandler stack and the number of errors dropped because it was full. The report is available from dump(), the status
+website's /metrics page and, with install_dump_signal(), on SIGUSR1 (Ctrl+Break
+on Windows).
+
+Like logger.all_events, the metrics are module-level so that every thread
+reports into the same place.
+"""
+
+SMALLEST_BUCKET_SECONDS = 0.0001
+BUCKET_COUNT = 21  # Doubling from 0.1 ms up to about 105 s; slower goes in an overflow bucket.
+BUCKET_BOUNDS = [SMALLEST_BUCKET_SECONDS * 2 ** index for index in xrange(BUCKET_COUNT)]
+
+QUEUE = "queue"
+HANDLER = "handler"
+DISPLAY = "display"
+RESPONSE = "response"
+ERROR = "error"
+MAIL = "mail"
+STAGES = (QUEUE, HANDLER, DISPLAY, RESPONSE, ERROR, MAIL)
+
+MAX_EVENTS_AWAITING_DISPLAY = 64  # Per display. Beyond this, e.g. with no display attached, the oldest are forgotten.
+
+BY_EVENT = "event"
+BY_STATE = "state"
+BY_SESSION = "session"
+NEW_SESSION = "new"
+REUSED_SESSION = "reused"
+
+
+class Histogram(object):
+    """ Counts durations in power of two buckets; percentiles are bucket upper bounds. """
+
+    def __init__(self):
+        self._counts = [0] * (BUCKET_COUNT + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self._counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(BUCKET_BOUNDS[index], self.max) if index < BUCKET_COUNT else self.max
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.mean(),
+                'p50': self.percentile(0.50),
+                'p99': self.percentile(0.99),
+                'max': self.max}
+
+
+class LatencyMetrics(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (stage, BY_EVENT or BY_STATE, event name or state) -> Histogram
+        self._queues = {}  # Name -> queue
+        self._dequeued = {}  # Event -> dequeue time, for events whose display stage hasn't ended
+        self._handled = {}  # Event -> handler return time
+        self._awaiting_response = set()  # Events the display hasn't settled for since they were dequeued
+        self._awaiting_display = {}  # Display -> its events in dequeue order
+        self._error_stacks = {}  # Station name -> {'current': depth, 'max': depth, 'dropped': count}
+
+    def watch_queue(self, name, queue_):
+        with self._lock:
+            self._queues[name] = queue_
+
+    def event_dequeued(self, event_, now, display=None):
+        with self._lock:
+            self._record(QUEUE, BY_EVENT, _event_name(event_), now - event_.timestamp)
+            self._dequeued[event_] = now
+            self._awaiting_response.add(event_)
+            awaiting_display = self._awaiting_display.setdefault(display, [])
+            awaiting_display.append(event_)
+            if len(awaiting_display) > MAX_EVENTS_AWAITING_DISPLAY:
+                forgotten = awaiting_display.pop(0)
+                self._dequeued.pop(forgotten, None)
+                self._handled.pop(forgotten, None)
+                self._awaiting_response.discard(forgotten)
+
+    def event_handled(self, event_, state, now):
+        with self._lock:
+            dequeued = self._dequeued.get(event_)
+            if dequeued is None:
+                return
+            self._record(HANDLER, BY_EVENT, _event_name(event_), now - dequeued)
+            self._record(HANDLER, BY_STATE, state, now - dequeued)
+            self._handled[event_] = now
+
+    def display_settled(self, now, display=None):
+        """ The display has caught up with the frames sent to it, whether or not they needed writing. """
+        with self._lock:
+            still_awaiting = []
+            for event_ in self._awaiting_display.get(display, ()):
+                name = _event_name(event_)
+                if event_ in self._awaiting_response:
+                    self._record(RESPONSE, BY_EVENT, name, now - event_.timestamp)
+                    self._awaiting_response.remove(event_)
+                handled = self._handled.pop(event_, None)
+                if handled is None:
+                    still_awaiting.append(event_)  # Its display stage ends when the display next settles.
+                else:
+                    self._record(DISPLAY, BY_EVENT, name, now - handled)
+                    del self._dequeued[event_]
+            if still_awaiting:
+                self._awaiting_display[display] = still_awaiting
+            else:
+                self._awaiting_display.pop(display, None)
+
+    def error_stack_changed(self, depth, station=None):
+        with self._lock:
+            error_stack = self._error_stack(station)
+            error_stack['current'] = depth
+            error_stack['max'] = max(error_stack['max'], depth)
+
+    def error_dropped(self, station=None):
+        with self._lock:
+            self._error_stack(station)['dropped'] += 1
+
+    def error_resolved(self, state, seconds):
+        with self._lock:
+            self._record(ERROR, BY_STATE, str(state), seconds)
+
+    def mail_sent(self, reused_session, seconds):
+        with self._lock:
+            self._record(MAIL, BY_SESSION, REUSED_SESSION if reused_session else NEW_SESSION, seconds)
+
+    def error_stack_depths(self):
+        """ {station name: {'current': depth, 'max': depth, 'dropped': count}} """
+        with self._lock:
+            return {station: dict(error_stack) for station, error_stack in self._error_stacks.iteritems()}
+
+    def histograms(self):
+        with self._lock:
+            return {key: histogram.snapshot() for key, histogram in self._histograms.iteritems()}
+
+    def queue_depths(self):
+        with self._lock:
+            return {name: queue_.qsize() for name, queue_ in self._queues.iteritems()}
+
+    def report(self):
+        lines = ["%-8s %-7s %-24s %7s %9s %9s %9s" % ("stage", "by", "name", "count", "p50 ms", "p99 ms", "max ms")]
+        histograms = self.histograms()
+        for stage in STAGES:
+            for key in sorted(key for key in histograms if key[0] == stage):
+                unused_stage, by, name = key
+                snapshot = histograms[key]
+                lines.append("%-8s %-7s %-24s %7d %9.3f %9.3f %9.3f" % (stage, by, name, snapshot['count'],
+                                                                        1000 * snapshot['p50'],
+                                                                        1000 * snapshot['p99'],
+                                                                        1000 * snapshot['max']))
+        for name, depth in sorted(self.queue_depths().iteritems()):
+            lines.append("queue depth %s: %d" % (name, depth))
+        for station, error_stack in sorted(self.error_stack_depths().iteritems()):
+            name_prefix = "%s " % station if station is not None else ""
+            lines.append("%serror stack depth: %d (max %d, %d errors dropped)" %
+                         (name_prefix, error_stack['current'], error_stack['max'], error_stack['dropped']))
+        return "\n".join(lines)
+
+    def _error_stack(self, station):
+        error_stack = self._error_stacks.get(station)
+        if error_stack is None:
+            error_stack = self._error_stacks[station] = {'current': 0, 'max': 0, 'dropped': 0}
+        return error_stack
+
+    def _record(self, stage, by, name, seconds):
+        key = (stage, by, name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.record(seconds)
+
+
+def _event_name(event_):
+    return event.EVENT_CODE_TO_NAME_MAP.get(event_.key, event_.key)
+
+
+_metrics = LatencyMetrics()
+
+
+def watch_queue(name, queue_):
+    _metrics.watch_queue(name, queue_)
+
+
+def event_dequeued(event_, now, display=None):
+    _metrics.event_dequeued(event_, now, display)
+
+
+def event_handled(event_, state, now):
+    _metrics.event_handled(event_, state, now)
+
+
+def display_settled(now, display=None):
+    _metrics.display_settled(now, display)
+
+
+def error_stack_changed(depth, station=None):
+    _metrics.error_stack_changed(depth, station)
+
+
+def error_dropped(station=None):
+    _metrics.error_dropped(station)
+
+
+def error_resolved(state, seconds):
+    _metrics.error_resolved(state, seconds)
+
+
+def mail_sent(reused_session, seconds):
+    _metrics.mail_sent(reused_session, seconds)
+
+
+def error_stack_depths():
+    return _metrics.error_stack_depths()
+
+
+def histograms():
+    return _metrics.histograms()
+
+
+def queue_depths():
+    return _metrics.queue_depths()
+
+
+def dump():
+    return _metrics.report()
+
+
+def reset():
+    global _metrics
+    _metrics = LatencyMetrics()
+
+
+def install_dump_signal():
+    """ Prints the report whenever the process gets SIGUSR1 (SIGBREAK, i.e. Ctrl+Break, on Windows). """
+    dump_signal = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+    if dump_signal is not None:
+        signal.signal(dump_signal, lambda unused_signal, unused_frame: _print_dump())
+
+
+def _print_dump():
+    print dump()
@@ -6,6 +6,7 @@ import util
 
 LOG_PATH = './logs/all_events/'
 LOG_NAME = 'events.log'
+LOG_FORMAT = '%(asctime)s: %(name)s: %(message)s'
 initialized = False
 logger = None
 
@@ -45,18 +46,25 @@ def log_display_message(message):
     global logger
     logger.debug('Message Display; message: %s' % message.replace('\n','\\n'))
 
-def init():
+@check_init
+def log_error_dropped(error, data, depth):
+    global logger
+    logger.warning('Error    Dropped; error: %s, data %s, stack depth %d' % (error, data, depth))
+
+def init(handler=None):
+    """ Starts logging to the daily rotated log files, or to handler if one is given. """
     global logger, initialized
     logger = logging.getLogger('all_events')
     logger.setLevel(logging.DEBUG)
 
-    util._safe_mkdirs(LOG_PATH)
+    if handler is None:
+        util._safe_mkdirs(LOG_PATH)
 
-    handler = TimedRotatingFileHandler(os.path.join(LOG_PATH, LOG_NAME),
-                                       when='midnight',
-                                       interval=1,
-                                       backupCount=60)
-    formatter = logging.Formatter('%(asctime)s: %(name)s: %(message)s')
+        handler = TimedRotatingFileHandler(os.path.join(LOG_PATH, LOG_NAME),
+                                           when='midnight',
+                                           interval=1,
+                                           backupCount=60)
+    formatter = logging.Formatter(LOG_FORMAT)
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
@@ -2,6 +2,8 @@ import os
 import re
 from datetime import datetime
 
+import atomic_file
+
 EXTENSION = '.log'
 TIME_HEADER = 'Log Time,'
 
@@ -20,10 +22,7 @@ def log(msg, header, log_root_path):
 
 
 def _safe_mkdirs(path):
-    try:
-        os.makedirs(_cut_file_name(path))
-    except WindowsError:
-        pass
+    atomic_file.safe_mkdirs(_cut_file_name(path))
 
 
 def _append_to_file_safe_with_header(path, msg, header):
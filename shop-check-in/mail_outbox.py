@@ -0,0 +1,192 @@
+import collections
+import cPickle
+import os
+import smtplib
+import socket
+import threading
+import time
+
+import atomic_file
+
+"""
+Sends the board's mail in the background, and keeps trying until it goes.
+
+The FSM must never wait on Gmail: a slow or unreachable SMTP server used to
+stall the board for as long as the connection took to time out, and the
+missed-checkout notice was lost. MailOutbox stands in for the Mailer, so
+_send_id_card_email_s() only queues the emails and returns. The outbox's
+thread then writes each one to a spool directory (one file per email, written
+to a temporary file and renamed into place) and delivers the spool in order,
+deleting each file once the email is sent. If sending fails, it backs off and
+tries again; emails still in the spool when the board stops are sent after it
+restarts. Emails the server rejects for good (a 5xx reply, such as a refused
+recipient) are moved to the dead letter directory, as retrying them can't
+help, and the rest of the spool carries on. If the server won't accept the
+Mailer's login, nothing can be sent until someone fixes it, so the outbox
+says so and waits max_backoff_seconds before trying again. The emails in the
+spool go out over one SMTP session, which the outbox logs out of once it has
+been idle for the Mailer's idle_seconds.
+
+    outbox = MailOutbox(Mailer())
+    outbox.start()
+    board = fsm.BoardFsm(event_q, message_q, shop_user_db, outbox)
+"""
+
+SPOOL_DIRECTORY = os.path.join(".", "state", "outbox")
+DEAD_LETTER_DIRECTORY_NAME = "dead"  # Inside the spool directory
+SPOOL_SUFFIX = ".mail"
+INITIAL_BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 30 * 60
+
+
+class MailOutbox(threading.Thread):
+
+    def __init__(self, mailer, spool_directory=SPOOL_DIRECTORY, initial_backoff_seconds=INITIAL_BACKOFF_SECONDS,
+                 max_backoff_seconds=MAX_BACKOFF_SECONDS):
+        threading.Thread.__init__(self, name="MailOutbox")
+        self.daemon = True
+        self._mailer = mailer
+        self._spool_directory = spool_directory
+        self._initial_backoff_seconds = initial_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._dead_letter_directory = os.path.join(spool_directory, DEAD_LETTER_DIRECTORY_NAME)
+        self._changed = threading.Condition()
+        self._incoming = []  # Emails queued but not yet spooled.
+        self._pending = collections.deque(self._load_spool())  # (path, email) in the order to send them.
+        self._sequence = 0
+        self.sent = 0
+        self.failed_attempts = 0
+        self.login_failures = 0
+        self.dropped = 0  # Moved to the dead letter directory
+
+    def _send_id_card_email_s(self, user_s):
+        """ Queues an email to each user and returns straight away. """
+        for user in user_s:
+            print "Queueing mail to %s at %s" % (user.name, user.email)
+            self.put(self._mailer.make_id_card_email(user))
+
+    def put(self, email):
+        with self._changed:
+            self._incoming.append(email)
+            self._changed.notify_all()
+
+    def pending(self):
+        """ How many emails are waiting to be sent. """
+        with self._changed:
+            return len(self._incoming) + len(self._pending)
+
+    def wait_until_idle(self, timeout=None):
+        """ Waits until every email queued so far is sent or dropped. Returns whether they were. """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._changed:
+            while self._incoming or self._pending:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return True
+
+    def run(self):
+        backoff = 0
+        retry_time = None  # After a failure, when to try again.
+        while True:
+            with self._changed:
+                if not self._incoming:
+                    if not self._pending:
+                        self._changed.wait(self._mailer.idle_seconds)
+                    elif retry_time is not None and time.time() < retry_time:
+                        self._changed.wait(retry_time - time.time())
+                incoming = list(self._incoming)
+            for email in incoming:
+                self._spool(email)
+            self._mailer.close_idle_session()
+            if not self._pending or retry_time is not None and time.time() < retry_time:
+                continue
+            login_failures = self.login_failures
+            if self.send_pending():
+                backoff = 0
+                retry_time = None
+            else:
+                if self.login_failures != login_failures:
+                    backoff = self._max_backoff_seconds  # Retrying soon won't fix the login.
+                else:
+                    backoff = min(max(2 * backoff, self._initial_backoff_seconds), self._max_backoff_seconds)
+                retry_time = time.time() + backoff
+
+    def send_pending(self):
+        """ Sends the spooled emails in order. Returns False if they couldn't all be sent or dead lettered. """
+        while True:
+            with self._changed:
+                if not self._pending:
+                    return True
+                path, email = self._pending[0]
+            try:
+                self._mailer.send(email)
+            except smtplib.SMTPAuthenticationError as error:
+                print "Could not log in to the mail server (%s); no mail can go out until the login is fixed" % error
+                self.login_failures += 1
+                return False
+            except (smtplib.SMTPException, socket.error) as error:
+                if not _is_permanent(error):
+                    print "Could not send mail to %s (%s); will try again" % (email.to_address, error)
+                    self.failed_attempts += 1
+                    return False
+                print "Could not send mail to %s (%s); moving it to %s" % (email.to_address, error,
+                                                                          self._dead_letter_directory)
+                self._dead_letter(path, email)
+                self.dropped += 1
+            else:
+                self.sent += 1
+                atomic_file.safe_remove(path)
+            with self._changed:
+                self._pending.popleft()
+                self._changed.notify_all()
+
+    def _spool(self, email):
+        self._sequence += 1
+        path = os.path.join(self._spool_directory,
+                            "%015d-%06d%s" % (time.time() * 1000, self._sequence, SPOOL_SUFFIX))
+        try:
+            atomic_file.write_atomically(path, lambda spool_file: cPickle.dump(email, spool_file,
+                                                                              cPickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError) as error:
+            print "Could not spool mail to %s (%s); it will be lost if the board stops" % (email.to_address, error)
+            path = None
+        with self._changed:
+            self._incoming.pop(0)  # Moves it to _pending in one step, so that wait_until_idle() can't miss it.
+            self._pending.append((path, email))
+            self._changed.notify_all()
+
+    def _dead_letter(self, path, email):
+        """ Moves a spooled email out of the spool, into the dead letter directory. """
+        if path is None:  # It couldn't be spooled in the first place.
+            return
+        try:
+            atomic_file.safe_mkdirs(self._dead_letter_directory)
+            os.rename(path, os.path.join(self._dead_letter_directory, os.path.basename(path)))
+        except OSError as error:
+            print "Could not keep undeliverable mail to %s (%s); deleting it" % (email.to_address, error)
+            atomic_file.safe_remove(path)
+
+    def _load_spool(self):
+        try:
+            names = sorted(name for name in os.listdir(self._spool_directory) if name.endswith(SPOOL_SUFFIX))
+        except OSError:  # Nothing spooled yet
+            return []
+        spooled = []
+        for name in names:
+            path = os.path.join(self._spool_directory, name)
+            try:
+                with open(path, 'rb') as spool_file:
+                    spooled.append((path, cPickle.load(spool_file)))
+            except Exception as error:
+                print "Skipping unreadable spooled mail %s (%s)" % (path, error)
+        return spooled
+
+
+def _is_permanent(error):
+    """ Whether the server has said that trying again won't help. """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, unused_message in error.recipients.itervalues())
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
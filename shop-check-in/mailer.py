@@ -1,5 +1,10 @@
 import smtplib
+import socket
 import os
+import threading
+import time
+
+import latency_metrics
 import shop_user
 from shop_user_database import PATH_LOGIN_INFO
 
@@ -25,13 +30,39 @@ Shop Management"""
 
 EMAIL_SUBJECT = "ID Removed from shop without checkout"
 
+SMTP_SERVER = 'smtp.gmail.com:587'
+SMTP_TIMEOUT_SECONDS = 30
+SMTP_IDLE_SECONDS = 60  # How long an unused SMTP session stays open.
+
+
+class Email(object):
+
+    def __init__(self, to_address, message):
+        self.to_address = to_address
+        self.message = message  # The whole message, headers included.
+
 
 class Mailer(object):
 
-    def __init__(self):
-        login_info = self._get_login_info()
-        self._username = login_info["GOOGLE_USERNAME"]
-        self._password = login_info["GOOGLE_PASSWORD"]
+    def __init__(self, smtp_server=SMTP_SERVER, use_tls=True, username=None, password=None,
+                 idle_seconds=SMTP_IDLE_SECONDS):
+        """ Without a username, logs in with the Google account in PATH_LOGIN_INFO.
+
+            Without a password, doesn't log in at all, e.g. for a local test server.
+            Emails sent within idle_seconds of each other share one SMTP session.
+        """
+        if username is None:
+            login_info = self._get_login_info()
+            username = login_info["GOOGLE_USERNAME"]
+            password = login_info["GOOGLE_PASSWORD"]
+        self._smtp_server = smtp_server
+        self._use_tls = use_tls
+        self._username = username
+        self._password = password
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._session = None
+        self._session_last_used = None
 
     @staticmethod
     def _get_login_info():
@@ -45,19 +76,73 @@ class Mailer(object):
 
     def _send_id_card_email(self, user):
         print "Sending mail to %s at %s" % (user.name, user.email)
-        message = self._make_id_card_email(user)
-        server = smtplib.SMTP('smtp.gmail.com:587')
-        server.starttls()
         try:
-            server.login(self._username, self._password)
-        except:
+            self.send(self.make_id_card_email(user))
+        except smtplib.SMTPAuthenticationError:
             print "Could not login to the google server!"
-        else:
+        except (smtplib.SMTPException, socket.error):
+            print "Could not send mail to the the address %s" % user.email
+
+    def send(self, email):
+        """ Sends email, raising smtplib.SMTPException or socket.error if it can't.
+
+            Reuses the SMTP session from the last email unless it has been idle
+            too long; if the server has dropped it, reconnects and tries once more.
+        """
+        with self._lock:
+            start_time = time.time()
+            reused_session = self._session is not None and not self._is_idle()
+            if not reused_session:
+                self._close_session()
             try:
-                server.sendmail(self._username, user.email, message)
-                server.quit()
-            except:
-                print "Could not send mail to the the address %s" % user.email
+                self._sendmail(email)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                self._close_session()
+                if not reused_session:
+                    raise
+                reused_session = False
+                self._sendmail(email)
+            self._session_last_used = time.time()
+            latency_metrics.mail_sent(reused_session, self._session_last_used - start_time)
+
+    def close_idle_session(self):
+        """ Logs out of the SMTP session if it hasn't been used for idle_seconds. """
+        with self._lock:
+            if self._session is not None and self._is_idle():
+                self._close_session()
+
+    def close(self):
+        with self._lock:
+            self._close_session()
+
+    def _sendmail(self, email):
+        if self._session is None:
+            self._session = self._open_session()
+            self._session_last_used = time.time()  # The server may still refuse this email.
+        self._session.sendmail(self._username, email.to_address, email.message)
+
+    def _open_session(self):
+        server = smtplib.SMTP(self._smtp_server, timeout=SMTP_TIMEOUT_SECONDS)
+        try:
+            if self._use_tls:
+                server.starttls()
+            if self._password is not None:
+                server.login(self._username, self._password)
+        except:
+            _quit(server)
+            raise
+        return server
+
+    def _close_session(self):
+        if self._session is not None:
+            _quit(self._session)
+            self._session = None
+
+    def _is_idle(self):
+        return time.time() - self._session_last_used >= self.idle_seconds
+
+    def make_id_card_email(self, user):
+        return Email(user.email, self._make_id_card_email(user))
 
     def _make_id_card_email(self, user):
         body =  EMAIL_BODY_TEMPLATE % (user.name)
@@ -77,3 +162,9 @@ class Mailer(object):
     def _populated_template(from_address, to_name, to_address, subject, body):
         return EMAIL_TEMPLATE % (from_address, to_name, to_address, subject, body)
 
+
+def _quit(server):
+    try:
+        server.quit()
+    except (smtplib.SMTPException, socket.error):
+        server.close()
@@ -1,15 +1,87 @@
-import Queue as queue
+import argparse
+import threading
 
+import event_loop
 import fsm
 import io_moderator
 import id_logger
+import latency_metrics
+from mail_outbox import MailOutbox
+from mailer import Mailer
 from website.server import LiveSite
+import shop
+import shop_check_in_exceptions
 import shop_user_database
+import state_journal
+import stations
+import user_lookup
+
+READERS_WITH_PATH = ('evdev', 'tty', 'replay')
 
 
 def main():
-    event_q = queue.Queue()
-    message_q = queue.Queue()
+    parser = argparse.ArgumentParser(description='Run the shop check-in board.')
+    parser.add_argument('--event-loop', action='store_true',
+                        help='Run the board I/O and FSM on one event loop instead of separate threads (POSIX only).')
+    parser.add_argument('--state-journal', default=state_journal.DEFAULT_PATH,
+                        help='Where the board records its state, and restores it from on start.')
+    parser.add_argument('--stations',
+                        help='JSON file describing one board per sub-shop (see stations.py); '
+                             'by default one board on %s runs the whole shop.' % io_moderator.COM_PORT)
+    parser.add_argument('--reader', choices=id_logger.BACKENDS,
+                        help='How to read the ID card reader when running one board (default %s; '
+                             'use evdev or tty off Windows).' % stations.DEFAULT_READER)
+    parser.add_argument('--reader-path', help='Input device or terminal the card reader is on, for --reader.')
+    args = parser.parse_args()
+
+    if args.stations:
+        if args.reader or args.reader_path:
+            parser.error('--stations gives each station its own reader')
+        try:
+            station_configs = stations.load_station_configs(args.stations)
+        except shop_check_in_exceptions.StationConfigError as error:
+            parser.error(str(error))
+    else:
+        reader = args.reader or stations.DEFAULT_READER
+        if reader in READERS_WITH_PATH and not args.reader_path:
+            parser.error('--reader %s needs --reader-path' % reader)
+        if args.event_loop and reader == stations.DEFAULT_READER:
+            parser.error('--event-loop needs a POSIX card reader: pass --reader evdev or --reader tty')
+        station_configs = [stations.StationConfig(reader=reader, reader_path=args.reader_path,
+                                                  journal_path=args.state_journal)]
+
+    latency_metrics.install_dump_signal()
+    if args.event_loop:
+        if len(station_configs) != 1:
+            parser.error('--event-loop runs a single station')
+        run_on_event_loop(station_configs[0])
+    else:
+        run_on_threads(station_configs)
+
+
+def run_on_threads(station_configs):
+    print "Connecting to Database..."
+
+    shop_user_db = shop_user_database.ShopUserDatabase()
+    user_lookup_pool = user_lookup.UserLookupPool(shop_user_db)
+    occupancy = shop.Occupancy()
+    outbox = _start_outbox()
+
+    boards = []
+    for config in station_configs:
+        print "Setting up station %s..." % (config.name or config.port)
+
+        station = stations.Station(config, shop_user_db, user_lookup_pool, occupancy, outbox)
+        station.start_io()
+        boards.append(station.board)
+
+    _run_boards(boards)
+
+
+def run_on_event_loop(station_config):
+    loop = event_loop.EventLoop()
+    event_q = event_loop.LoopEventQueue(loop)
+    message_q = event_loop.LoopMessageQueue(loop)
 
     print "Connecting to Database..."
 
@@ -17,27 +89,44 @@ def main():
 
     print "Setting up ID Logger..."
 
-    thread_id_logger = id_logger.IdLogger(event_q)
-    thread_id_logger.daemon = True
-    thread_id_logger.start()
+    user_lookup_pool = user_lookup.UserLookupPool(shop_user_db, loop=loop)
+    id_logger.IdLogger(event_q, station_config.make_reader(), user_lookup_pool).attach(loop)
 
     print "Setting up IO Moderator..."
 
-    thread_io_moderator = io_moderator.IoModerator(event_q, message_q)
-    thread_io_moderator.daemon = True
-    thread_io_moderator.start()
+    io_moderator.IoModerator(event_q, message_q, port=station_config.port,
+                             negotiate=station_config.framed, slots_=station_config.slots).attach(loop)
 
     print "Setting up FSM..."
 
-    board = fsm.BoardFsm(event_q, message_q, shop_user_db)
+    # Database writes block on the network, so they run on the loop's executor. Mail has its own thread.
+    board = fsm.BoardFsm(event_q, message_q,
+                         event_loop.ExecutorProxy(loop, shop_user_db),
+                         _start_outbox(),
+                         journal=state_journal.StateJournal(station_config.journal_path),
+                         shop_=shop.Shop(slots_=station_config.slots), name=station_config.name)
+
+    _run_boards([board])
+
+
+def _start_outbox():
+    outbox = MailOutbox(Mailer())
+    outbox.start()
+    return outbox
+
 
+def _run_boards(boards):
     print "Starting webserver..."
-    server = LiveSite(board._shop)
+    server = LiveSite([board._shop for board in boards])
     server.daemon = True
     server.start()
 
     print "Running FSM"
-    board.run_fsm()
+    for board in boards[1:]:
+        board_thread = threading.Thread(target=board.run_fsm)
+        board_thread.daemon = True
+        board_thread.start()
+    boards[0].run_fsm()
 
     print "Board shutting down"
 
@@ -0,0 +1,320 @@
+import argparse
+import collections
+import datetime
+import logging
+import pickle
+import re
+import threading
+import time
+import Queue as queue
+
+import audio
+import event
+import fsm
+import shop_check_in_exceptions
+import shop_user
+import shop_user_database
+import slots
+
+import logger.all_events as event_logger
+
+"""
+Replays the events recorded in logger.all_events logs through a headless
+BoardFsm and ErrorHandler, with the database, sounds and mail stubbed out.
+
+The events fed to the FSM are the log's "Event Submit" records, in order, plus
+any picked up event that was put on the queue without being logged. The
+state frames the FSM sends ("Message Submit") are compared with the ones the
+log recorded after the same event was picked up, and any difference is
+reported as a divergence. That makes a recorded day both a regression test
+for FSM changes and a throughput benchmark. Frames that depend on timing,
+like the state frame shown again once a timed frame expires, can diverge
+without the FSM having changed; replaying with --speed 1 keeps those closest
+to the recording.
+
+    python replay.py logs/all_events/events.log* [--users PICKLE] [--speed N]
+
+Without --speed the events are fed as fast as possible; with it they keep
+their recorded spacing, N times faster.
+
+The stub database knows the users in --users (a pickled {ID: ShopUser} dict,
+like the local database cache); without it, every ID belongs to a certified
+proctor with no debt.
+"""
+
+REPLAY_AS_FAST_AS_POSSIBLE = None
+
+EVENT_SUBMIT = "Submit"
+EVENT_PICKUP = "Pickup"
+
+_LOG_LINE_RE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}): all_events: (.*)$')
+_EVENT_RE = re.compile(r'^Event +(Submit|Pickup); name: .* ,key: (\S*), data ?(.*)$')
+_MESSAGE_SUBMIT_RE = re.compile(r'^Message  Submit; message: (.*)$')
+_ASCTIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_PERMISSIVE_USER_DATA = ["Replayed User", None, "", "replay@example.com", None, 0, shop_user.IS_PROCTOR]
+_SLOT_EVENT_KEYS = (event.CARD_INSERT, event.CARD_REMOVE)
+
+
+class EventRecord(object):
+
+    def __init__(self, timestamp, action, key, data):
+        self.timestamp = timestamp
+        self.action = action  # EVENT_SUBMIT or EVENT_PICKUP
+        self.key = key
+        self.data = data
+
+    def to_event(self):
+        new_event = event.Event(self.key, self.data)
+        new_event.timestamp = self.timestamp
+        return new_event
+
+
+class MessageRecord(object):
+
+    def __init__(self, timestamp, message):
+        self.timestamp = timestamp
+        self.message = message  # As logged, i.e. with newlines escaped.
+
+
+def parse_log_line(line):
+    """ Returns an EventRecord or MessageRecord for an all_events log line, or None for anything else. """
+    match = _LOG_LINE_RE.match(line.rstrip('\n'))
+    if match is None:
+        return None
+    asctime, milliseconds, message = match.groups()
+    timestamp = time.mktime(datetime.datetime.strptime(asctime, _ASCTIME_FORMAT).timetuple())
+    timestamp += int(milliseconds) / 1000.0
+    return parse_log_message(timestamp, message)
+
+
+def parse_log_message(timestamp, message):
+    event_match = _EVENT_RE.match(message)
+    if event_match is not None:
+        action, key, data = event_match.groups()
+        return EventRecord(timestamp, action, key, decode_event_data(key, data))
+    message_match = _MESSAGE_SUBMIT_RE.match(message)
+    if message_match is not None:
+        return MessageRecord(timestamp, message_match.group(1))
+    return None
+
+
+def decode_event_data(key, data):
+    """ Undoes the %s formatting of an event's data in the log. """
+    if key in _SLOT_EVENT_KEYS and data.isdigit():
+        return int(data)
+    if data == "None":
+        return None
+    return data
+
+
+def load_log(paths):
+    """ Returns the records of all the log files, oldest file first. Lines are split on \\n only. """
+    files = []
+    for path in paths:
+        with open(path, 'rb') as log_file:
+            records = [record for record in (parse_log_line(line) for line in log_file.read().split('\n'))
+                       if record is not None]
+        if records:
+            files.append(records)
+    files.sort(key=lambda records: records[0].timestamp)
+    return [record for records in files for record in records]
+
+
+def input_events(records):
+    """ The events that were put on the FSM's queue, in order. """
+    events = []
+    submitted = collections.Counter()  # (key, data) of submitted events not picked up yet
+    for record in records:
+        if not isinstance(record, EventRecord):
+            continue
+        key = (record.key, record.data)
+        if record.action == EVENT_SUBMIT:
+            events.append(record)
+            submitted[key] += 1
+        elif submitted[key]:
+            submitted[key] -= 1
+        else:
+            events.append(record)  # Queued without being logged, e.g. by the board simulator.
+    return events
+
+
+def messages_by_pickup(records):
+    """ Groups the logged state frames by how many events had been picked up when they were sent. """
+    groups = [[]]
+    for record in records:
+        if isinstance(record, EventRecord) and record.action == EVENT_PICKUP:
+            groups.append([])
+        elif isinstance(record, MessageRecord):
+            groups[-1].append(record.message)
+    return groups
+
+
+class ReplayShopUserDatabase(object):
+    """ A shop user database stub that never touches the network. """
+
+    def __init__(self, users=None):
+        self._users = users
+        self.debt_changes = 0
+
+    @staticmethod
+    def from_pickle(path):
+        with open(path, 'rb') as users_file:
+            return ReplayShopUserDatabase(pickle.load(users_file))
+
+    def get_shop_user(self, id_number):
+        if self._users is None:
+            user_data = list(_PERMISSIVE_USER_DATA)
+            user_data[shop_user.TEST_DATE] = str(datetime.date.today())
+            user_data[shop_user.ID] = id_number
+            return shop_user.ShopUser(user_data)
+        try:
+            return self._users[id_number]
+        except KeyError:
+            raise shop_check_in_exceptions.NonexistentUserError
+
+    def increase_debt(self, user):
+        user.debt += shop_user_database.DEBT_INCREMENT
+        self.debt_changes += 1
+
+    def clear_debt(self, user):
+        user.debt = 0
+        self.debt_changes += 1
+
+
+class NullMailer(object):
+
+    def __init__(self):
+        self.mail_count = 0
+
+    def _send_id_card_email_s(self, user_s):
+        self.mail_count += len(user_s)
+
+
+class Divergence(object):
+
+    def __init__(self, pickup_index, event_record, expected, actual):
+        self.pickup_index = pickup_index
+        self.event_record = event_record  # The event picked up before the frames, or None at the start.
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        after = "at start" if self.event_record is None else "after %s %r" % (self.event_record.key,
+                                                                            self.event_record.data)
+        return "pickup %d, %s: logged %r, replayed %r" % (self.pickup_index, after, self.expected, self.actual)
+
+
+class ReplayResult(object):
+
+    def __init__(self, final_state, shop_, events_replayed, seconds, divergences):
+        self.final_state = final_state
+        self.shop = shop_
+        self.events_replayed = events_replayed
+        self.seconds = seconds
+        self.divergences = divergences
+
+    def events_per_second(self):
+        return self.events_replayed / self.seconds if self.seconds else 0.0
+
+    def shop_summary(self):
+        summary = {'state': self.final_state, 'open': self.shop.is_open()}
+        if self.shop.is_open():
+            summary['pods'] = [user.name for user in self.shop.pods()]
+            summary['slots in use'] = {slot: [user.name for user in self.shop.current_machine_user_s(slot)]
+                                       for slot in slots.SLOTS if self.shop.is_machine_in_use(slot)}
+        return summary
+
+    def report(self, max_divergences=20):
+        lines = ["Replayed %d events in %.3f s (%.1f events/s)" % (self.events_replayed, self.seconds,
+                                                                  self.events_per_second()),
+                 "Final shop: %s" % self.shop_summary(),
+                 "Divergences: %d" % len(self.divergences)]
+        lines.extend("    %s" % divergence for divergence in self.divergences[:max_divergences])
+        return "\n".join(lines)
+
+
+class _CapturingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        parsed = parse_log_message(record.created, record.getMessage())
+        if parsed is not None:
+            self.records.append(parsed)
+
+
+def replay(records, shop_user_db=None, speed=REPLAY_AS_FAST_AS_POSSIBLE):
+    """ Feeds the submitted events in records through a headless BoardFsm; returns a ReplayResult. """
+    events = input_events(records)
+    shop_user_db = shop_user_db if shop_user_db is not None else ReplayShopUserDatabase()
+
+    event_q = queue.Queue()
+    board = fsm.BoardFsm(event_q, queue.Queue(), shop_user_db, NullMailer(),
+                         audio_worker=audio.AudioWorker({}, audio.NullBackend()))
+
+    if not event_logger.initialized:
+        event_logger.init(logging.NullHandler())  # Don't add the replay to the real logs.
+    capture = _CapturingHandler()
+    event_logger.logger.addHandler(capture)
+    try:
+        start_time = time.time()
+        if speed is REPLAY_AS_FAST_AS_POSSIBLE:
+            _feed_events(event_q, events, speed)
+        else:
+            feeder = threading.Thread(target=_feed_events, args=(event_q, events, speed))
+            feeder.daemon = True
+            feeder.start()
+        final_state = board.run_fsm()
+        seconds = time.time() - start_time
+    finally:
+        event_logger.logger.removeHandler(capture)
+
+    divergences = _find_divergences(records, capture.records)
+    return ReplayResult(final_state, board._shop, len(events), seconds, divergences)
+
+
+def _feed_events(event_q, events, speed):
+    start_time = time.time()
+    for record in events:
+        if speed is not REPLAY_AS_FAST_AS_POSSIBLE:
+            delay = start_time + (record.timestamp - events[0].timestamp) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        event_q.put(record.to_event())
+    event_q.put(event.Event(event.TERMINATE_PROGRAM))
+
+
+def _find_divergences(logged_records, replayed_records):
+    pickups = [None] + [record for record in logged_records
+                        if isinstance(record, EventRecord) and record.action == EVENT_PICKUP]
+    expected_groups = messages_by_pickup(logged_records)
+    actual_groups = messages_by_pickup(replayed_records)
+    divergences = []
+    for index in xrange(max(len(expected_groups), len(actual_groups))):
+        expected = expected_groups[index] if index < len(expected_groups) else []
+        actual = actual_groups[index] if index < len(actual_groups) else []
+        if expected != actual:
+            pickup = pickups[index] if index < len(pickups) else None
+            divergences.append(Divergence(index, pickup, expected, actual))
+    return divergences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay all_events logs through a headless board FSM.')
+    parser.add_argument('logs', nargs='+', help='all_events log files, e.g. logs/all_events/events.log*')
+    parser.add_argument('--users', help='Pickled {ID: ShopUser} dict to look swiped users up in.')
+    parser.add_argument('--speed', type=float, default=REPLAY_AS_FAST_AS_POSSIBLE,
+                        help='Keep the recorded timing, this many times faster. Default: as fast as possible.')
+    parser.add_argument('--max-divergences', type=int, default=20, help='Divergences to print.')
+    args = parser.parse_args()
+
+    shop_user_db = ReplayShopUserDatabase.from_pickle(args.users) if args.users else None
+    result = replay(load_log(args.logs), shop_user_db, args.speed)
+    print result.report(args.max_divergences)
+
+
+if __name__ == "__main__":
+    main()
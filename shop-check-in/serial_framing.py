@@ -0,0 +1,86 @@
+FRAME_END = '\n'
+LINE_END = '\r'  # The board ends lines with "\r\n"; frames exclude both.
+
+READ_BUFFER_SIZE = 1024
+
+
+class LineFramer(object):
+    """ Splits the board's serial input into newline terminated frames.
+
+        Everything waiting on the port is read with a single call into a
+        reusable bytearray. Complete frames are returned as memoryviews into
+        that buffer, so they are only valid until the next read. A trailing
+        partial frame stays in the buffer and is completed by later reads.
+    """
+
+    def __init__(self, buffer_size=READ_BUFFER_SIZE):
+        self._buffer = bytearray(buffer_size)
+        self._length = 0
+        self._consumed = 0
+
+        self.reads = 0
+        self.bytes_read = 0
+        self.frames_read = 0
+        self.max_bytes_per_read = 0
+        self.max_frames_per_read = 0
+
+    def read_frames(self, serial_port):
+        bytes_waiting = serial_port.inWaiting()
+        if not bytes_waiting:
+            return []
+        return self.feed(serial_port.read(bytes_waiting))
+
+    def feed(self, data):
+        self._discard_consumed()
+        self._reserve(len(data))
+        self._buffer[self._length:self._length + len(data)] = data
+        self._length += len(data)
+
+        frames = self._split_frames()
+
+        self.reads += 1
+        self.bytes_read += len(data)
+        self.frames_read += len(frames)
+        self.max_bytes_per_read = max(self.max_bytes_per_read, len(data))
+        self.max_frames_per_read = max(self.max_frames_per_read, len(frames))
+        return frames
+
+    def pending_bytes(self):
+        return self._length - self._consumed
+
+    def stats(self):
+        return {'reads': self.reads,
+                'bytes_read': self.bytes_read,
+                'frames_read': self.frames_read,
+                'bytes_per_read': float(self.bytes_read) / self.reads if self.reads else 0.0,
+                'frames_per_read': float(self.frames_read) / self.reads if self.reads else 0.0,
+                'max_bytes_per_read': self.max_bytes_per_read,
+                'max_frames_per_read': self.max_frames_per_read}
+
+    def _split_frames(self):
+        frames = []
+        view = memoryview(self._buffer)
+        start = self._consumed
+        end = self._buffer.find(FRAME_END, start, self._length)
+        while end != -1:
+            frame_end = end - 1 if end > start and self._buffer[end - 1] == ord(LINE_END) else end
+            frames.append(view[start:frame_end])
+            start = end + 1
+            end = self._buffer.find(FRAME_END, start, self._length)
+        self._consumed = start
+        return frames
+
+    def _discard_consumed(self):
+        # Move the partial frame left over from the last read to the front of the buffer.
+        remaining = self._length - self._consumed
+        if self._consumed and remaining:
+            self._buffer[:remaining] = self._buffer[self._consumed:self._length]
+        self._length = remaining
+        self._consumed = 0
+
+    def _reserve(self, size):
+        if self._length + size > len(self._buffer):
+            # Copy rather than resize: frames handed out earlier may still hold views of the old buffer.
+            buffer_ = bytearray(max(2 * len(self._buffer), self._length + size))
+            buffer_[:self._length] = self._buffer[:self._length]
+            self._buffer = buffer_
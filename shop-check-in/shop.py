@@ -1,5 +1,6 @@
 from datetime import datetime
-from slots import SLOTS, get_machine_name
+import threading
+from slots import SLOTS, SUB_SHOP_SLOTS, get_machine_name, which_sub_shop
 
 import shop_check_in_exceptions
 import logger.usage as usage_logger
@@ -7,61 +8,169 @@ import logger.usage as usage_logger
 
 NO_TIME = None
 
-class Shop(object):
+
+class Occupancy(object):
+    """ Who is on which machine, and since when.
+
+        The Shops of several stations (check-in boards) can share one
+        Occupancy, each looking after its own slots; its lock serializes
+        their changes. Alongside the per-slot lists it keeps indexes (which
+        slot each user is in, and how many users are in each sub-shop and
+        in all), changed only through set_slot(), and after every change
+        publishes an immutable OccupancySnapshot for readers on other threads.
+    """
+
     def __init__(self):
+        self.lock = threading.RLock()
+        self.occupants = [[] for slot in SLOTS]
+        self.start_times = [NO_TIME for slot in SLOTS]
+        self.slot_by_id = {}  # ID number -> slot; a user is in at most one slot.
+        self.sub_shop_counts = {sub_shop: 0 for sub_shop in SUB_SHOP_SLOTS}
+        self.occupant_count = 0
+        self.version = 0
+        self.snapshot = OccupancySnapshot(self)
+        self._published = threading.Condition()
+
+    def set_slot(self, slot, user_s, start_time):
+        """ Puts user_s in slot, keeping the indexes up to date. Hold the lock, and publish() when done. """
+        old_user_s = self.occupants[slot]
+        for user in old_user_s:
+            if self.slot_by_id.get(user.id_number) == slot:
+                del self.slot_by_id[user.id_number]
+        for user in user_s:
+            self.slot_by_id[user.id_number] = slot
+        sub_shop = which_sub_shop(slot)
+        if sub_shop is not None:
+            self.sub_shop_counts[sub_shop] += len(user_s) - len(old_user_s)
+        self.occupant_count += len(user_s) - len(old_user_s)
+        self.occupants[slot] = user_s
+        self.start_times[slot] = start_time
+
+    def publish(self):
+        self.version += 1
+        self.snapshot = OccupancySnapshot(self)
+        with self._published:
+            self._published.notify_all()
+
+    def wait_for_change(self, version, timeout):
+        """ Waits up to timeout seconds for a snapshot newer than version, and returns the latest snapshot. """
+        with self._published:
+            if self.snapshot.version == version:
+                self._published.wait(timeout)
+        return self.snapshot
+
+
+class OccupancySnapshot(object):
+    """ An Occupancy as it was at one version. Never changes, so any thread can read it without locking. """
+
+    __slots__ = ('version', 'occupants', 'start_times', 'sub_shop_counts', 'occupant_count')
+
+    def __init__(self, occupancy):
+        self.version = occupancy.version
+        self.occupants = tuple(tuple(user_s) for user_s in occupancy.occupants)
+        self.start_times = tuple(occupancy.start_times)
+        self.sub_shop_counts = dict(occupancy.sub_shop_counts)
+        self.occupant_count = occupancy.occupant_count
+
+    def user_s(self, slot):
+        return self.occupants[slot]
+
+    def start_time(self, slot):
+        return self.start_times[slot]
+
+    def is_machine_in_use(self, slot):
+        return bool(self.occupants[slot])
+
+
+class ShopSnapshot(object):
+    """ Whether a Shop was open, and its PODs, at one version. Never changes. """
+
+    __slots__ = ('version', 'is_open', 'pods')
+
+    def __init__(self, version, is_open, pods):
+        self.version = version
+        self.is_open = is_open
+        self.pods = tuple(pods)
+
+
+class Shop(object):
+    """ A station's view of the shop: whether it is open, its PODs, and the users in its slots.
+
+        With the default arguments it is the whole shop. Only the station's
+        BoardFsm changes it; other threads, such as the status website's,
+        read snapshot() and occupancy_snapshot() instead of the Shop itself.
+    """
+
+    def __init__(self, occupancy=None, slots_=SLOTS):
+        occupancy = occupancy if occupancy is not None else Occupancy()
+        self._occupancy = occupancy
+        self._lock = occupancy.lock
+        self._slots = list(slots_)
         self._open = False
         self._pods = []
-        self._occupants = [[] for slot in SLOTS]
-        self._start_times = [NO_TIME for slot in SLOTS]
+        self._pod_ids = set()
+        self._occupants = occupancy.occupants
+        self._start_times = occupancy.start_times
+        self._occupant_count = 0  # In this Shop's slots
+        self._version = 0  # Goes up on every change.
+        self._snapshot = ShopSnapshot(self._version, self._open, self._pods)
 
     def open_(self, user):
-        if user.is_proctor() and not self._open:
-            self._open = True
-            self._pods.append(user)
-            usage_logger.log_pod_opens_shop(user)
-        elif user.is_proctor():
-            raise shop_check_in_exceptions.ShopAlreadyOpenError
-        else:
-            raise shop_check_in_exceptions.NonProctorError
+        with self._lock:
+            if user.is_proctor() and not self._open:
+                self._open = True
+                self._add_pod(user)
+                self._changed()
+                usage_logger.log_pod_opens_shop(user)
+            elif user.is_proctor():
+                raise shop_check_in_exceptions.ShopAlreadyOpenError
+            else:
+                raise shop_check_in_exceptions.NonProctorError
 
     def close_(self, user):
-        if self.is_pod(user) and self._empty():
-            self._pods = []
-            self._open = False
-            usage_logger.log_pod_closes_shop(user)
-        elif not self.is_pod(user):
-            raise shop_check_in_exceptions.UnauthorizedUserError
-        else:
-            raise shop_check_in_exceptions.ShopOccupiedError
+        with self._lock:
+            if self.is_pod(user) and self._empty():
+                self._pods = []
+                self._pod_ids = set()
+                self._open = False
+                self._changed()
+                usage_logger.log_pod_closes_shop(user)
+            elif not self.is_pod(user):
+                raise shop_check_in_exceptions.UnauthorizedUserError
+            else:
+                raise shop_check_in_exceptions.ShopOccupiedError
     
     def is_pod(self, user):
-        return user in self._pods
+        return user.id_number in self._pod_ids
 
     def add_user_s_to_slot(self, user_s, slot):
         slot = int(slot)
-        if all(user.is_shop_certified() for user in user_s):
-            self._occupants[slot] = user_s
-            self._start_times[slot] = datetime.now()
+        with self._lock:
+            if all(user.is_shop_certified() for user in user_s):
+                self._set_slot(slot, user_s, datetime.now())
+                self._changed()
 
     def replace_or_transfer_user(self, slot, prev_slot):
         slot = int(slot)
         prev_slot = int(prev_slot)
 
         if slot != prev_slot:
-            self.log_exit(prev_slot)
-            self._occupants[slot] = self._occupants[prev_slot]
-            self._start_times[slot] = NO_TIME
-            self._occupants[prev_slot] = []
-            self._start_times[slot] = datetime.now()
+            with self._lock:
+                self.log_exit(prev_slot)
+                user_s = self._occupants[prev_slot]
+                self._set_slot(prev_slot, [], NO_TIME)
+                self._set_slot(slot, user_s, datetime.now())
+                self._changed()
         else:
             pass  # The user(s) remain in their current location.
 
     def discharge_user_s(self, slot):
         slot = int(slot)
-        occupants = self._occupants[slot]
-        self.log_exit(slot)
-        self._occupants[slot] = []
-        self._start_times[slot] = NO_TIME
+        with self._lock:
+            occupants = self._occupants[slot]
+            self.log_exit(slot)
+            self._set_slot(slot, [], NO_TIME)
+            self._changed()
         return occupants
 
     def get_user_s(self, slot):
@@ -73,17 +182,101 @@ class Shop(object):
         return [user.name for user in self._occupants[slot]]
 
     def change_pod(self, user):
-        if user.is_proctor() and not self.is_pod(user):
-            self._pods.append(user)
-            usage_logger.log_pod_arrives_at_shop(user)
-        elif self.is_pod(user) and len(self._pods) > 1:
-            self._pods.remove(user)
-            usage_logger.log_pod_exits_shop(user)
-        elif self.is_pod(user):
-            raise shop_check_in_exceptions.PodRequiredError
+        with self._lock:
+            if user.is_proctor() and not self.is_pod(user):
+                self._add_pod(user)
+                self._changed()
+                usage_logger.log_pod_arrives_at_shop(user)
+            elif self.is_pod(user) and len(self._pods) > 1:
+                self._pods = [pod for pod in self._pods if pod.id_number != user.id_number]
+                self._pod_ids.discard(user.id_number)
+                self._changed()
+                usage_logger.log_pod_exits_shop(user)
+            elif self.is_pod(user):
+                raise shop_check_in_exceptions.PodRequiredError
+
+    def slot_of(self, user):
+        """ The slot user is checked in to, in any station's slots, or None. """
+        return self._occupancy.slot_by_id.get(user.id_number)
+
+    def occupant_count(self):
+        """ How many users are checked in to this Shop's slots. """
+        return self._occupant_count
+
+    def sub_shop_occupant_count(self, sub_shop):
+        """ How many users are checked in to a sub-shop (as named in slots.SUB_SHOP_SLOTS), by any station. """
+        return self._occupancy.sub_shop_counts[sub_shop]
+
+    def total_occupant_count(self):
+        """ How many users are checked in, by any station. """
+        return self._occupancy.occupant_count
+
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        """ The ShopSnapshot published after the latest change. """
+        return self._snapshot
+
+    def occupancy_snapshot(self):
+        """ The OccupancySnapshot published after the latest change to any station's slots. """
+        return self._occupancy.snapshot
+
+    def wait_for_change(self, occupancy_version, timeout):
+        """ Waits up to timeout seconds for any station to change the shop. Returns the latest OccupancySnapshot.
+
+            Every change publishes a new OccupancySnapshot, so occupancy_version is the last one seen.
+        """
+        return self._occupancy.wait_for_change(occupancy_version, timeout)
+
+    def slots(self):
+        """ The slots this Shop looks after. """
+        return self._slots
+
+    def get_state(self):
+        """ Everything needed to put a Shop back the way it is now, as picklable builtins and ShopUsers. """
+        with self._lock:
+            return {'open': self._open,
+                    'pods': list(self._pods),
+                    'occupants': {slot: list(self._occupants[slot]) for slot in self._slots},
+                    'start_times': {slot: self._start_times[slot] for slot in self._slots}}
+
+    def set_state(self, state, resolve_user=None):
+        """ Puts the Shop back the way get_state() found it.
+
+            resolve_user maps each saved user to the one to use now, e.g. the
+            database's current copy of them. Only this Shop's slots are restored.
+        """
+        resolve_user = resolve_user if resolve_user is not None else (lambda user: user)
+        occupants = _by_slot(state['occupants'])
+        start_times = _by_slot(state['start_times'])
+        with self._lock:
+            self._open = state['open']
+            self._pods = []
+            self._pod_ids = set()
+            for user in state['pods']:
+                self._add_pod(resolve_user(user))
+            for slot in self._slots:
+                self._set_slot(slot, [resolve_user(user) for user in occupants.get(slot, [])],
+                               start_times.get(slot, NO_TIME))
+            self._changed()
+
+    def _add_pod(self, user):
+        self._pods.append(user)
+        self._pod_ids.add(user.id_number)
+
+    def _set_slot(self, slot, user_s, start_time):
+        self._occupant_count += len(user_s) - len(self._occupants[slot])
+        self._occupancy.set_slot(slot, user_s, start_time)
+
+    def _changed(self):
+        """ Publishes new snapshots; call with the lock held, after every change. """
+        self._version += 1
+        self._snapshot = ShopSnapshot(self._version, self._open, self._pods)
+        self._occupancy.publish()
 
     def _empty(self):
-        return all(self._occupants[slot] == [] for slot in SLOTS)
+        return self._occupant_count == 0
 
     def log_exit(self, slot):
         users = self._occupants[slot]
@@ -108,3 +301,8 @@ class Shop(object):
 
     def pods(self):
         return self._pods
+
+
+def _by_slot(values):
+    """ States saved before stations existed hold lists of every slot rather than dicts. """
+    return dict(enumerate(values)) if isinstance(values, list) else values
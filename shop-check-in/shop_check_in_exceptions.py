@@ -94,4 +94,20 @@ class PodCannotWorkError(FSMError):
 class UserAlreadySwipedError(FSMError):
     pass
 
+
+class UserAlreadyCheckedInError(FSMError):
+    pass
+
+
+class TransitionTableError(FSMError):
+    pass
+
+# endregion
+
+
+# region Station Errors
+
+class StationConfigError(ShopCheckInError):
+    pass
+
 # endregion
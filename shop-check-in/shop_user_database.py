@@ -1,6 +1,9 @@
 import cPickle
+import itertools
 import os
 import sys
+import threading
+import time
 
 import json
 #from oauth2client.client import SignedJwtAssertionCredentials
@@ -8,7 +11,9 @@ from oauth2client.service_account import ServiceAccountCredentials
 
 import gspread
 import gspread.exceptions
+import gspread.models
 
+import atomic_file
 import shop_user
 import shop_check_in_exceptions
 
@@ -18,11 +23,16 @@ SPREADSHEET = "Shop Users"
 SPREADSHEET_TESTING = "Shop Users Testing"
 WORKSHEET = "Raw Data"
 
-PATH_LOCAL_DATABASE = "resources\\shop_user_database_local_test.pkl"
-PATH_OUT_OF_SYNC_USERS = "resources\\out_of_sync_users_test.pkl"
-PATH_TESTING_LOCAL_DATABASE = "resources\\shop_user_database_local_test.pkl"
-PATH_TESTING_OUT_OF_SYNC_USERS = "resources\\out_of_sync_users_test.pkl"
-PATH_LOGIN_INFO = "resources\\sensitive_info.txt"
+RESOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Resources")
+PATH_LOCAL_DATABASE = os.path.join(RESOURCE_DIRECTORY, "shop_user_database_local_test.pkl")
+PATH_OUT_OF_SYNC_USERS = os.path.join(RESOURCE_DIRECTORY, "out_of_sync_users_test.pkl")
+PATH_TESTING_LOCAL_DATABASE = os.path.join(RESOURCE_DIRECTORY, "shop_user_database_local_test.pkl")
+PATH_TESTING_OUT_OF_SYNC_USERS = os.path.join(RESOURCE_DIRECTORY, "out_of_sync_users_test.pkl")
+PATH_LOGIN_INFO = os.path.join(RESOURCE_DIRECTORY, "sensitive_info.txt")
+
+SYNC_BATCH_SIZE = 50  # Users per spreadsheet write.
+SYNC_INITIAL_BACKOFF_SECONDS = 1
+SYNC_MAX_BACKOFF_SECONDS = 5 * 60
 
 
 class ShopUserDatabase(object):
@@ -31,16 +41,27 @@ class ShopUserDatabase(object):
                  path_local_database=PATH_LOCAL_DATABASE,
                  path_out_of_sync_users=PATH_OUT_OF_SYNC_USERS):
         self._shop_user_database = {}
-        self._out_of_sync_users = []
         self._spreadsheet_name = spreadsheet_name
+        self._lock = threading.RLock()  # Guards _shop_user_database; users are looked up from lookup pool threads.
 
-        self._shop_user_database_google_worksheet = None
+        # Each thread looking users up has a spreadsheet connection of its own, so lookups run side by side.
+        self._lookup_connections = threading.local()
         self._shop_user_database_local = _ShopUserDatabaseLocal(path_local_database, path_out_of_sync_users)
 
+        # Debt changes reach the spreadsheet in the background, over a connection of the worker's own.
+        self._debt_sync_worker = _DebtSyncWorker(lambda: _ShopUserDatabaseGoogleWorksheet(spreadsheet_name),
+                                                 self._shop_user_database_local.dump_out_of_sync_users,
+                                                 self._shop_user_database_local.load_out_of_sync_users())
+
         self._initialize_database()
+        with self._lock:
+            # The sheet and the local copy don't have the changes that hadn't been synced yet.
+            for user in self._shop_user_database.itervalues():
+                self._apply_pending_change(user)
+        self._debt_sync_worker.start()
 
     def __del__(self):
-        self._shop_user_database_local.dump_data(self._shop_user_database, self._out_of_sync_users)
+        self._shop_user_database_local.dump_data(self._shop_user_database, self._debt_sync_worker.pending())
 
     def get_shop_user(self, id_number):
         try:
@@ -55,66 +76,67 @@ class ShopUserDatabase(object):
         self._change_debt(user, 0)
 
     def _change_debt(self, user, new_debt):
-        try:
-            self._shop_user_database[user.id_number].debt = new_debt
-        except KeyError:
-            exc_traceback = sys.exc_traceback
-            raise shop_check_in_exceptions.NonexistentUserError, None, exc_traceback
-        else:
-            self._out_of_sync_users.append(user)
-            self._synchronize_databases()
+        with self._lock:
+            try:
+                self._shop_user_database[user.id_number].debt = new_debt
+            except KeyError:
+                exc_traceback = sys.exc_traceback
+                raise shop_check_in_exceptions.NonexistentUserError, None, exc_traceback
+            else:
+                self._debt_sync_worker.enqueue(self._shop_user_database[user.id_number])
 
     def _connect_to_google_spreadsheet(self):
-        if self._shop_user_database_google_worksheet is None:
+        """ Returns this thread's connection to the spreadsheet, connecting (again) if need be. """
+        worksheet = getattr(self._lookup_connections, 'worksheet', None)
+        if worksheet is None:
             try:
                 print "Trying to load the spreadsheet",self._spreadsheet_name
-                self._shop_user_database_google_worksheet = _ShopUserDatabaseGoogleWorksheet(self._spreadsheet_name)
+                worksheet = _ShopUserDatabaseGoogleWorksheet(self._spreadsheet_name)
                 print "Spreadsheet loaded!"
             except (gspread.AuthenticationError, IOError):
                 print "Authentication/IOError"
                 exc_traceback = sys.exc_traceback
                 raise shop_check_in_exceptions.CannotAccessGoogleSpreadsheetsError, None, exc_traceback
+            self._lookup_connections.worksheet = worksheet
         else:
             print "Okay, testing connection"
             try:
-                self._shop_user_database_google_worksheet.test_connection()
+                worksheet.test_connection()
             except (IOError, Exception):
-                self._shop_user_database_google_worksheet = None
-                self._connect_to_google_spreadsheet()
+                self._lookup_connections.worksheet = None
+                return self._connect_to_google_spreadsheet()
+        return worksheet
 
     def _get_shop_user_from_google_spreadsheet(self, id_number):
+        # No lock around the round trip: it would hold up the other lookups and the FSM's debt changes.
         try:
-            self._connect_to_google_spreadsheet()
-            user_data = self._shop_user_database_google_worksheet.get_shop_user_data(id_number)
+            user_data = self._connect_to_google_spreadsheet().get_shop_user_data(id_number)
         except (shop_check_in_exceptions.CannotAccessGoogleSpreadsheetsError, gspread.exceptions.CellNotFound, IOError):
             exc_traceback = sys.exc_traceback
             raise shop_check_in_exceptions.NonexistentUserError, None, exc_traceback
         else:
             user = shop_user.ShopUser(user_data)
-            self._shop_user_database[user.id_number] = user
-            return user
+            with self._lock:
+                # Someone else may have looked them up meanwhile, and had their debt changed since.
+                if user.id_number not in self._shop_user_database:
+                    self._apply_pending_change(user)
+                return self._shop_user_database.setdefault(user.id_number, user)
+
+    def _apply_pending_change(self, user):
+        """ Brings user up to date with their change, if it is still waiting to be synced. """
+        change = self._debt_sync_worker.pending_change(user.id_number)
+        if change is not None:
+            user.debt, proctorliness = change
+            user._proctor = proctorliness == shop_user.IS_PROCTOR
 
     def _initialize_database(self):
         print "Trying to connect to spreadsheet"
         try:
-            self._connect_to_google_spreadsheet()
+            worksheet = self._connect_to_google_spreadsheet()
             print "Successfully connected to spreadsheet"
-            self._shop_user_database = self._shop_user_database_google_worksheet.load_shop_user_database()
+            self._shop_user_database = worksheet.load_shop_user_database()
         except (gspread.GSpreadException, shop_check_in_exceptions.CannotAccessGoogleSpreadsheetsError):
             self._shop_user_database = self._shop_user_database_local.load_shop_user_database()
-        else:
-            self._out_of_sync_users = self._shop_user_database_local.load_out_of_sync_users()
-            self._synchronize_databases()
-
-    def _synchronize_databases(self):
-            try:
-                self._connect_to_google_spreadsheet()
-                for user in self._out_of_sync_users:
-                    self._shop_user_database_google_worksheet.update_user(user)
-            except (gspread.GSpreadException, IOError):
-                pass
-            else:
-                self._out_of_sync_users = []
 
 
 class ShopUserDatabaseTesting(ShopUserDatabase):
@@ -155,11 +177,11 @@ class _ShopUserDatabaseGoogleWorksheet(object):
         for user in shop_users:
             if user.validation_required_changes():
                 print 'Need to update:', user.name
-        try:
-                   self.update_user(user)
-        except:
-           print 'Update for %s failed' % user.name
-                print 'Updates done'
+                try:
+                    self.update_user(user)
+                except:
+                    print 'Update for %s failed' % user.name
+        print 'Updates done'
         shop_user_database = {user.id_number: user for user in shop_users}
         return shop_user_database
 
@@ -174,6 +196,22 @@ class _ShopUserDatabaseGoogleWorksheet(object):
         self._change_debt(user.id_number, user.debt)
         self._update_proctorliness(user)
 
+    def update_sync_values(self, sync_values_by_id):
+        """ Writes {ID number: (debt, proctorliness)} in one request. IDs not in the worksheet are skipped. """
+        # Rows move when the sheet is sorted or added to, so the ID column is read afresh for every batch.
+        id_column = self._worksheet.col_values(shop_user.ID + 1)  # gspread is 1-indexed.
+        rows_by_id = {id_number: index + 1 for index, id_number in enumerate(id_column)}
+        cells = []
+        for id_number, (debt, proctorliness) in sync_values_by_id.iteritems():
+            row = rows_by_id.get(id_number)
+            if row is None:
+                print "Can't sync user %s: not in the spreadsheet" % id_number
+                continue
+            cells.append(gspread.models.Cell(row, shop_user.DEBT + 1, debt))
+            cells.append(gspread.models.Cell(row, shop_user.PROCTOR + 1, proctorliness))
+        if cells:
+            self._worksheet.update_cells(cells)
+
     def _get_login_info(self):
         with open(PATH_LOGIN_INFO, "r") as login_info:
             return dict([line.split() for line in login_info])
@@ -200,30 +238,106 @@ class _ShopUserDatabaseLocal(object):
         return self._load_file(self._database_file_path)
 
     def load_out_of_sync_users(self):
-        return self._load_file(self._out_of_date_users_file_path)
+        """ Returns {ID number: (debt, proctorliness)} of the changes not synced yet. """
+        try:
+            out_of_sync_users = self._load_file(self._out_of_date_users_file_path)
+        except (IOError, EOFError):
+            return {}
+        if isinstance(out_of_sync_users, list):  # Saved by an older version, as the changed users.
+            return {user.id_number: sync_values(user) for user in out_of_sync_users}
+        return out_of_sync_users
+
+    def dump_out_of_sync_users(self, out_of_sync_users):
+        self._dump_file(self._out_of_date_users_file_path, out_of_sync_users)
 
     def dump_data(self, database, out_of_sync_users):
         self._dump_file(self._database_file_path, database)
-        self._dump_file(self._out_of_date_users_file_path, out_of_sync_users)
-
-    def _correct_current_working_directory(self):
-        absolute_path = os.path.abspath(__file__)
-        directory_name = os.path.dirname(absolute_path)
-        os.chdir(directory_name)
+        self.dump_out_of_sync_users(out_of_sync_users)
 
     def _load_file(self, file_path):
-        self._correct_current_working_directory()
+        if not os.path.exists(file_path) and os.path.exists(file_path + atomic_file.TEMPORARY_SUFFIX):
+            file_path += atomic_file.TEMPORARY_SUFFIX  # A dump died mid-replace.
         with open(file_path, 'rb') as file_:
             return cPickle.load(file_)
 
     def _dump_file(self, file_path, dumpee):
-        self._correct_current_working_directory()
-        self._erase_file(file_path)
-
-        with open(file_path, 'wb') as file_:
-            cPickle.dump(dumpee, file_)
-
-    def _erase_file(self, file_path):
-        self._correct_current_working_directory()
-        with open(file_path, "wb") as file_:
-            file_.truncate()
\ No newline at end of file
+        atomic_file.write_atomically(file_path, lambda file_: cPickle.dump(dumpee, file_))
+
+
+def sync_values(user):
+    """ What the spreadsheet needs to know about a changed user: (debt, proctorliness). """
+    return user.debt, shop_user.IS_PROCTOR if user._proctor else shop_user.IS_NOT_PROCTOR
+
+
+class _DebtSyncWorker(threading.Thread):
+    """ Writes changed users to the spreadsheet in the background, in batches.
+
+        Changes are kept by ID number, so a user changed many times between
+        syncs is written once, with their latest values. They are saved
+        locally on every change, so they survive restarts, and dropped once
+        written. When the spreadsheet can't be reached the worker backs off,
+        doubling the wait up to max_backoff_seconds.
+    """
+
+    def __init__(self, connect, save_pending, pending=None, batch_size=SYNC_BATCH_SIZE,
+                 initial_backoff_seconds=SYNC_INITIAL_BACKOFF_SECONDS, max_backoff_seconds=SYNC_MAX_BACKOFF_SECONDS):
+        super(_DebtSyncWorker, self).__init__()
+        self.daemon = True
+        self._connect = connect  # Returns a _ShopUserDatabaseGoogleWorksheet.
+        self._save_pending = save_pending
+        self._pending = dict(pending) if pending else {}  # ID number -> sync_values()
+        self._pending_changed = threading.Condition()
+        self._batch_size = batch_size
+        self._initial_backoff_seconds = initial_backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._worksheet = None
+
+    def enqueue(self, user):
+        """ Saves user's change locally; never touches the network. """
+        with self._pending_changed:
+            self._pending[user.id_number] = sync_values(user)
+            self._save_pending(dict(self._pending))
+            self._pending_changed.notify()
+
+    def pending(self):
+        with self._pending_changed:
+            return dict(self._pending)
+
+    def pending_change(self, id_number):
+        """ The sync_values() waiting to be written for id_number, or None. """
+        with self._pending_changed:
+            return self._pending.get(id_number)
+
+    def run(self):
+        backoff_seconds = 0
+        while True:
+            with self._pending_changed:
+                while not self._pending:
+                    self._pending_changed.wait()
+            if self.sync_once():
+                backoff_seconds = 0
+            else:
+                backoff_seconds = min(max(2 * backoff_seconds, self._initial_backoff_seconds),
+                                      self._max_backoff_seconds)
+                time.sleep(backoff_seconds)
+
+    def sync_once(self):
+        """ Writes one batch of pending changes. Returns False if the spreadsheet couldn't be written. """
+        with self._pending_changed:
+            batch = dict(itertools.islice(self._pending.iteritems(), self._batch_size))
+        if not batch:
+            return True
+        try:
+            if self._worksheet is None:
+                self._worksheet = self._connect()
+            self._worksheet.update_sync_values(batch)
+        except Exception as error:  # Whatever the network throws, the changes stay pending.
+            print "Debt sync failed, will retry: %s" % error
+            self._worksheet = None
+            return False
+        with self._pending_changed:
+            for id_number, values in batch.iteritems():
+                if self._pending.get(id_number) == values:  # Unless it changed again meanwhile.
+                    del self._pending[id_number]
+            self._save_pending(dict(self._pending))
+        return True
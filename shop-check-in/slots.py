@@ -30,6 +30,11 @@ _MAIN_SHOP_SLOTS = [1, 2, 3, 4, 5, 27, 28, 29, 30, 31]
 _WOOD_SHOP_SLOTS = [6, 7, 8, 9, 10, 22, 23, 24, 25, 26]
 _SHEET_METAL_SHOP_SLOTS = [11, 12, 13, 14, 15, 17, 18, 19, 20, 21]
 
+# Sub-shop name (as in which_sub_shop) -> its slots
+SUB_SHOP_SLOTS = {'main': _MAIN_SHOP_SLOTS,
+                  'wood': _WOOD_SHOP_SLOTS,
+                  'sheet': _SHEET_METAL_SHOP_SLOTS}
+
 # Mapping from slot to machine - constructed based on previous data
 _SLOT_TO_MACHINE_MAP = {}
 # Add the specific machines to the map
@@ -0,0 +1,116 @@
+import cPickle
+import os
+import struct
+import time
+import zlib
+
+import atomic_file
+
+"""
+Crash-safe storage of the board's state, so that a restarted board comes back
+with the shop open, the same POD(s) on duty, everyone still checked in to
+their machines and the FSM in the state it was in.
+
+The journal is a single append-only file of records, each one a complete
+snapshot (a few hundred bytes of pickle) framed as
+
+    length (4 bytes) | CRC32 of the payload (4 bytes) | payload
+
+Every change appends one record and flushes it, which is all a process crash
+needs; a torn or corrupt record at the end of the file (from a power cut
+mid-write) is ignored, so loading returns the last snapshot that was written
+completely. To keep loading fast, the journal is periodically compacted:
+rewritten as a single record in a temporary file which then atomically
+replaces the journal. Until it does, the temporary file holds the newest
+snapshot, so loading reads it first: one that is complete is from a
+compaction that died before its rename.
+
+    journal = StateJournal()
+    snapshot = journal.load()  # None the first time.
+    ...
+    journal.record(snapshot)
+"""
+
+DEFAULT_PATH = os.path.join(".", "state", "board_state.journal")
+COMPACT_EVERY_RECORDS = 256
+COMPACT_INTERVAL_SECONDS = 60 * 60
+
+_HEADER = struct.Struct('<II')
+
+
+class StateJournal(object):
+
+    def __init__(self, path=DEFAULT_PATH, compact_every_records=COMPACT_EVERY_RECORDS,
+                 compact_interval_seconds=COMPACT_INTERVAL_SECONDS, sync=False, clock=time.time):
+        """ With sync, every record is fsynced too, which survives power cuts at the cost of a disk flush. """
+        self._path = path
+        self._compact_every_records = compact_every_records
+        self._compact_interval_seconds = compact_interval_seconds
+        self._sync = sync
+        self._clock = clock
+        self._file = None
+        self._records_since_compaction = 0
+        self._last_compaction_time = clock()
+
+    def load(self):
+        """ Returns the last snapshot recorded, or None if there is none. """
+        for path in (self._path + atomic_file.TEMPORARY_SUFFIX, self._path):  # Newest first; see above.
+            try:
+                with open(path, 'rb') as journal_file:
+                    data = journal_file.read()
+            except IOError:
+                continue
+            snapshot = _last_snapshot(data)
+            if snapshot is not None:
+                return snapshot
+        return None
+
+    def record(self, snapshot):
+        """ Appends snapshot, compacting the journal instead when it is due. """
+        if (self._file is None or self._records_since_compaction >= self._compact_every_records or
+                self._clock() - self._last_compaction_time >= self._compact_interval_seconds):
+            self.compact(snapshot)
+            return
+        self._file.write(_frame(snapshot))
+        self._flush(self._file)
+        self._records_since_compaction += 1
+
+    def compact(self, snapshot):
+        """ Atomically replaces the journal with one holding only snapshot. """
+        self.close()
+        atomic_file.write_atomically(self._path, lambda journal_file: journal_file.write(_frame(snapshot)))
+        self._file = open(self._path, 'ab')
+        self._records_since_compaction = 0
+        self._last_compaction_time = self._clock()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _flush(self, journal_file):
+        journal_file.flush()
+        if self._sync:
+            os.fsync(journal_file.fileno())
+
+
+def _frame(snapshot):
+    payload = cPickle.dumps(snapshot, cPickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload
+
+
+def _last_snapshot(data):
+    snapshot = None
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        payload = data[offset + _HEADER.size:offset + _HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            break  # Torn or corrupt; nothing after it can be trusted.
+        try:
+            snapshot = cPickle.loads(payload)
+        except Exception:
+            break
+        offset += _HEADER.size + length
+    return snapshot
+
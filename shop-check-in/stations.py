@@ -0,0 +1,127 @@
+import json
+import os
+import Queue as queue
+
+import fsm
+import id_logger
+import io_moderator
+import shop
+import shop_check_in_exceptions
+import slots
+import state_journal
+
+"""
+Check-in stations: one board per sub-shop, all run by one process.
+
+Each station has its own event and message queues, serial port, card reader,
+BoardFsm and state journal, and looks after its own slots. The stations share
+the shop user database (and its lookup pool), the shop's Occupancy, the mail
+outbox and the status website. Stations are described in a JSON file passed to main.py with
+--stations:
+
+    [{"name": "main", "port": "COM4", "slots": "main"},
+     {"name": "wood", "port": "COM5", "slots": [6, 7, 8, 9, 10],
+      "reader": "tty", "reader_path": "COM6"}]
+
+"slots" is a list of slot numbers or the name of a sub-shop in slots.py.
+"reader" is an id_logger backend (default "pyhook"); the Windows keyboard hook
+sees every reader plugged into the machine, so at most one station may use it.
+"journal" is where the station's state is recorded (default
+state/<name>.journal). "framed": true offers the board the framed link protocol
+(see board_protocol); only set it for firmware that speaks it.
+"""
+
+DEFAULT_READER = 'pyhook'
+STATE_DIRECTORY = os.path.dirname(state_journal.DEFAULT_PATH)
+
+
+class StationConfig(object):
+
+    def __init__(self, name=None, port=io_moderator.COM_PORT, slots_=slots.SLOTS, reader=DEFAULT_READER,
+                 reader_path=None, journal_path=None, framed=False):
+        """ The unnamed station is the whole shop on one board, as before there were stations. """
+        self.name = name
+        self.port = port
+        self.slots = list(slots_)
+        self.reader = reader
+        self.reader_path = reader_path
+        if journal_path is None:
+            journal_path = (state_journal.DEFAULT_PATH if name is None
+                            else os.path.join(STATE_DIRECTORY, "%s.journal" % name))
+        self.journal_path = journal_path
+        self.framed = framed
+
+    def make_reader(self):
+        return id_logger.make_backend(self.reader, self.reader_path)
+
+
+def load_station_configs(path):
+    """ Reads and checks a --stations file. Raises StationConfigError if it doesn't make sense. """
+    try:
+        with open(path, 'r') as config_file:
+            entries = json.load(config_file)
+    except (IOError, ValueError) as error:
+        raise shop_check_in_exceptions.StationConfigError("Can't read %s: %s" % (path, error))
+    configs = [_station_config(entry) for entry in entries]
+    check_station_configs(configs)
+    return configs
+
+
+def _station_config(entry):
+    try:
+        name = entry['name']
+        slots_ = entry['slots']
+    except KeyError as error:
+        raise shop_check_in_exceptions.StationConfigError("Station %r needs a %s" % (entry, error))
+    if not isinstance(slots_, list):
+        try:
+            slots_ = slots.SUB_SHOP_SLOTS[slots_]
+        except KeyError:
+            raise shop_check_in_exceptions.StationConfigError("Station %s: no sub-shop called %s" % (name, slots_))
+    return StationConfig(name, entry.get('port', io_moderator.COM_PORT), slots_,
+                         entry.get('reader', DEFAULT_READER), entry.get('reader_path'), entry.get('journal'),
+                         entry.get('framed', False))
+
+
+def check_station_configs(configs):
+    owners = {}
+    for config in configs:
+        if config.reader not in id_logger.BACKENDS:
+            raise shop_check_in_exceptions.StationConfigError("Station %s: unknown reader %s" %
+                                                              (config.name, config.reader))
+        for slot in config.slots:
+            if slot not in slots.SLOTS:
+                raise shop_check_in_exceptions.StationConfigError("Station %s: no slot %s" % (config.name, slot))
+            if slot in owners:
+                raise shop_check_in_exceptions.StationConfigError("Stations %s and %s both own slot %d" %
+                                                                  (owners[slot], config.name, slot))
+            owners[slot] = config.name
+    for attribute in ('name', 'port', 'journal_path'):
+        values = [getattr(config, attribute) for config in configs]
+        if len(set(values)) != len(values):
+            raise shop_check_in_exceptions.StationConfigError("Stations must have different %ss" % attribute)
+    if sum(1 for config in configs if config.reader == DEFAULT_READER) > 1:
+        raise shop_check_in_exceptions.StationConfigError("Only one station can use the %s reader" % DEFAULT_READER)
+
+
+class Station(object):
+    """ One check-in board: its queues, serial port, card reader and BoardFsm. """
+
+    def __init__(self, config, shop_user_db, user_lookup_pool, occupancy, mailer=None):
+        self.name = config.name
+        self.event_q = queue.Queue()
+        self.message_q = io_moderator.MessageQueue()
+        self.shop = shop.Shop(occupancy, config.slots)
+
+        self._id_logger = id_logger.IdLogger(self.event_q, config.make_reader(), user_lookup_pool)
+        self._io_moderator = io_moderator.IoModerator(self.event_q, self.message_q, port=config.port,
+                                                      negotiate=config.framed, slots_=config.slots)
+        self.board = fsm.BoardFsm(self.event_q, self.message_q, shop_user_db, mailer,
+                                  journal=state_journal.StateJournal(config.journal_path),
+                                  shop_=self.shop, name=config.name)
+
+    def start_io(self):
+        """ Starts reading the card reader and talking to the board, each on a daemon thread. """
+        for thread in (self._id_logger, self._io_moderator):
+            thread.daemon = True
+            thread.start()
@@ -0,0 +1,109 @@
+import time
+
+FRAME_START = ';'
+FRAME_END = '\x00'
+FRAME_DIGIT_COUNT = 10
+
+# The ID number is the frame's digits minus the first and last check digits.
+ID_START_INDEX = 1
+ID_END_INDEX = FRAME_DIGIT_COUNT - 1
+
+_WAITING_FOR_START = 0
+_READING_DIGITS = 1
+_WAITING_FOR_END = 2
+
+_ORD_ZERO = ord('0')
+_ORD_NINE = ord('9')
+
+
+class SwipeParser(object):
+    """ Incrementally decodes card swipes from a stream of keyboard characters.
+
+        A swipe is the frame ';' + 10 digits + NUL. Each character is examined
+        exactly once and the digits are kept in a preallocated buffer, so
+        feeding a character that does not complete a frame does no allocation.
+
+        Timing counters cover each frame from its ';' to its NUL.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._state = _WAITING_FOR_START
+        self._digits = bytearray(FRAME_DIGIT_COUNT)
+        self._digit_count = 0
+        self._frame_start_time = 0.0
+
+        self.characters_parsed = 0
+        self.frames_parsed = 0
+        self.frames_aborted = 0
+        self.total_frame_seconds = 0.0
+        self.max_frame_seconds = 0.0
+        self.last_frame_seconds = 0.0
+
+    def feed(self, char):
+        """ Returns the ID number if char completes a swipe, otherwise None. """
+        self.characters_parsed += 1
+        state = self._state
+
+        if state == _READING_DIGITS:
+            code = ord(char)
+            if _ORD_ZERO <= code <= _ORD_NINE:
+                self._digits[self._digit_count] = code
+                self._digit_count += 1
+                if self._digit_count == FRAME_DIGIT_COUNT:
+                    self._state = _WAITING_FOR_END
+                return None
+        elif state == _WAITING_FOR_END:
+            if char == FRAME_END:
+                return self._complete_frame()
+        elif char == FRAME_START:
+            self._start_frame()
+            return None
+        else:
+            return None
+
+        # The frame was broken; a ';' may begin the next one.
+        self.frames_aborted += 1
+        if char == FRAME_START:
+            self._start_frame()
+        else:
+            self._state = _WAITING_FOR_START
+        return None
+
+    def feed_string(self, chars):
+        """ Feeds every character of chars, returning the list of decoded ID numbers. """
+        id_numbers = []
+        for char in chars:
+            id_number = self.feed(char)
+            if id_number is not None:
+                id_numbers.append(id_number)
+        return id_numbers
+
+    def reset(self):
+        self._state = _WAITING_FOR_START
+        self._digit_count = 0
+
+    def stats(self):
+        average = self.total_frame_seconds / self.frames_parsed if self.frames_parsed else 0.0
+        return {'characters_parsed': self.characters_parsed,
+                'frames_parsed': self.frames_parsed,
+                'frames_aborted': self.frames_aborted,
+                'last_frame_seconds': self.last_frame_seconds,
+                'max_frame_seconds': self.max_frame_seconds,
+                'average_frame_seconds': average}
+
+    def _start_frame(self):
+        self._state = _READING_DIGITS
+        self._digit_count = 0
+        self._frame_start_time = self._clock()
+
+    def _complete_frame(self):
+        frame_seconds = self._clock() - self._frame_start_time
+        self.frames_parsed += 1
+        self.total_frame_seconds += frame_seconds
+        self.last_frame_seconds = frame_seconds
+        if frame_seconds > self.max_frame_seconds:
+            self.max_frame_seconds = frame_seconds
+
+        self._state = _WAITING_FOR_START
+        return str(self._digits[ID_START_INDEX:ID_END_INDEX])
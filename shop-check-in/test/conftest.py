@@ -0,0 +1,12 @@
+import pytest
+
+import shop_user_database
+
+
+@pytest.fixture(autouse=True)
+def local_testing_database(monkeypatch, tmpdir):
+    """ Keeps ShopUserDatabaseTesting's local copies in tmpdir, away from the ones in Resources. """
+    monkeypatch.setattr(shop_user_database, 'PATH_TESTING_LOCAL_DATABASE',
+                        str(tmpdir.join("shop_user_database_local_test.pkl")))
+    monkeypatch.setattr(shop_user_database, 'PATH_TESTING_OUT_OF_SYNC_USERS',
+                        str(tmpdir.join("out_of_sync_users_test.pkl")))
@@ -0,0 +1,48 @@
+import asyncore
+import smtpd
+import threading
+"""
+A local SMTP server standing in for Gmail in tests: it accepts mail on
+127.0.0.1 without TLS or a login and keeps what it receives.
+
+    server = SmtpStandIn()
+    server.start()
+    mailer = Mailer(server.address, use_tls=False, username="shop@example.com")
+    ...
+    server.stop()
+"""
+
+
+class SmtpStandIn(smtpd.SMTPServer):
+
+    def __init__(self, port=0):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', port), None)
+        self.address = "127.0.0.1:%d" % self.socket.getsockname()[1]
+        self.received = []  # (from address, to addresses, message)
+        self.sessions = 0  # Connections accepted
+        self.rejected_addresses = set()  # Mail to these is refused with a permanent error.
+        self._thread = None
+
+    def handle_accept(self):
+        self.sessions += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def drop_sessions(self):
+        """ Hangs up on every client, as a server timing out idle sessions would. """
+        for channel in asyncore.socket_map.values():
+            if channel is not self:
+                channel.close()
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.rejected_addresses.intersection(rcpttos):
+            return "554 Message rejected"
+        self.received.append((mailfrom, rcpttos, data))
+
+    def start(self):
+        self._thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        asyncore.close_all()  # The server and its connections; asyncore.loop returns once there are none.
+        self._thread.join(1)
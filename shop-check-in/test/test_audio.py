@@ -0,0 +1,73 @@
+import os
+import threading
+
+import audio
+import fsm
+
+IDLE_TIMEOUT = 1
+
+
+class _BlockingBackend(object):
+
+    def __init__(self):
+        self.played = []
+        self.playing = threading.Event()
+        self.release = threading.Event()
+
+    def play(self, wav_data):
+        self.playing.set()
+        self.release.wait(IDLE_TIMEOUT)
+        self.played.append(wav_data)
+
+
+class TestLoadSounds(object):
+
+    def test_windows_path_with_other_case(self):
+        sound_data = audio.load_sounds([fsm.NOISE_CHARGING_USER], fsm.SOUND_DIRECTORY)
+
+        assert sound_data[fsm.NOISE_CHARGING_USER][:4] == "RIFF"
+
+    def test_missing_sound_skipped(self):
+        assert audio.load_sounds(["resources\\sounds\\no_such_sound.wav"], fsm.SOUND_DIRECTORY) == {}
+
+    def test_resolve_sound_path(self):
+        path = audio.resolve_sound_path("RESOURCES/Sounds/sad_trombone.wav", fsm.SOUND_DIRECTORY)
+
+        assert path == os.path.join(fsm.SOUND_DIRECTORY, "Resources", "sounds", "Sad_Trombone.wav")
+
+
+class TestAudioWorker(object):
+
+    def test_plays_in_order(self):
+        backend = _BlockingBackend()
+        backend.release.set()
+        worker = audio.AudioWorker({"ding": "DING", "buzz": "BUZZ"}, backend)
+
+        worker.play("ding")
+        assert worker.wait_until_idle(IDLE_TIMEOUT)
+        worker.play("buzz")
+        assert worker.wait_until_idle(IDLE_TIMEOUT)
+
+        assert backend.played == ["DING", "BUZZ"]
+
+    def test_merges_and_drops_while_busy(self):
+        backend = _BlockingBackend()
+        worker = audio.AudioWorker({"a": "A", "b": "B", "c": "C", "d": "D"}, backend, max_pending=2)
+        worker.play("a")
+        assert backend.playing.wait(IDLE_TIMEOUT)  # The worker has taken "a" off its queue.
+
+        for sound in ["b", "b", "c", "d"]:
+            worker.play(sound)
+        backend.release.set()
+        assert worker.wait_until_idle(IDLE_TIMEOUT)
+
+        assert backend.played == ["A", "C", "D"]
+        assert worker.stats()['merged'] == 1
+        assert worker.stats()['dropped'] == 1
+
+    def test_unknown_sound_ignored(self):
+        worker = audio.AudioWorker({}, audio.NullBackend())
+
+        worker.play("ding")
+
+        assert worker.stats()['missing'] == 1
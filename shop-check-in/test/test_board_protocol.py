@@ -0,0 +1,120 @@
+import board_protocol
+
+EVENT = board_protocol.FRAME_EVENT
+
+
+class _FakeSerialPort(object):
+
+    def __init__(self, replies=None):
+        self.written = []
+        self._replies = list(replies or [])
+
+    def write(self, data):
+        self.written.append(data)
+
+    def inWaiting(self):
+        return len(self._replies[0]) if self._replies else 0
+
+    def read(self, size):
+        return self._replies.pop(0) if self._replies else ""
+
+
+def _frames(*sequences_and_payloads):
+    return "".join(board_protocol.encode_frame(EVENT, sequence, payload)
+                   for sequence, payload in sequences_and_payloads)
+
+
+class TestFrameDecoder(object):
+
+    def test_round_trip(self):
+        decoder = board_protocol.FrameDecoder()
+
+        assert decoder.feed(_frames((0, "M15"), (1, "B1"))) == [(EVENT, 0, "M15"), (EVENT, 1, "B1")]
+
+    def test_partial_frame(self):
+        decoder = board_protocol.FrameDecoder()
+        data = _frames((0, "M15"))
+
+        assert decoder.feed(data[:4]) == []
+        assert decoder.feed(data[4:]) == [(EVENT, 0, "M15")]
+
+    def test_corrupt_frame_skipped(self):
+        decoder = board_protocol.FrameDecoder()
+        corrupt = _frames((0, "M15")).replace("M15", "M16")
+
+        assert decoder.feed("junk" + corrupt + _frames((1, "B1"))) == [(EVENT, 1, "B1")]
+        assert decoder.checksum_errors == 1
+
+
+class TestFramedProtocol(object):
+
+    def test_in_order(self):
+        protocol = board_protocol.FramedProtocol()
+        control = []
+
+        assert protocol.feed(_frames((0, "M15"), (1, "M05")), control.append) == ["M15", "M05"]
+        assert control == []
+
+    def test_duplicate_dropped(self):
+        protocol = board_protocol.FramedProtocol()
+
+        assert protocol.feed(_frames((0, "B1"), (0, "B1")), lambda data: None) == ["B1"]
+        assert protocol.duplicate_frames == 1
+
+    def test_gap_requests_retransmit_and_reorders(self):
+        protocol = board_protocol.FramedProtocol()
+        control = []
+
+        assert protocol.feed(_frames((0, "B0"), (2, "B2")), control.append) == ["B0"]
+        assert control == [board_protocol.encode_frame(board_protocol.FRAME_RETRANSMIT,
+                                                       board_protocol.NO_SEQUENCE, chr(1))]
+        assert protocol.feed(_frames((1, "B1")), control.append) == ["B1", "B2"]
+
+    def test_gap_given_up_when_window_overflows(self):
+        protocol = board_protocol.FramedProtocol()
+        ahead = [(sequence, "B1") for sequence in xrange(2, 3 + board_protocol.REORDER_WINDOW)]
+
+        messages = protocol.feed(_frames((0, "B0"), *ahead), lambda data: None)
+
+        assert messages == ["B0"] + ["B1"] * len(ahead)
+        assert protocol.frames_lost == 1
+
+    def test_sequence_wraps(self):
+        protocol = board_protocol.FramedProtocol()
+
+        assert protocol.feed(_frames((255, "B0"), (0, "B1")), lambda data: None) == ["B0", "B1"]
+
+    def test_retransmit_display_frame(self):
+        protocol = board_protocol.FramedProtocol()
+        serial_port = _FakeSerialPort()
+        protocol.write_display(serial_port, "\0HELLO")
+
+        retransmit_request = board_protocol.encode_frame(board_protocol.FRAME_RETRANSMIT,
+                                                         board_protocol.NO_SEQUENCE, chr(0))
+        protocol.feed(retransmit_request, serial_port.write)
+
+        assert serial_port.written == [serial_port.written[0]] * 2
+        assert protocol.retransmits_sent == 1
+
+
+class TestNegotiate(object):
+
+    def test_framed_board(self):
+        hello = board_protocol.encode_frame(board_protocol.FRAME_HELLO, board_protocol.NO_SEQUENCE,
+                                            chr(board_protocol.PROTOCOL_VERSION))
+        serial_port = _FakeSerialPort([hello + _frames((0, "S1"))])
+
+        protocol = board_protocol.negotiate(serial_port)
+
+        assert protocol.name == "framed"
+        assert protocol.read_messages(serial_port) == ["S1"]
+
+    def test_legacy_board(self):
+        ticks = iter(xrange(10))
+        serial_port = _FakeSerialPort(["S1\r\nM1"])
+
+        protocol = board_protocol.negotiate(serial_port, timeout=2, clock=lambda: next(ticks))
+
+        assert protocol.name == "legacy"
+        assert protocol.read_messages(serial_port) == ["S1"]
+        assert protocol.feed("5\r\n") == ["M15"]
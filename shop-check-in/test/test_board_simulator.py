@@ -0,0 +1,37 @@
+import board_simulator
+import fsm
+
+
+class TestBoardSimulator(object):
+
+    def test_scripted_day(self):
+        benchmark = board_simulator.LatencyBenchmark(interval=0)
+        benchmark.run(board_simulator.DEFAULT_SCRIPT)
+
+        assert benchmark.unanswered == {}
+        assert sum(len(latencies) for latencies in benchmark.latencies.values()) == \
+            len(board_simulator.DEFAULT_SCRIPT)
+        assert benchmark._board._state == fsm.CLOSED
+
+    def test_scripted_day_framed(self):
+        benchmark = board_simulator.LatencyBenchmark(interval=0, framed=True)
+        benchmark.run(board_simulator.DEFAULT_SCRIPT)
+
+        assert benchmark.unanswered == {}
+        assert benchmark._moderator.read_stats()['protocol'] == "framed"
+        assert benchmark._board._state == fsm.CLOSED
+
+    def test_scripted_day_on_event_loop(self):
+        benchmark = board_simulator.LatencyBenchmark(interval=0, use_event_loop=True)
+        benchmark.run(board_simulator.DEFAULT_SCRIPT)
+
+        assert benchmark.unanswered == {}
+        assert benchmark._board._state == fsm.CLOSED
+
+    def test_random_schedule_is_reproducible(self):
+        assert board_simulator.random_schedule(20, seed=3) == board_simulator.random_schedule(20, seed=3)
+
+    def test_percentile(self):
+        assert board_simulator.percentile([], 0.5) == 0.0
+        assert board_simulator.percentile([1, 2, 3], 0.5) == 2
+        assert board_simulator.percentile(range(100), 0.99) == 98
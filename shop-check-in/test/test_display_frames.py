@@ -0,0 +1,72 @@
+import display_frames
+
+STANDBY = "\0BOARD LOCKED.\n\rPOD SWIPE"
+CLOSED = "\0SHOP CLOSED.\n\rPROCTOR SWIPE"
+CHARGING = "\0CHARGING USER:\n\rJoe Schmoe"
+CHARGED = "\0CHARGING USER:\n\rJoe"
+
+
+class TestDisplayFrameFilter(object):
+
+    def test_no_frames(self):
+        display_filter = display_frames.DisplayFrameFilter()
+
+        assert display_filter.next_write([]) is None
+
+    def test_only_newest_frame_written(self):
+        display_filter = display_frames.DisplayFrameFilter()
+
+        assert display_filter.next_write([STANDBY, CHARGING, CLOSED]) == CLOSED
+        assert display_filter.frames_coalesced == 2
+
+    def test_frame_already_shown_skipped(self):
+        display_filter = display_frames.DisplayFrameFilter()
+        display_filter.next_write([STANDBY])
+
+        assert display_filter.next_write([STANDBY]) is None
+        assert display_filter.next_write([CLOSED]) == CLOSED
+        assert display_filter.writes_saved() == 1
+
+    def test_non_clearing_frames_always_written(self):
+        display_filter = display_frames.DisplayFrameFilter()
+
+        assert display_filter.next_write(["MORE"]) == "MORE"
+        assert display_filter.next_write(["MORE"]) == "MORE"
+
+    def test_changed_line_only(self):
+        display_filter = display_frames.DisplayFrameFilter(send_changed_line_only=True)
+        display_filter.next_write([CHARGING])
+
+        assert display_filter.next_write([CHARGED]) == "\rJoe       "
+        assert display_filter.partial_writes == 1
+
+    def test_changed_line_only_needs_same_first_line(self):
+        display_filter = display_frames.DisplayFrameFilter(send_changed_line_only=True)
+        display_filter.next_write([CHARGING])
+
+        assert display_filter.next_write([STANDBY]) == STANDBY
+
+    def test_full_rewrite_after_interval(self):
+        now = [100.0]
+        display_filter = display_frames.DisplayFrameFilter(full_rewrite_seconds=30, clock=lambda: now[0])
+        display_filter.next_write([STANDBY])
+        now[0] += 29
+
+        assert display_filter.next_write([STANDBY]) is None
+        now[0] += 1
+        assert display_filter.next_write([STANDBY]) == STANDBY
+        assert display_filter.next_write([STANDBY]) is None
+
+    def test_changed_line_only_not_after_full_second_line(self):
+        display_filter = display_frames.DisplayFrameFilter(send_changed_line_only=True)
+        display_filter.next_write(["\0REMOVING USER_S\n\r(R)NSRT/CLR/CHRG"])
+
+        # The LCD clears on the next character, so the whole frame has to be sent.
+        assert display_filter.next_write(["\0REMOVING USER_S\n\rCHARGED"]) == "\0REMOVING USER_S\n\rCHARGED"
+
+    def test_forget_shown_frame(self):
+        display_filter = display_frames.DisplayFrameFilter()
+        display_filter.next_write([STANDBY])
+        display_filter.forget_shown_frame()
+
+        assert display_filter.next_write([STANDBY]) == STANDBY
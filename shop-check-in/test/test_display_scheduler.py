@@ -0,0 +1,127 @@
+import threading
+import time
+import Queue as queue
+
+import board_simulator
+import display_scheduler
+import event
+import fsm
+import shop_user
+
+
+class _FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _drain(message_q):
+    messages = []
+    while not message_q.empty():
+        messages.append(message_q.get_nowait())
+    return messages
+
+
+class TestTimerWheel(object):
+
+    def test_timers_fire_when_due(self):
+        clock = _FakeClock()
+        wheel = display_scheduler.TimerWheel(clock=clock)
+        fired = []
+        wheel.call_later(0.5, lambda: fired.append("short"))
+        wheel.call_later(10, lambda: fired.append("long"))  # More than one turn of the wheel away.
+
+        clock.now += 0.25
+        wheel.advance()
+        assert fired == []
+        assert 0.2 < wheel.time_until_next() <= 0.3
+
+        clock.now += 0.3
+        wheel.advance()
+        assert fired == ["short"]
+
+        clock.now += 10
+        wheel.advance()
+        assert fired == ["short", "long"]
+        assert wheel.time_until_next() is None
+        assert len(wheel) == 0
+
+    def test_cancelled_timer(self):
+        clock = _FakeClock()
+        wheel = display_scheduler.TimerWheel(clock=clock)
+        fired = []
+        wheel.call_later(0.1, lambda: fired.append("cancelled")).cancel()
+
+        clock.now += 1
+        wheel.advance()
+
+        assert fired == []
+        assert wheel.time_until_next() is None
+
+    def test_cancel_removes_timer(self):
+        clock = _FakeClock()
+        wheel = display_scheduler.TimerWheel(clock=clock)
+        wheel.call_later(0.5, lambda: None)
+        wheel.call_later(0.1, lambda: None).cancel()
+
+        assert len(wheel) == 1
+        assert 0.45 < wheel.time_until_next() <= 0.5
+
+
+class TestDisplayScheduler(object):
+
+    def test_timed_frames_in_sequence(self):
+        clock = _FakeClock()
+        message_q = queue.Queue()
+        display = display_scheduler.DisplayScheduler(message_q, display_scheduler.TimerWheel(clock=clock))
+
+        display.show_for("\0FIRST", 1)
+        display.show_for("\0SECOND", 1)
+        assert _drain(message_q) == ["\0FIRST"]
+
+        clock.now += 1
+        display.tick()
+        assert _drain(message_q) == ["\0SECOND"]
+        assert display.is_showing()
+
+        clock.now += 1
+        display.tick()
+        assert not display.is_showing()
+
+    def test_show_cuts_timed_frames_short(self):
+        message_q = queue.Queue()
+        display = display_scheduler.DisplayScheduler(message_q)
+
+        display.show_for("\0FIRST", 1)
+        display.show_for("\0SECOND", 1)
+        display.show("\0NOW")
+
+        assert _drain(message_q) == ["\0FIRST", "\0NOW"]
+        assert not display.is_showing()
+        assert display.time_until_next() is None
+
+
+class TestFsmTimedFrames(object):
+
+    def test_no_confirm_error_does_not_block_events(self):
+        event_q = queue.Queue()
+        message_q = queue.Queue()
+        pod = shop_user.ShopUser(board_simulator._USER_DATA_POD)
+        board = fsm.BoardFsm(event_q, message_q, board_simulator.SimulatedShopUserDatabase([pod]),
+                             board_simulator.NullMailer())
+        board_thread = threading.Thread(target=board.run_fsm)
+        board_thread.daemon = True
+        board_thread.start()
+
+        start_time = time.time()
+        event_q.put(event.Event(event.CARD_SWIPE, "12345678"))  # Nonexistent user: no-confirm error.
+        event_q.put(event.Event(event.CARD_SWIPE, pod.id_number))
+        event_q.put(event.Event(event.TERMINATE_PROGRAM))
+        board_thread.join(1)
+
+        assert not board_thread.is_alive()
+        assert time.time() - start_time < 1
+        assert board._state == fsm.OPENING
@@ -0,0 +1,146 @@
+import Queue as queue
+
+import audio
+import error_handler
+import event
+import fsm
+import io_moderator
+import latency_metrics
+import replay
+import shop
+import shop_check_in_exceptions
+import shop_user
+
+
+STATES = [state for state, unused_message, unused_transitions in fsm.TRANSITION_TABLE] + [None]
+ERRORS = [shop_check_in_exceptions.MoneyOwedError, shop_check_in_exceptions.NonPodError,
+          shop_check_in_exceptions.ShopUserError, shop_check_in_exceptions.NonexistentUserError,
+          shop_check_in_exceptions.ShopOccupiedError, shop_check_in_exceptions.PodCannotWorkError,
+          shop_check_in_exceptions.UserAlreadySwipedError, shop_check_in_exceptions.UserAlreadyCheckedInError,
+          shop_user.DEFAULT_NAME] + list(event.EVENT_KEYS)
+
+
+class _CustomUserError(shop_check_in_exceptions.NonProctorError):
+    pass
+
+
+def _handler():
+    return error_handler.ErrorHandler(queue.Queue(), queue.Queue(), shop.Shop(), None, mailer=object())
+
+
+def _in_combination_dict(state, error, combination_dict):
+    """ How the handler used to decide, by walking the tuples. """
+    for template in combination_dict.get(state, ()):
+        if error == template or (isinstance(error, type) and isinstance(template, type) and
+                                 issubclass(error, template)):
+            return True
+    return False
+
+
+class TestErrorPolicies(object):
+
+    def test_policies_match_combination_dicts(self):
+        handler = _handler()
+        for state in STATES:
+            for error in ERRORS:
+                policy = handler._policy(state, error)
+                no_confirm = _in_combination_dict(state, error, handler._no_confirm_state_error_combos)
+
+                assert policy.requires_confirmation == (not no_confirm)
+                assert policy.is_real == (not _in_combination_dict(state, error, handler._not_actual_error_combos))
+                default_message = error_handler.DEFAULT_ERROR_MESSAGE_NO_CONFIRM if no_confirm \
+                    else error_handler.DEFAULT_ERROR_MESSAGE
+                assert policy.message == handler._messages_to_display.get(error, default_message)
+
+    def test_subclass_resolved_through_mro(self):
+        handler = _handler()
+
+        policy = handler._policy(fsm.CLOSED, _CustomUserError)
+
+        assert not policy.requires_confirmation
+        assert policy.message == error_handler.DEFAULT_ERROR_MESSAGE_NO_CONFIRM
+        assert handler._policy(fsm.CLOSED, _CustomUserError) is policy
+
+    def test_error_specific_actions(self):
+        handler = _handler()
+
+        actions = handler._policy(fsm.UNLOCKED, event.CARD_REMOVE).actions
+
+        assert actions[event.TYPE_CARD_INSERT] == handler._handle_card_reinsert
+        assert handler._policy(fsm.UNLOCKED, event.BUTTON_MONEY).actions is handler._default_actions
+
+    def test_error_message_appends_data(self):
+        policy = _handler()._policy(None, event.CARD_INSERT)
+
+        assert error_handler.ErrorHandler._error_message(policy, None) == policy.frame
+        assert error_handler.ErrorHandler._error_message(policy, 12) == \
+            io_moderator.safe_format_msg("\0ERR - UNINSERT\n\rSLOT: 12")
+
+
+def _run_board(state, events, shop_=None):
+    event_q = queue.Queue()
+    for key, data in events + [(event.TERMINATE_PROGRAM, None)]:
+        event_q.put(event.Event(key, data))
+    board = fsm.BoardFsm(event_q, queue.Queue(), replay.ReplayShopUserDatabase(), replay.NullMailer(),
+                         audio_worker=audio.AudioWorker({}, audio.NullBackend()), shop_=shop_)
+    board._state = state
+    final_state = board.run_fsm()
+    return board, final_state
+
+
+class TestErrorStack(object):
+
+    def setup_method(self, method):
+        latency_metrics.reset()
+
+    def test_nested_errors_pushed_and_popped(self):
+        board, final_state = _run_board(fsm.STANDBY, [(event.CARD_INSERT, 5),
+                                                      (event.CARD_INSERT, 6),
+                                                      (event.CARD_REMOVE, 6),
+                                                      (event.CARD_REMOVE, 5)])
+
+        assert final_state == fsm.STANDBY
+        assert not board._error_handler.is_resolving()
+        assert latency_metrics.error_stack_depths() == {None: {'current': 0, 'max': 2, 'dropped': 0}}
+        assert latency_metrics.histograms()[(latency_metrics.ERROR, latency_metrics.BY_STATE, fsm.STANDBY)][
+            'count'] == 1
+
+    def test_state_resumes_after_resolution(self):
+        board, final_state = _run_board(fsm.UNLOCKED, [(event.CARD_INSERT, 5),
+                                                       (event.BUTTON_CANCEL, None),
+                                                       (event.CARD_REMOVE, 5),
+                                                       (event.BUTTON_CANCEL, None)])
+
+        assert final_state == fsm.STANDBY
+
+    def test_stack_bounded(self):
+        inserts = [(event.CARD_INSERT, slot) for slot in xrange(1, 2 * error_handler.MAX_ERROR_STACK_DEPTH)]
+        board, final_state = _run_board(fsm.STANDBY, inserts)
+
+        assert board._error_handler.depth() == error_handler.MAX_ERROR_STACK_DEPTH
+        assert latency_metrics.error_stack_depths()[None]['dropped'] == error_handler.MAX_ERROR_STACK_DEPTH - 1
+
+    def test_full_stack_replaces_top_error_of_same_kind(self):
+        inserts = [(event.CARD_INSERT, slot) for slot in xrange(1, error_handler.MAX_ERROR_STACK_DEPTH + 2)]
+        board, final_state = _run_board(fsm.STANDBY, inserts)
+
+        assert board._error_handler._error_stack[-1].error_data == error_handler.MAX_ERROR_STACK_DEPTH + 1
+        assert latency_metrics.error_stack_depths()[None]['dropped'] == 1
+
+    def test_one_terminate_ends_resolution(self):
+        board, final_state = _run_board(fsm.STANDBY, [(event.CARD_INSERT, 5), (event.CARD_INSERT, 6)])
+
+        assert final_state == fsm.STANDBY
+        assert board._error_handler.depth() == 2
+        assert board._event_q.empty()
+
+    def test_double_check_in_refused(self):
+        machine_shop = shop.Shop()
+        user = replay.ReplayShopUserDatabase().get_shop_user("12345678")
+        machine_shop.add_user_s_to_slot([user], 5)
+
+        board, final_state = _run_board(fsm.UNLOCKED, [(event.CARD_SWIPE, user.id_number)], machine_shop)
+
+        assert final_state == fsm.UNLOCKED
+        assert not board._error_handler.is_resolving()
+        assert machine_shop.slot_of(user) == 5
@@ -0,0 +1,36 @@
+import event
+
+
+class TestEvent(object):
+
+    def test_decode_key(self):
+        assert event.decode_key(event.CARD_SWIPE) == event.TYPE_CARD_SWIPE
+        assert event.decode_key(event.BUTTON_DISCHARGE_USER) == event.TYPE_BUTTON_DISCHARGE_USER
+        assert event.decode_key(event.TERMINATE_PROGRAM) == event.TYPE_TERMINATE_PROGRAM
+        assert event.decode_key("Z9") == event.TYPE_UNKNOWN
+
+    def test_every_key_has_a_type(self):
+        assert sorted(event.decode_key(key) for key in event.EVENT_CODE_TO_NAME_MAP) == \
+            range(event.TYPE_TERMINATE_PROGRAM + 1)
+
+    def test_event_fields(self):
+        new_event = event.Event(event.CARD_INSERT, 5)
+
+        assert (new_event.key, new_event.type, new_event.data) == (event.CARD_INSERT, event.TYPE_CARD_INSERT, 5)
+        assert new_event.timestamp > 0
+        assert event.Event(event.BUTTON_CONFIRM).data is None
+
+    def test_slots(self):
+        try:
+            event.Event(event.BUTTON_CONFIRM).extra = 1
+        except AttributeError:
+            pass
+        else:
+            assert False
+
+    def test_make_dispatch_table(self):
+        table = event.make_dispatch_table({event.BUTTON_CANCEL: "cancel"}, "default")
+
+        assert len(table) == event.EVENT_TYPE_COUNT
+        assert table[event.TYPE_BUTTON_CANCEL] == "cancel"
+        assert table[event.TYPE_UNKNOWN] == "default"
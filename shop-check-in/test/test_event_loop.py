@@ -0,0 +1,98 @@
+import threading
+import Queue as queue
+
+import event
+import event_loop
+import id_logger
+import id_logger_backends
+
+SWIPE = ";0401551819\x00"
+
+
+class TestEventLoop(object):
+
+    def test_timers_run_in_order(self):
+        loop = event_loop.EventLoop()
+        calls = []
+        loop.call_later(0.02, calls.append, "second")
+        loop.call_later(0.01, calls.append, "first")
+        loop.call_later(0.01, calls.append, "cancelled").cancel()
+
+        loop.run_until(lambda: len(calls) == 2, 1)
+
+        assert calls == ["first", "second"]
+
+    def test_call_soon_threadsafe_wakes_loop(self):
+        loop = event_loop.EventLoop()
+        calls = []
+        threading.Timer(0.01, loop.call_soon_threadsafe, (calls.append, "called")).start()
+
+        assert loop.run_until(lambda: calls, 1)
+
+    def test_run_until_timeout(self):
+        loop = event_loop.EventLoop()
+
+        assert not loop.run_until(lambda: False, 0.01)
+
+    def test_run_in_executor(self):
+        loop = event_loop.EventLoop()
+
+        assert loop.wait_for(loop.run_in_executor(sum, [1, 2, 3]), 1) == 6
+
+    def test_run_in_executor_error(self):
+        loop = event_loop.EventLoop()
+        future = loop.run_in_executor(int, "not a number")
+
+        try:
+            loop.wait_for(future, 1)
+        except ValueError:
+            pass
+        else:
+            assert False
+
+    def test_executor_proxy(self):
+        loop = event_loop.EventLoop()
+        proxy = event_loop.ExecutorProxy(loop, "a string")
+
+        assert proxy.upper() == "A STRING"
+
+
+class TestLoopQueues(object):
+
+    def test_event_queue_get_timeout(self):
+        loop = event_loop.EventLoop()
+        event_q = event_loop.LoopEventQueue(loop)
+
+        try:
+            event_q.get(timeout=0.01)
+        except queue.Empty:
+            pass
+        else:
+            assert False
+
+    def test_event_queue_put_from_other_thread(self):
+        loop = event_loop.EventLoop()
+        event_q = event_loop.LoopEventQueue(loop)
+        threading.Timer(0.01, event_q.put, ("event",)).start()
+
+        assert event_q.get(timeout=1) == "event"
+
+    def test_message_queue_consumer(self):
+        loop = event_loop.EventLoop()
+        message_q = event_loop.LoopMessageQueue(loop)
+        consumed = []
+        message_q.set_consumer(lambda: consumed.append(message_q.get_nowait()))
+
+        message_q.put("\0HELLO")
+        loop.run_until(lambda: consumed, 1)
+
+        assert consumed == ["\0HELLO"]
+
+    def test_id_logger_on_loop(self):
+        loop = event_loop.EventLoop()
+        event_q = event_loop.LoopEventQueue(loop)
+
+        id_logger.IdLogger(event_q, id_logger_backends.ReplayBackend.from_string(SWIPE)).attach(loop)
+        swipe = event_q.get(timeout=1)
+
+        assert (swipe.key, swipe.data) == (event.CARD_SWIPE, "40155181")
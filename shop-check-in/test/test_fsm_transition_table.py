@@ -0,0 +1,47 @@
+import event
+import fsm
+import shop_check_in_exceptions
+
+
+def _compile_fails(transition_table):
+    try:
+        fsm.compile_transition_table(transition_table, fsm.BoardFsm)
+    except shop_check_in_exceptions.TransitionTableError:
+        return True
+    return False
+
+
+class TestTransitionTable(object):
+
+    def test_board_table_compiles(self):
+        compiled = fsm.compile_transition_table(fsm.TRANSITION_TABLE, fsm.BoardFsm)
+        frame, handler_names = compiled[fsm.OPENING]
+
+        assert set(compiled) == set(state for state, unused_message, unused_transitions in fsm.TRANSITION_TABLE)
+        assert frame == "\0STARTING UP!\n\rFLIP SWITCH"
+        assert handler_names[event.TYPE_SWITCH_FLIP_ON] == '_opening_process_switch_flip'
+        assert handler_names[event.TYPE_CARD_SWIPE] is None
+        assert len(handler_names) == event.EVENT_TYPE_COUNT
+
+    def test_frames_are_preformatted(self):
+        compiled = fsm.compile_transition_table(((fsm.CLOSED, "NO NULL\n\rA LINE LONGER THAN SIXTEEN", ()),),
+                                                fsm.BoardFsm)
+
+        assert compiled[fsm.CLOSED][0] == "\0NO NULL\n\rA LINE LONGER TH"
+
+    def test_missing_handler(self):
+        assert _compile_fails(((fsm.CLOSED, "\0CLOSED", ((event.CARD_SWIPE, '_no_such_handler', ()),)),))
+
+    def test_unknown_event(self):
+        assert _compile_fails(((fsm.CLOSED, "\0CLOSED", (("Z9", '_go_to_closed_state', ()),)),))
+
+    def test_undefined_next_state(self):
+        assert _compile_fails(((fsm.CLOSED, "\0CLOSED", ((event.CARD_SWIPE, '_go_to_standby_state', (fsm.STANDBY,)),)),))
+
+    def test_unreachable_state(self):
+        assert _compile_fails(((fsm.CLOSED, "\0CLOSED", ()),
+                               (fsm.STANDBY, "\0STANDBY", ())))
+
+    def test_duplicate_state(self):
+        assert _compile_fails(((fsm.CLOSED, "\0CLOSED", ()),
+                               (fsm.CLOSED, "\0CLOSED", ())))
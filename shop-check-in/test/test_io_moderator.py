@@ -1,6 +1,9 @@
 import Queue
+import select
 
+import event
 import io_moderator
+import latency_metrics
 
 
 class TestIoModerator(object):
@@ -9,4 +12,117 @@ class TestIoModerator(object):
         event_q = Queue.Queue()
         message_q = Queue.Queue()
 
-        io_moderator.IoModerator(event_q, message_q)
\ No newline at end of file
+        moderator = io_moderator.IoModerator(event_q, message_q)
+
+        assert not moderator._negotiate  # Interface.ino doesn't speak the framed protocol.
+
+    def test_start_link_forgets_shown_frame(self):
+        moderator = io_moderator.IoModerator(Queue.Queue(), Queue.Queue(), negotiate=False)
+        moderator._display_filter.next_write(["\0HELLO"])
+
+        moderator._start_link(_FakeSerialPort())
+
+        assert moderator._display_filter.next_write(["\0HELLO"]) == "\0HELLO"
+
+    def test_board_hello_forgets_shown_frame(self):
+        moderator = io_moderator.IoModerator(Queue.Queue(), Queue.Queue(), negotiate=False)
+        moderator._protocol = _FakeProtocol()
+        moderator._display_filter.next_write(["\0HELLO"])
+        moderator._enqueue_events(_FakeSerialPort())
+
+        assert moderator._display_filter.next_write(["\0HELLO"]) is None
+        moderator._protocol.board_hellos += 1
+        moderator._enqueue_events(_FakeSerialPort())
+        assert moderator._display_filter.next_write(["\0HELLO"]) == "\0HELLO"
+
+    def test_deduplicated_frame_settles_display(self):
+        latency_metrics.reset()
+        message_q = Queue.Queue()
+        moderator = io_moderator.IoModerator(Queue.Queue(), message_q, negotiate=False)
+        moderator._write_pending_messages(_FakeSerialPort(), ["\0HELLO"])
+        swipe = event.Event(event.BUTTON_CONFIRM)
+        latency_metrics.event_dequeued(swipe, swipe.timestamp, message_q)
+        latency_metrics.event_handled(swipe, "standby", swipe.timestamp)
+
+        moderator._write_pending_messages(_FakeSerialPort(), ["\0HELLO"])
+
+        histograms = latency_metrics.histograms()
+        assert [key for key in histograms if key[0] == latency_metrics.DISPLAY]
+        latency_metrics.reset()
+
+
+class _FakeSerialPort(object):
+
+    def inWaiting(self):
+        return 0
+
+    def read(self, size):
+        return ""
+
+    def write(self, data):
+        pass
+
+
+class _FakeProtocol(object):
+
+    board_hellos = 0
+
+    def read_messages(self, serial_port):
+        return []
+
+class TestMessageQueue(object):
+
+    def test_put_wakes_reader(self):
+        message_q = io_moderator.MessageQueue()
+        message_q.put("\0HELLO")
+
+        readable, unused_writable, unused_exceptional = select.select([message_q], [], [], 0)
+
+        assert readable == [message_q]
+        assert message_q.get_nowait() == "\0HELLO"
+
+    def test_clear_wakeups(self):
+        message_q = io_moderator.MessageQueue()
+        message_q.put("\0HELLO")
+        message_q.put("\0WORLD")
+        message_q.clear_wakeups()
+
+        readable, unused_writable, unused_exceptional = select.select([message_q], [], [], 0)
+
+        assert readable == []
+        assert message_q.qsize() == 2
+
+    def test_multiplexed_by_default(self):
+        moderator = io_moderator.IoModerator(Queue.Queue(), io_moderator.MessageQueue())
+
+        assert moderator._multiplexed
+        assert not io_moderator.IoModerator(Queue.Queue(), Queue.Queue())._multiplexed
+
+
+class TestIoModeratorInput(object):
+
+    def test_enqueue_events_batch(self):
+        event_q = Queue.Queue()
+        moderator = io_moderator.IoModerator(event_q, Queue.Queue())
+
+        events = moderator._convert_messages_to_events(["S1", "M015", "B4"])
+
+        assert [(new_event.key, new_event.data) for new_event in events] == [(event.SWITCH_FLIP_ON, ""),
+                                                                             (event.CARD_REMOVE, 15),
+                                                                             (event.BUTTON_DISCHARGE_USER, "")]
+
+    def test_malformed_messages_ignored(self):
+        moderator = io_moderator.IoModerator(Queue.Queue(), Queue.Queue())
+
+        events = moderator._convert_messages_to_events(["M1", "M1x5", "M199", "B1M15", "Q1", "", "B1"])
+
+        assert [new_event.key for new_event in events] == [event.BUTTON_CONFIRM]
+        assert moderator.malformed_messages == 6
+
+    def test_other_stations_slots_ignored(self):
+        moderator = io_moderator.IoModerator(Queue.Queue(), Queue.Queue(), slots_=[6, 7])
+
+        events = moderator._convert_messages_to_events(["M16", "M15", "M07"])
+
+        assert [new_event.data for new_event in events] == [6, 7]
+        assert moderator.malformed_messages == 1
@@ -0,0 +1,104 @@
+import Queue as queue
+
+import event
+import latency_metrics
+
+SWIPE_NAME = event.EVENT_CODE_TO_NAME_MAP[event.CARD_SWIPE]
+
+
+def _event_created_at(timestamp):
+    new_event = event.Event(event.CARD_SWIPE, "40155181")
+    new_event.timestamp = timestamp
+    return new_event
+
+
+class TestHistogram(object):
+
+    def test_percentiles(self):
+        histogram = latency_metrics.Histogram()
+        for unused_index in xrange(99):
+            histogram.record(0.001)
+        histogram.record(0.5)
+
+        assert histogram.count == 100
+        assert 0.001 <= histogram.percentile(0.50) < 0.002
+        assert histogram.percentile(1.0) == 0.5
+        assert histogram.max == 0.5
+
+    def test_empty(self):
+        assert latency_metrics.Histogram().snapshot()['p99'] == 0.0
+
+
+class TestLatencyMetrics(object):
+
+    def test_stages(self):
+        metrics = latency_metrics.LatencyMetrics()
+        swipe = _event_created_at(10.0)
+
+        metrics.event_dequeued(swipe, 10.5)
+        metrics.event_handled(swipe, "standby", 10.75)
+        metrics.display_settled(11.0)
+        histograms = metrics.histograms()
+
+        assert histograms[(latency_metrics.QUEUE, latency_metrics.BY_EVENT, SWIPE_NAME)]['max'] == 0.5
+        assert histograms[(latency_metrics.HANDLER, latency_metrics.BY_STATE, "standby")]['max'] == 0.25
+        assert histograms[(latency_metrics.DISPLAY, latency_metrics.BY_EVENT, SWIPE_NAME)]['max'] == 0.25
+        assert histograms[(latency_metrics.RESPONSE, latency_metrics.BY_EVENT, SWIPE_NAME)]['max'] == 1.0
+
+    def test_frame_written_during_handler(self):
+        metrics = latency_metrics.LatencyMetrics()
+        swipe = _event_created_at(10.0)
+
+        metrics.event_dequeued(swipe, 10.0)
+        metrics.display_settled(10.5)
+        metrics.event_handled(swipe, "standby", 11.0)
+        metrics.display_settled(11.5)
+        histograms = metrics.histograms()
+
+        assert histograms[(latency_metrics.RESPONSE, latency_metrics.BY_EVENT, SWIPE_NAME)]['count'] == 1
+        assert histograms[(latency_metrics.DISPLAY, latency_metrics.BY_EVENT, SWIPE_NAME)]['max'] == 0.5
+
+    def test_displays_settle_separately(self):
+        metrics = latency_metrics.LatencyMetrics()
+        main_swipe = _event_created_at(10.0)
+        wood_swipe = _event_created_at(10.0)
+
+        metrics.event_dequeued(main_swipe, 10.0, "main")
+        metrics.event_dequeued(wood_swipe, 10.0, "wood")
+        metrics.event_handled(main_swipe, "standby", 10.5)
+        metrics.event_handled(wood_swipe, "standby", 10.5)
+        metrics.display_settled(11.0, "main")
+        metrics.display_settled(12.0, "wood")
+        histograms = metrics.histograms()
+
+        assert histograms[(latency_metrics.DISPLAY, latency_metrics.BY_EVENT, SWIPE_NAME)]['count'] == 2
+        assert histograms[(latency_metrics.DISPLAY, latency_metrics.BY_EVENT, SWIPE_NAME)]['max'] == 1.5
+        assert not metrics._awaiting_display
+
+    def test_error_stacks_by_station(self):
+        metrics = latency_metrics.LatencyMetrics()
+        metrics.error_stack_changed(2, "main")
+        metrics.error_stack_changed(1, "wood")
+        metrics.error_stack_changed(0, "main")
+        metrics.error_dropped("wood")
+
+        assert metrics.error_stack_depths() == {"main": {'current': 0, 'max': 2, 'dropped': 0},
+                                                "wood": {'current': 1, 'max': 1, 'dropped': 1}}
+        assert "wood error stack depth: 1 (max 1, 1 errors dropped)" in metrics.report()
+
+    def test_queue_depths(self):
+        metrics = latency_metrics.LatencyMetrics()
+        event_q = queue.Queue()
+        event_q.put(event.Event(event.BUTTON_CONFIRM))
+        metrics.watch_queue('event_q', event_q)
+
+        assert metrics.queue_depths() == {'event_q': 1}
+        assert "queue depth event_q: 1" in metrics.report()
+
+    def test_events_awaiting_display_are_bounded(self):
+        metrics = latency_metrics.LatencyMetrics()
+        for index in xrange(2 * latency_metrics.MAX_EVENTS_AWAITING_DISPLAY):
+            metrics.event_dequeued(_event_created_at(index), index)
+
+        assert len(metrics._awaiting_display[None]) == latency_metrics.MAX_EVENTS_AWAITING_DISPLAY
+        assert len(metrics._dequeued) == latency_metrics.MAX_EVENTS_AWAITING_DISPLAY
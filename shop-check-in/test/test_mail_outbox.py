@@ -0,0 +1,207 @@
+import os
+import smtplib
+import socket
+
+from test import sample_users
+from test.smtp_stand_in import SmtpStandIn
+
+import latency_metrics
+import mail_outbox
+import mailer
+
+
+FROM_ADDRESS = "shop@example.com"
+
+
+def _unused_address():
+    """ An address nothing is listening on. """
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    address = "127.0.0.1:%d" % probe.getsockname()[1]
+    probe.close()
+    return address
+
+
+def _mailer(address, **kwargs):
+    return mailer.Mailer(address, use_tls=False, username=FROM_ADDRESS, **kwargs)
+
+
+def _outbox(tmpdir, address, **kwargs):
+    return mail_outbox.MailOutbox(_mailer(address), str(tmpdir.join("outbox")), **kwargs)
+
+
+def _spooled(tmpdir):
+    directory = tmpdir.join("outbox")
+    return sorted(os.listdir(str(directory))) if directory.check() else []
+
+
+class TestMailer(object):
+
+    def test_send(self):
+        server = SmtpStandIn()
+        server.start()
+        try:
+            _mailer(server.address).send(mailer.Email("someone@example.com", "Subject: hi\n\nhello"))
+        finally:
+            server.stop()
+
+        assert len(server.received) == 1
+        from_address, to_addresses, message = server.received[0]
+        assert (from_address, to_addresses) == (FROM_ADDRESS, ["someone@example.com"])
+        assert "hello" in message
+
+    def test_session_reused(self):
+        latency_metrics.reset()
+        server = SmtpStandIn()
+        server.start()
+        sender = _mailer(server.address)
+        try:
+            for index in xrange(3):
+                sender.send(mailer.Email("user%d@example.com" % index, "hello"))
+            sender.close()
+        finally:
+            server.stop()
+
+        assert len(server.received) == 3
+        assert server.sessions == 1
+        histograms = latency_metrics.histograms()
+        assert histograms[(latency_metrics.MAIL, latency_metrics.BY_SESSION, latency_metrics.NEW_SESSION)]['count'] == 1
+        assert histograms[(latency_metrics.MAIL, latency_metrics.BY_SESSION,
+                           latency_metrics.REUSED_SESSION)]['count'] == 2
+
+    def test_idle_session_replaced(self):
+        server = SmtpStandIn()
+        server.start()
+        sender = _mailer(server.address, idle_seconds=0)
+        try:
+            for index in xrange(2):
+                sender.send(mailer.Email("user%d@example.com" % index, "hello"))
+        finally:
+            server.stop()
+
+        assert len(server.received) == 2
+        assert server.sessions == 2
+
+    def test_dropped_session_reconnects(self):
+        server = SmtpStandIn()
+        server.start()
+        sender = _mailer(server.address)
+        try:
+            sender.send(mailer.Email("first@example.com", "hello"))
+            server.drop_sessions()
+            sender.send(mailer.Email("second@example.com", "hello"))
+        finally:
+            server.stop()
+
+        assert [to_addresses for _, to_addresses, _ in server.received] == \
+            [["first@example.com"], ["second@example.com"]]
+        assert server.sessions == 2
+
+    def test_send_unreachable(self):
+        try:
+            _mailer(_unused_address()).send(mailer.Email("someone@example.com", "hello"))
+        except socket.error:
+            pass
+        else:
+            assert False, "Expected socket.error"
+
+
+class TestMailOutbox(object):
+
+    def test_sends_in_background(self, tmpdir):
+        server = SmtpStandIn()
+        server.start()
+        outbox = _outbox(tmpdir, server.address)
+        outbox.start()
+        try:
+            outbox._send_id_card_email_s([sample_users.USER_CERTIFIED, sample_users.USER_POD])
+            assert outbox.wait_until_idle(5)
+        finally:
+            server.stop()
+
+        assert [to_addresses for _, to_addresses, _ in server.received] == \
+            [[sample_users.USER_CERTIFIED.email], [sample_users.USER_POD.email]]
+        assert outbox.sent == 2
+        assert _spooled(tmpdir) == []
+
+    def test_failed_mail_stays_spooled(self, tmpdir):
+        outbox = _outbox(tmpdir, _unused_address(), initial_backoff_seconds=60)
+        outbox.start()
+        outbox._send_id_card_email_s([sample_users.USER_CERTIFIED])
+
+        assert not outbox.wait_until_idle(0.5)
+        assert outbox.pending() == 1
+        assert outbox.failed_attempts == 1
+        assert len(_spooled(tmpdir)) == 1
+
+    def test_restart_sends_spooled_mail(self, tmpdir):
+        unreachable = _outbox(tmpdir, _unused_address(), initial_backoff_seconds=60)
+        unreachable.start()
+        unreachable._send_id_card_email_s([sample_users.USER_CERTIFIED])
+        unreachable.wait_until_idle(0.5)
+
+        server = SmtpStandIn()
+        server.start()
+        restarted = _outbox(tmpdir, server.address)
+        assert restarted.pending() == 1
+        restarted.start()
+        try:
+            assert restarted.wait_until_idle(5)
+        finally:
+            server.stop()
+
+        assert [to_addresses for _, to_addresses, _ in server.received] == [[sample_users.USER_CERTIFIED.email]]
+        assert _spooled(tmpdir) == []
+
+    def test_sends_in_order(self, tmpdir):
+        server = SmtpStandIn()
+        server.start()
+        outbox = _outbox(tmpdir, server.address)
+        for index in xrange(3):
+            outbox.put(mailer.Email("user%d@example.com" % index, "hello"))
+        outbox.start()
+        try:
+            assert outbox.wait_until_idle(5)
+        finally:
+            server.stop()
+
+        assert [to_addresses for _, to_addresses, _ in server.received] == \
+            [["user%d@example.com" % index] for index in xrange(3)]
+        assert server.sessions == 1
+
+    def test_rejected_mail_moved_aside(self, tmpdir):
+        server = SmtpStandIn()
+        server.rejected_addresses.add("user0@example.com")
+        server.start()
+        outbox = _outbox(tmpdir, server.address)
+        for index in xrange(2):
+            outbox.put(mailer.Email("user%d@example.com" % index, "hello"))
+        outbox.start()
+        try:
+            assert outbox.wait_until_idle(5)
+        finally:
+            server.stop()
+
+        assert [to_addresses for _, to_addresses, _ in server.received] == [["user1@example.com"]]
+        assert outbox.dropped == 1
+        assert _spooled(tmpdir) == [mail_outbox.DEAD_LETTER_DIRECTORY_NAME]
+        assert len(tmpdir.join("outbox", mail_outbox.DEAD_LETTER_DIRECTORY_NAME).listdir()) == 1
+
+    def test_login_failure_keeps_mail(self, tmpdir):
+        outbox = mail_outbox.MailOutbox(_LoginRefusedMailer(), str(tmpdir.join("outbox")))
+        email = mailer.Email("someone@example.com", "hello")
+        outbox.put(email)
+        outbox._spool(email)
+
+        assert not outbox.send_pending()
+        assert outbox.login_failures == 1
+        assert outbox.dropped == 0
+        assert outbox.pending() == 1
+
+
+class _LoginRefusedMailer(object):
+
+    idle_seconds = 60
+
+    def send(self, email):
+        raise smtplib.SMTPAuthenticationError(535, "Username and Password not accepted")
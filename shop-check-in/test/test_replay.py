@@ -0,0 +1,85 @@
+import event
+import fsm
+import replay
+
+ID_NUMBER = "40000001"
+
+
+def _log_line(second, message):
+    return "2026-10-18 09:00:%02d,250: all_events: %s" % (second, message)
+
+
+def _event_line(second, action, key, data):
+    name = event.EVENT_CODE_TO_NAME_MAP[key]
+    return _log_line(second, "Event    %s; name: %s ,key: %s, data %s" % (action, name, key, data))
+
+
+def _frame_line(second, state):
+    frame = fsm._COMPILED_TRANSITIONS[state][0]
+    return _log_line(second, "Message  Submit; message: %s" % frame.replace('\n', '\\n'))
+
+
+def _opening_day_log(last_frame_state=fsm.STANDBY):
+    return [_frame_line(0, fsm.CLOSED),
+            _event_line(1, "Submit", event.CARD_SWIPE, ID_NUMBER),
+            _event_line(1, "Pickup", event.CARD_SWIPE, ID_NUMBER),
+            _frame_line(1, fsm.OPENING),
+            _event_line(2, "Submit", event.SWITCH_FLIP_ON, ""),
+            _event_line(2, "Pickup", event.SWITCH_FLIP_ON, ""),
+            _frame_line(2, last_frame_state)]
+
+
+class TestParseLog(object):
+
+    def test_event_line(self):
+        record = replay.parse_log_line(_event_line(5, "Submit", event.CARD_INSERT, 12))
+
+        assert (record.action, record.key, record.data) == (replay.EVENT_SUBMIT, event.CARD_INSERT, 12)
+        assert record.timestamp % 60 == 5.25
+
+    def test_message_line(self):
+        record = replay.parse_log_line(_frame_line(0, fsm.CLOSED))
+
+        assert record.message == "\0SHOP CLOSED.\\n\rPROCTOR SWIPE"
+
+    def test_other_lines_ignored(self):
+        assert replay.parse_log_line("Traceback (most recent call last):") is None
+        assert replay.parse_log_line(_log_line(0, "Message Display; message: \0HELLO")) is None
+
+
+class TestReplay(object):
+
+    def test_matching_day(self):
+        records = [replay.parse_log_line(line) for line in _opening_day_log()]
+
+        result = replay.replay(records)
+
+        assert result.divergences == []
+        assert result.final_state == fsm.STANDBY
+        assert result.shop_summary()['pods'] == ["Replayed User"]
+        assert result.events_replayed == 2
+
+    def test_divergence_reported(self):
+        records = [replay.parse_log_line(line) for line in _opening_day_log(last_frame_state=fsm.UNLOCKED)]
+
+        result = replay.replay(records)
+
+        assert len(result.divergences) == 1
+        assert result.divergences[0].pickup_index == 2
+        assert result.divergences[0].event_record.key == event.SWITCH_FLIP_ON
+
+    def test_unlogged_submission_replayed(self):
+        lines = _opening_day_log()
+        del lines[1]  # The swipe's submission.
+        records = [replay.parse_log_line(line) for line in lines]
+
+        assert [record.key for record in replay.input_events(records)] == [event.CARD_SWIPE, event.SWITCH_FLIP_ON]
+        assert replay.replay(records).divergences == []
+
+    def test_load_log(self, tmpdir):
+        log_file = tmpdir.join("events.log")
+        log_file.write("\n".join(_opening_day_log()) + "\n")
+
+        records = replay.load_log([str(log_file)])
+
+        assert len(records) == 7
@@ -0,0 +1,72 @@
+import serial_framing
+
+
+class _FakeSerialPort(object):
+
+    def __init__(self, data=""):
+        self.data = data
+        self.read_count = 0
+
+    def inWaiting(self):
+        return len(self.data)
+
+    def read(self, size):
+        self.read_count += 1
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+def _frames_as_strings(frames):
+    return [frame.tobytes() for frame in frames]
+
+
+class TestLineFramer(object):
+
+    def test_read_nothing_waiting(self):
+        framer = serial_framing.LineFramer()
+        serial_port = _FakeSerialPort()
+
+        assert framer.read_frames(serial_port) == []
+        assert serial_port.read_count == 0
+
+    def test_read_burst_in_one_call(self):
+        framer = serial_framing.LineFramer()
+        serial_port = _FakeSerialPort("M15\r\nM012\r\nB1\r\n")
+
+        frames = framer.read_frames(serial_port)
+
+        assert _frames_as_strings(frames) == ["M15", "M012", "B1"]
+        assert serial_port.read_count == 1
+        assert framer.stats()['frames_per_read'] == 3
+
+    def test_partial_frame_kept_for_next_read(self):
+        framer = serial_framing.LineFramer()
+
+        assert _frames_as_strings(framer.feed("S1\r\nM1")) == ["S1"]
+        assert framer.pending_bytes() == 2
+        assert _frames_as_strings(framer.feed("5\r\n")) == ["M15"]
+        assert framer.pending_bytes() == 0
+
+    def test_bare_newline_frames(self):
+        framer = serial_framing.LineFramer()
+
+        assert _frames_as_strings(framer.feed("B0\nB1\n")) == ["B0", "B1"]
+
+    def test_buffer_grows_for_large_reads(self):
+        framer = serial_framing.LineFramer(buffer_size=4)
+
+        assert _frames_as_strings(framer.feed("M15\r\nM012\r\nB")) == ["M15", "M012"]
+        assert _frames_as_strings(framer.feed("2\r\n")) == ["B2"]
+
+    def test_stats(self):
+        framer = serial_framing.LineFramer()
+        framer.feed("B1\r\nB2\r\n")
+        framer.feed("B3")
+
+        stats = framer.stats()
+
+        assert stats['reads'] == 2
+        assert stats['bytes_read'] == 10
+        assert stats['frames_read'] == 2
+        assert stats['max_frames_per_read'] == 2
+        assert stats['max_bytes_per_read'] == 8
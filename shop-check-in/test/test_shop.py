@@ -2,6 +2,8 @@ from test import sample_users
 
 import shop
 import shop_check_in_exceptions
+import shop_user
+import slots
 
 
 FIRST_SLOT = 0
@@ -227,3 +229,99 @@ class TestShop(object):
         machine_shop.close_(sample_users.USER_POD)
 
         assert machine_shop._empty()
+
+
+class TestShopIndexes(object):
+
+    def test_slot_of(self):
+        machine_shop = shop.Shop()
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED, sample_users.USER_PROCTOR], FIRST_SLOT)
+
+        assert machine_shop.slot_of(sample_users.USER_CERTIFIED) == FIRST_SLOT
+        assert machine_shop.slot_of(sample_users.USER_PROCTOR) == FIRST_SLOT
+        assert machine_shop.slot_of(sample_users.USER_POD) is None
+
+    def test_indexes_follow_transfer_and_discharge(self):
+        machine_shop = shop.Shop()
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], slots._MILL_1)
+        machine_shop.replace_or_transfer_user(slots._WOOD_LATHE_1, slots._MILL_1)
+
+        assert machine_shop.slot_of(sample_users.USER_CERTIFIED) == slots._WOOD_LATHE_1
+        assert machine_shop.sub_shop_occupant_count('main') == 0
+        assert machine_shop.sub_shop_occupant_count('wood') == 1
+        assert machine_shop.current_machine_start_time(slots._MILL_1) is shop.NO_TIME
+
+        machine_shop.discharge_user_s(slots._WOOD_LATHE_1)
+
+        assert machine_shop.slot_of(sample_users.USER_CERTIFIED) is None
+        assert machine_shop.sub_shop_occupant_count('wood') == 0
+        assert machine_shop.total_occupant_count() == 0
+
+    def test_counts(self):
+        occupancy = shop.Occupancy()
+        main_shop = shop.Shop(occupancy, [1, 2])
+        wood_shop = shop.Shop(occupancy, [6, 7])
+        main_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED, sample_users.USER_PROCTOR], 1)
+        wood_shop.add_user_s_to_slot([sample_users.USER_POD], 6)
+
+        assert main_shop.occupant_count() == 2
+        assert wood_shop.occupant_count() == 1
+        assert main_shop.total_occupant_count() == 3
+        assert wood_shop.slot_of(sample_users.USER_CERTIFIED) == 1
+
+    def test_pod_matched_by_id_number(self):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        pod_with_debt = shop_user.ShopUser(["POD Joe", sample_users.VALID_TEST_DATE, "", "email", "1111111", 2,
+                                            shop_user.IS_PROCTOR])
+
+        assert machine_shop.is_pod(pod_with_debt)
+
+    def test_set_state_rebuilds_indexes(self):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], FIRST_SLOT)
+
+        restored = shop.Shop()
+        restored.set_state(machine_shop.get_state())
+
+        assert restored.is_pod(sample_users.USER_POD)
+        assert restored.slot_of(sample_users.USER_CERTIFIED) == FIRST_SLOT
+        assert restored.occupant_count() == 1
+
+
+class TestShopSnapshots(object):
+
+    def test_snapshot_published_on_change(self):
+        machine_shop = shop.Shop()
+        before = machine_shop.snapshot()
+        occupancy_before = machine_shop.occupancy_snapshot()
+        machine_shop.open_(sample_users.USER_POD)
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], FIRST_SLOT)
+
+        after = machine_shop.snapshot()
+        occupancy_after = machine_shop.occupancy_snapshot()
+        assert after.version > before.version
+        assert occupancy_after.version > occupancy_before.version
+        assert after.is_open and not before.is_open
+        assert after.pods == (sample_users.USER_POD,)
+        assert occupancy_after.user_s(FIRST_SLOT) == (sample_users.USER_CERTIFIED,)
+        assert not occupancy_before.is_machine_in_use(FIRST_SLOT)
+
+    def test_snapshot_unchanged_by_later_changes(self):
+        machine_shop = shop.Shop()
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], FIRST_SLOT)
+        snapshot = machine_shop.occupancy_snapshot()
+
+        machine_shop.discharge_user_s(FIRST_SLOT)
+
+        assert snapshot.user_s(FIRST_SLOT) == (sample_users.USER_CERTIFIED,)
+        assert snapshot.occupant_count == 1
+        assert machine_shop.occupancy_snapshot().occupant_count == 0
+
+    def test_snapshot_reused_until_change(self):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+
+        assert machine_shop.snapshot() is machine_shop.snapshot()
+        assert machine_shop.occupancy_snapshot() is machine_shop.occupancy_snapshot()
@@ -1,5 +1,10 @@
+import threading
+import time
+
 from test import sample_users
 
+import atomic_file
+import shop_user
 import shop_user_database
 import shop_check_in_exceptions
 
@@ -95,4 +100,211 @@ class TestShopUserDatabase(object):
         except shop_check_in_exceptions.NonexistentUserError:
             assert True
         else:
-            assert False
\ No newline at end of file
+            assert False
+
+class _FakeWorksheet(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def update_sync_values(self, sync_values_by_id):
+        if self.fail:
+            raise IOError("No network")
+        self.batches.append(dict(sync_values_by_id))
+
+
+class TestDebtSyncWorker(object):
+
+    def _worker(self, worksheet, saved, **kwargs):
+        return shop_user_database._DebtSyncWorker(lambda: worksheet, saved.append, **kwargs)
+
+    def test_changes_coalesced_by_id(self):
+        worksheet = _FakeWorksheet()
+        saved = []
+        worker = self._worker(worksheet, saved)
+        user = shop_user.ShopUser(["Joe Schmoe", sample_users.VALID_TEST_DATE, "", "email", "7777777", 0,
+                                   shop_user.IS_NOT_PROCTOR])
+        for debt in (3, 6, 9):
+            user.debt = debt
+            worker.enqueue(user)
+
+        assert worker.sync_once()
+        assert worksheet.batches == [{"7777777": (9, shop_user.IS_NOT_PROCTOR)}]
+        assert worker.pending() == {}
+        assert saved[-1] == {}
+
+    def test_batches(self):
+        worksheet = _FakeWorksheet()
+        worker = self._worker(worksheet, [], pending={str(id_number): (3, shop_user.IS_NOT_PROCTOR)
+                                                      for id_number in xrange(5)}, batch_size=2)
+        while worker.pending():
+            assert worker.sync_once()
+
+        assert [len(batch) for batch in worksheet.batches] == [2, 2, 1]
+
+    def test_failure_keeps_changes(self):
+        worksheet = _FakeWorksheet(fail=True)
+        worker = self._worker(worksheet, [])
+        worker.enqueue(sample_users.USER_OWES_MONEY)
+
+        assert not worker.sync_once()
+        assert worker.pending() == {sample_users.USER_OWES_MONEY.id_number: (1, shop_user.IS_NOT_PROCTOR)}
+
+        worksheet.fail = False
+        assert worker.sync_once()
+        assert worker.pending() == {}
+
+    def test_legacy_out_of_sync_users_file(self, tmpdir):
+        out_of_sync_users_path = str(tmpdir.join("out_of_sync_users.pkl"))
+        local_database = shop_user_database._ShopUserDatabaseLocal(str(tmpdir.join("database.pkl")),
+                                                                   out_of_sync_users_path)
+        local_database.dump_out_of_sync_users([sample_users.USER_CERTIFIED, sample_users.USER_OWES_MONEY])
+
+        assert local_database.load_out_of_sync_users() == {"7777777": (1, shop_user.IS_NOT_PROCTOR)}
+
+    def test_missing_out_of_sync_users_file(self, tmpdir):
+        local_database = shop_user_database._ShopUserDatabaseLocal(str(tmpdir.join("database.pkl")),
+                                                                   str(tmpdir.join("missing.pkl")))
+
+        assert local_database.load_out_of_sync_users() == {}
+
+    def test_dump_replaces_file(self, tmpdir):
+        out_of_sync_users_path = tmpdir.join("state", "out_of_sync_users.pkl")
+        local_database = shop_user_database._ShopUserDatabaseLocal(str(tmpdir.join("database.pkl")),
+                                                                   str(out_of_sync_users_path))
+        local_database.dump_out_of_sync_users({"7777777": (3, shop_user.IS_NOT_PROCTOR)})
+        local_database.dump_out_of_sync_users({"7777777": (6, shop_user.IS_NOT_PROCTOR)})
+
+        assert local_database.load_out_of_sync_users() == {"7777777": (6, shop_user.IS_NOT_PROCTOR)}
+        assert [path.basename for path in tmpdir.join("state").listdir()] == ["out_of_sync_users.pkl"]
+
+    def test_load_after_interrupted_dump(self, tmpdir):
+        out_of_sync_users_path = str(tmpdir.join("out_of_sync_users.pkl"))
+        local_database = shop_user_database._ShopUserDatabaseLocal(str(tmpdir.join("database.pkl")),
+                                                                   out_of_sync_users_path)
+        local_database.dump_out_of_sync_users({"7777777": (3, shop_user.IS_NOT_PROCTOR)})
+        tmpdir.join("out_of_sync_users.pkl").rename(out_of_sync_users_path + atomic_file.TEMPORARY_SUFFIX)
+
+        assert local_database.load_out_of_sync_users() == {"7777777": (3, shop_user.IS_NOT_PROCTOR)}
+
+
+class _FakeGspreadWorksheet(object):
+    """ The gspread worksheet calls update_sync_values() makes, over rows of [ID number, debt, proctorliness]. """
+
+    def __init__(self, id_numbers):
+        self.id_numbers = list(id_numbers)
+        self.updated_cells = []
+
+    def col_values(self, col):
+        assert col == shop_user.ID + 1
+        return list(self.id_numbers)
+
+    def update_cells(self, cells):
+        self.updated_cells.extend((self.id_numbers[cell.row - 1], cell.col, cell.value) for cell in cells)
+
+
+class TestUpdateSyncValues(object):
+
+    def _worksheet(self, gspread_worksheet):
+        worksheet = object.__new__(shop_user_database._ShopUserDatabaseGoogleWorksheet)
+        worksheet._worksheet = gspread_worksheet
+        return worksheet
+
+    def test_rows_found_again_after_sort(self):
+        gspread_worksheet = _FakeGspreadWorksheet(["ID", "1111111", "7777777"])
+        worksheet = self._worksheet(gspread_worksheet)
+        worksheet.update_sync_values({"7777777": (3, shop_user.IS_NOT_PROCTOR)})
+        gspread_worksheet.id_numbers = ["ID", "7777777", "1111111"]
+        gspread_worksheet.updated_cells = []
+
+        worksheet.update_sync_values({"7777777": (6, shop_user.IS_NOT_PROCTOR)})
+
+        assert gspread_worksheet.updated_cells == [("7777777", shop_user.DEBT + 1, 6),
+                                                   ("7777777", shop_user.PROCTOR + 1, shop_user.IS_NOT_PROCTOR)]
+
+    def test_unknown_user_skipped(self):
+        gspread_worksheet = _FakeGspreadWorksheet(["ID", "1111111"])
+
+        self._worksheet(gspread_worksheet).update_sync_values({"7777777": (3, shop_user.IS_NOT_PROCTOR)})
+
+        assert gspread_worksheet.updated_cells == []
+
+
+SLOW_USER_DATA = ["Slow Joe", sample_users.VALID_TEST_DATE, "", "email", "5555555", 0, shop_user.IS_NOT_PROCTOR]
+
+
+class _SlowWorksheet(object):
+    """ A spreadsheet whose lookups take until release is set. """
+
+    looking_up = threading.Event()
+    release = threading.Event()
+
+    def __init__(self, spreadsheet=None):
+        pass
+
+    def load_shop_user_database(self):
+        return {sample_users.USER_CERTIFIED.id_number: shop_user.ShopUser(
+            ["Joe Schmoe", sample_users.VALID_TEST_DATE, "", "email", "7777777", 0, shop_user.IS_NOT_PROCTOR])}
+
+    def test_connection(self):
+        pass
+
+    def get_shop_user_data(self, id_number):
+        _SlowWorksheet.looking_up.set()
+        _SlowWorksheet.release.wait(5)
+        return SLOW_USER_DATA
+
+    def update_sync_values(self, sync_values_by_id):
+        pass
+
+
+class _UnsyncableWorksheet(_SlowWorksheet):
+    """ A spreadsheet that can be read but not written, so changes stay pending. """
+
+    def update_sync_values(self, sync_values_by_id):
+        raise IOError("No network")
+
+
+class TestShopUserLookups(object):
+
+    def test_lookup_doesnt_hold_up_debt_changes(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(shop_user_database, '_ShopUserDatabaseGoogleWorksheet', _SlowWorksheet)
+        _SlowWorksheet.looking_up.clear()
+        _SlowWorksheet.release.clear()
+        shop_user_db = shop_user_database.ShopUserDatabase(shop_user_database.SPREADSHEET_TESTING,
+                                                           str(tmpdir.join("database.pkl")),
+                                                           str(tmpdir.join("out_of_sync_users.pkl")))
+        lookup = threading.Thread(target=shop_user_db.get_shop_user, args=("5555555",))
+        lookup.start()
+        assert _SlowWorksheet.looking_up.wait(5)
+
+        start_time = time.time()
+        user = shop_user_db.get_shop_user(sample_users.USER_CERTIFIED.id_number)
+        shop_user_db.increase_debt(user)
+        assert time.time() - start_time < 1
+
+        _SlowWorksheet.release.set()
+        lookup.join(5)
+        assert user.debt == shop_user_database.DEBT_INCREMENT
+        assert shop_user_db.get_shop_user("5555555").name == "Slow Joe"
+
+    def test_restart_keeps_unsynced_changes(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(shop_user_database, '_ShopUserDatabaseGoogleWorksheet', _UnsyncableWorksheet)
+        _SlowWorksheet.release.set()
+        out_of_sync_users_path = str(tmpdir.join("out_of_sync_users.pkl"))
+        local_database = shop_user_database._ShopUserDatabaseLocal(str(tmpdir.join("database.pkl")),
+                                                                   out_of_sync_users_path)
+        local_database.dump_out_of_sync_users({sample_users.USER_CERTIFIED.id_number: (3, shop_user.IS_PROCTOR),
+                                               "5555555": (6, shop_user.IS_NOT_PROCTOR)})
+
+        shop_user_db = shop_user_database.ShopUserDatabase(shop_user_database.SPREADSHEET_TESTING,
+                                                           str(tmpdir.join("database.pkl")),
+                                                           out_of_sync_users_path)
+
+        user = shop_user_db.get_shop_user(sample_users.USER_CERTIFIED.id_number)
+        assert user.debt == 3
+        assert user._proctor
+        assert shop_user_db.get_shop_user("5555555").debt == 6
+        shop_user_db.increase_debt(user)
+        assert user.debt == 3 + shop_user_database.DEBT_INCREMENT
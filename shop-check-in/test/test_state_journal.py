@@ -0,0 +1,141 @@
+import Queue as queue
+
+from test import sample_users
+
+import atomic_file
+import audio
+import event
+import fsm
+import replay
+import shop
+import state_journal
+
+
+def _journal(tmpdir, **kwargs):
+    return state_journal.StateJournal(str(tmpdir.join("state", "board_state.journal")), **kwargs)
+
+
+def _run_board(journal, events):
+    event_q = queue.Queue()
+    for key, data in events + [(event.TERMINATE_PROGRAM, None)]:
+        event_q.put(event.Event(key, data))
+    users = {user.id_number: user for user in (sample_users.USER_POD, sample_users.USER_CERTIFIED)}
+    board = fsm.BoardFsm(event_q, queue.Queue(), replay.ReplayShopUserDatabase(users), replay.NullMailer(),
+                         audio_worker=audio.AudioWorker({}, audio.NullBackend()), journal=journal)
+    board.run_fsm()
+    return board
+
+
+class TestStateJournal(object):
+
+    def test_load_nothing_recorded(self, tmpdir):
+        assert _journal(tmpdir).load() is None
+
+    def test_load_last_record(self, tmpdir):
+        journal = _journal(tmpdir)
+        for index in xrange(5):
+            journal.record({'index': index})
+        journal.close()
+
+        assert _journal(tmpdir).load() == {'index': 4}
+
+    def test_compaction(self, tmpdir):
+        journal = _journal(tmpdir, compact_every_records=3)
+        for index in xrange(4):
+            journal.record({'index': index})
+        size_before_compaction = tmpdir.join("state", "board_state.journal").size()
+        for index in xrange(4, 6):
+            journal.record({'index': index})
+
+        assert tmpdir.join("state", "board_state.journal").size() < size_before_compaction
+        assert not tmpdir.join("state", "board_state.journal" + atomic_file.TEMPORARY_SUFFIX).exists()
+        assert _journal(tmpdir).load() == {'index': 5}
+
+    def test_load_after_interrupted_compaction(self, tmpdir):
+        journal = _journal(tmpdir)
+        for index in xrange(2):
+            journal.record({'index': index})
+        journal.close()
+        compacted = _journal(tmpdir.join("compacted"))
+        compacted.compact({'index': 2})
+        compacted.close()
+        tmpdir.join("compacted", "state", "board_state.journal").copy(
+            tmpdir.join("state", "board_state.journal" + atomic_file.TEMPORARY_SUFFIX))
+
+        assert _journal(tmpdir).load() == {'index': 2}
+
+    def test_torn_compaction_ignored(self, tmpdir):
+        journal = _journal(tmpdir)
+        journal.record({'index': 0})
+        journal.close()
+        tmpdir.join("state", "board_state.journal" + atomic_file.TEMPORARY_SUFFIX).write_binary("\x10\0")
+
+        assert _journal(tmpdir).load() == {'index': 0}
+
+    def test_torn_record_ignored(self, tmpdir):
+        journal = _journal(tmpdir)
+        journal.record({'index': 0})
+        journal.record({'index': 1})
+        journal.close()
+        path = tmpdir.join("state", "board_state.journal")
+        path.write_binary(path.read_binary()[:-3])
+
+        assert _journal(tmpdir).load() == {'index': 0}
+
+    def test_corrupt_record_ignored(self, tmpdir):
+        journal = _journal(tmpdir)
+        journal.record({'index': 0})
+        journal.record({'index': 1})
+        journal.close()
+        path = tmpdir.join("state", "board_state.journal")
+        data = path.read_binary()
+        path.write_binary(data[:-1] + chr(ord(data[-1]) ^ 0xff))
+
+        assert _journal(tmpdir).load() == {'index': 0}
+
+
+class TestShopState(object):
+
+    def test_round_trip(self):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], 3)
+
+        restored_shop = shop.Shop()
+        restored_shop.set_state(machine_shop.get_state())
+
+        assert restored_shop.is_open()
+        assert restored_shop.is_pod(sample_users.USER_POD)
+        assert restored_shop.get_user_s(3) == [sample_users.USER_CERTIFIED]
+        assert restored_shop.current_machine_start_time(3) == machine_shop.current_machine_start_time(3)
+
+    def test_version_changes(self):
+        machine_shop = shop.Shop()
+        version = machine_shop.version()
+        machine_shop.open_(sample_users.USER_POD)
+
+        assert machine_shop.version() > version
+
+
+class TestBoardRestore(object):
+
+    def test_restores_where_it_left_off(self, tmpdir):
+        _run_board(_journal(tmpdir), [(event.CARD_SWIPE, sample_users.USER_POD.id_number),
+                                      (event.SWITCH_FLIP_ON, None),
+                                      (event.CARD_SWIPE, sample_users.USER_POD.id_number),
+                                      (event.CARD_SWIPE, sample_users.USER_CERTIFIED.id_number),
+                                      (event.CARD_INSERT, 3)])
+
+        board = _run_board(_journal(tmpdir), [])
+
+        assert board._state == fsm.STANDBY
+        assert board._shop.is_pod(sample_users.USER_POD)
+        assert board._shop.get_user_s(3) == [sample_users.USER_CERTIFIED]
+
+    def test_restores_cargo(self, tmpdir):
+        _run_board(_journal(tmpdir), [(event.CARD_SWIPE, sample_users.USER_POD.id_number)])
+
+        board = _run_board(_journal(tmpdir), [(event.SWITCH_FLIP_ON, None)])
+
+        assert board._state == fsm.STANDBY
+        assert board._shop.is_pod(sample_users.USER_POD)
@@ -0,0 +1,93 @@
+import json
+
+from test import sample_users
+
+import shop
+import shop_check_in_exceptions
+import slots
+import stations
+
+
+def _load(tmpdir, entries):
+    path = tmpdir.join("stations.json")
+    path.write(json.dumps(entries))
+    return stations.load_station_configs(str(path))
+
+
+def _load_fails(tmpdir, entries):
+    try:
+        _load(tmpdir, entries)
+    except shop_check_in_exceptions.StationConfigError:
+        return True
+    return False
+
+
+class TestStationConfig(object):
+
+    def test_load(self, tmpdir):
+        configs = _load(tmpdir, [{"name": "main", "port": "COM4", "slots": "main"},
+                                 {"name": "wood", "port": "COM5", "slots": [6, 7], "reader": "tty",
+                                  "reader_path": "COM6", "framed": True}])
+
+        assert [config.name for config in configs] == ["main", "wood"]
+        assert configs[0].slots == slots.SUB_SHOP_SLOTS['main']
+        assert configs[0].reader == stations.DEFAULT_READER
+        assert configs[1].slots == [6, 7]
+        assert configs[1].reader_path == "COM6"
+        assert configs[0].journal_path != configs[1].journal_path
+        assert not configs[0].framed
+        assert configs[1].framed
+
+    def test_default_is_whole_shop(self):
+        config = stations.StationConfig()
+
+        assert config.slots == list(slots.SLOTS)
+        assert config.name is None
+
+    def test_overlapping_slots(self, tmpdir):
+        assert _load_fails(tmpdir, [{"name": "main", "port": "COM4", "slots": [1, 2]},
+                                    {"name": "wood", "port": "COM5", "slots": [2, 3], "reader": "stdin"}])
+
+    def test_unknown_sub_shop(self, tmpdir):
+        assert _load_fails(tmpdir, [{"name": "main", "slots": "metal"}])
+
+    def test_one_keyboard_hook(self, tmpdir):
+        assert _load_fails(tmpdir, [{"name": "main", "port": "COM4", "slots": [1]},
+                                    {"name": "wood", "port": "COM5", "slots": [2]}])
+
+    def test_same_port(self, tmpdir):
+        assert _load_fails(tmpdir, [{"name": "main", "port": "COM4", "slots": [1]},
+                                    {"name": "wood", "port": "COM4", "slots": [2], "reader": "stdin"}])
+
+
+class TestSharedOccupancy(object):
+
+    def test_stations_share_occupancy(self):
+        occupancy = shop.Occupancy()
+        main_shop = shop.Shop(occupancy, [1, 2])
+        wood_shop = shop.Shop(occupancy, [6, 7])
+        main_shop.open_(sample_users.USER_POD)
+        wood_shop.open_(sample_users.USER_PROCTOR)
+        wood_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], 6)
+
+        assert main_shop.current_machine_user_s(6) == [sample_users.USER_CERTIFIED]
+        assert not main_shop.is_pod(sample_users.USER_PROCTOR)
+
+        main_shop.close_(sample_users.USER_POD)  # Only its own slots need to be empty.
+        assert not main_shop.is_open()
+        assert wood_shop.is_open()
+
+    def test_state_covers_own_slots(self):
+        occupancy = shop.Occupancy()
+        main_shop = shop.Shop(occupancy, [1, 2])
+        wood_shop = shop.Shop(occupancy, [6, 7])
+        main_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], 1)
+        state = main_shop.get_state()
+
+        restored_occupancy = shop.Occupancy()
+        restored_wood_shop = shop.Shop(restored_occupancy, [6, 7])
+        restored_wood_shop.set_state(wood_shop.get_state())
+        shop.Shop(restored_occupancy, [1, 2]).set_state(state)
+
+        assert restored_occupancy.occupants[1] == [sample_users.USER_CERTIFIED]
+        assert sorted(state['occupants']) == [1, 2]
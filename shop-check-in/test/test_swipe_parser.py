@@ -0,0 +1,70 @@
+import swipe_parser
+
+ID_NUMBER = "40155181"
+SWIPE = ";0" + ID_NUMBER + "9\x00"
+
+
+class TestSwipeParser(object):
+
+    def test_feed_none(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string("gibberish 0123456789 gibberish") == []
+        assert parser.frames_parsed == 0
+
+    def test_feed_one(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string(SWIPE) == [ID_NUMBER]
+        assert parser.frames_parsed == 1
+
+    def test_feed_only_completes_on_end_character(self):
+        parser = swipe_parser.SwipeParser()
+
+        results = [parser.feed(char) for char in SWIPE]
+
+        assert results[:-1] == [None] * (len(SWIPE) - 1)
+        assert results[-1] == ID_NUMBER
+
+    def test_feed_one_in_the_middle(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string("gibberish " + SWIPE + " gibberish") == [ID_NUMBER]
+
+    def test_feed_one_broken_up(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string(";04015 gibberish 51819\x00") == []
+        assert parser.frames_aborted == 1
+
+    def test_feed_too_many_digits(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string(";00" + ID_NUMBER + "9\x00") == []
+
+    def test_feed_restarts_on_start_character(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string(";0401" + SWIPE) == [ID_NUMBER]
+
+    def test_feed_two_back_to_back(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string(SWIPE + SWIPE) == [ID_NUMBER, ID_NUMBER]
+
+    def test_feed_two_separated(self):
+        parser = swipe_parser.SwipeParser()
+
+        assert parser.feed_string(SWIPE + " gibberish " + SWIPE) == [ID_NUMBER, ID_NUMBER]
+
+    def test_frame_timing(self):
+        ticks = iter([10.0, 10.5])
+        parser = swipe_parser.SwipeParser(clock=lambda: next(ticks))
+
+        parser.feed_string(SWIPE)
+        stats = parser.stats()
+
+        assert stats['frames_parsed'] == 1
+        assert stats['last_frame_seconds'] == 0.5
+        assert stats['max_frame_seconds'] == 0.5
+        assert stats['characters_parsed'] == len(SWIPE)
@@ -0,0 +1,84 @@
+import threading
+import Queue as queue
+
+from test import sample_users
+
+import event
+import id_logger
+import id_logger_backends
+import shop_check_in_exceptions
+import shop_user
+import user_lookup
+
+LOOKUP_TIMEOUT = 1
+USER_SWIPED = shop_user.ShopUser(["Swipe Joe", sample_users.VALID_TEST_DATE, "", "email", "40155181", 0,
+                                  shop_user.IS_NOT_PROCTOR])
+SWIPE = ";0" + USER_SWIPED.id_number + "9\x00"
+
+
+class _BlockingShopUserDatabase(object):
+
+    def __init__(self, users):
+        self._users = {user.id_number: user for user in users}
+        self.release = threading.Event()
+        self.lookup_count = 0
+
+    def get_shop_user(self, id_number):
+        self.lookup_count += 1
+        self.release.wait(LOOKUP_TIMEOUT)
+        try:
+            return self._users[id_number]
+        except KeyError:
+            raise shop_check_in_exceptions.NonexistentUserError
+
+
+class TestUserLookupPool(object):
+
+    def test_lookup_hit(self):
+        shop_user_db = _BlockingShopUserDatabase([sample_users.USER_CERTIFIED])
+        shop_user_db.release.set()
+        pool = user_lookup.UserLookupPool(shop_user_db)
+
+        lookup = pool.submit(sample_users.USER_CERTIFIED.id_number)
+
+        assert lookup.get_shop_user(LOOKUP_TIMEOUT) == sample_users.USER_CERTIFIED
+        assert not lookup.is_miss()
+
+    def test_lookup_miss(self):
+        shop_user_db = _BlockingShopUserDatabase([])
+        shop_user_db.release.set()
+        pool = user_lookup.UserLookupPool(shop_user_db)
+
+        lookup = pool.submit(sample_users.USER_CERTIFIED.id_number)
+
+        try:
+            lookup.get_shop_user(LOOKUP_TIMEOUT)
+        except shop_check_in_exceptions.NonexistentUserError:
+            assert lookup.is_miss()
+        else:
+            assert False
+
+    def test_pending_lookups_are_shared(self):
+        shop_user_db = _BlockingShopUserDatabase([sample_users.USER_CERTIFIED])
+        pool = user_lookup.UserLookupPool(shop_user_db)
+
+        first_lookup = pool.submit(sample_users.USER_CERTIFIED.id_number)
+        second_lookup = pool.submit(sample_users.USER_CERTIFIED.id_number)
+        shop_user_db.release.set()
+
+        assert first_lookup is second_lookup
+        assert second_lookup.get_shop_user(LOOKUP_TIMEOUT) == sample_users.USER_CERTIFIED
+        assert shop_user_db.lookup_count == 1
+
+    def test_id_logger_attaches_lookup_to_swipe(self):
+        shop_user_db = _BlockingShopUserDatabase([USER_SWIPED])
+        shop_user_db.release.set()
+        pool = user_lookup.UserLookupPool(shop_user_db)
+        event_q = queue.Queue()
+
+        backend = id_logger_backends.ReplayBackend.from_string(SWIPE)
+        id_logger.IdLogger(event_q, backend, pool).run()
+        swipe = event_q.get_nowait()
+
+        assert swipe.key == event.CARD_SWIPE
+        assert swipe.user_lookup.get_shop_user(LOOKUP_TIMEOUT) == USER_SWIPED
@@ -0,0 +1,154 @@
+import json
+
+import flask
+
+from test import sample_users
+
+import shop
+import slots
+from website import server
+
+
+def _live_site(monkeypatch, shop_s):
+    monkeypatch.setattr(flask.Config, 'from_pyfile', lambda self, filename: True)  # No web.cfg needed
+    return server.LiveSite(shop_s)
+
+
+class TestShopStatus(object):
+
+    def test_status(self, monkeypatch):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], slots._MILL_1)
+
+        status = _live_site(monkeypatch, machine_shop).shop_status()
+
+        assert status['open']
+        assert status['pods'] == sample_users.USER_POD.name
+        assert status['main']['machines']['Mill 1']['users'] == sample_users.USER_CERTIFIED.name
+        assert status['main']['occupant_count'] == 1
+        assert status['wood']['occupant_count'] == 0
+
+    def test_status_cached_until_change(self, monkeypatch):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        live_site = _live_site(monkeypatch, machine_shop)
+
+        status = live_site.shop_status()
+        assert live_site.shop_status() is status
+
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], slots._MILL_1)
+        changed_status = live_site.shop_status()
+        assert changed_status is not status
+        assert changed_status['main']['occupant_count'] == 1
+        assert status['main']['occupant_count'] == 0
+
+    def test_stations(self, monkeypatch):
+        occupancy = shop.Occupancy()
+        main_shop = shop.Shop(occupancy, slots.SUB_SHOP_SLOTS['main'])
+        wood_shop = shop.Shop(occupancy, slots.SUB_SHOP_SLOTS['wood'])
+        live_site = _live_site(monkeypatch, [main_shop, wood_shop])
+        assert not live_site.shop_status()['open']
+
+        wood_shop.open_(sample_users.USER_POD)
+        wood_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], 7)
+
+        status = live_site.shop_status()
+        assert status['open']
+        assert status['wood']['limbo'] == [sample_users.USER_CERTIFIED.name]
+
+
+class TestStatusPage(object):
+
+    def test_not_modified(self, monkeypatch):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        client = _live_site(monkeypatch, machine_shop)._server.test_client()
+
+        page = client.get('/')
+        assert page.status_code == 200
+        assert sample_users.USER_POD.name in page.get_data()
+        etag = page.headers['ETag']
+
+        assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], slots._MILL_1)
+        changed_page = client.get('/', headers={'If-None-Match': etag})
+        assert changed_page.status_code == 200
+        assert changed_page.headers['ETag'] != etag
+
+    def test_json(self, monkeypatch):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        client = _live_site(monkeypatch, machine_shop)._server.test_client()
+
+        response = client.get('/', headers={'Accept': server.JSON_MIMETYPE})
+
+        assert response.mimetype == server.JSON_MIMETYPE
+        assert json.loads(response.get_data())['pods'] == sample_users.USER_POD.name
+        assert response.headers['ETag'] != client.get('/').headers['ETag']
+
+
+class TestStatusApi(object):
+
+    def test_status(self, monkeypatch):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        live_site = _live_site(monkeypatch, machine_shop)
+        client = live_site._server.test_client()
+
+        response = client.get('/api/status')
+
+        assert response.mimetype == server.JSON_MIMETYPE
+        assert json.loads(response.get_data()) == live_site.shop_status()
+        assert client.get('/api/status', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    def test_stream(self, monkeypatch):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        client = _live_site(monkeypatch, machine_shop)._server.test_client()
+
+        response = client.get('/api/stream', buffered=False)
+        events = iter(response.response)
+        try:
+            first = next(events)
+            assert "event: status\n" in first
+            machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], slots._MILL_1)
+            second = next(events)
+        finally:
+            response.close()
+
+        assert "event: changes\n" in second
+        changes = json.loads(second.split("data: ", 1)[1])
+        assert {'sub_shop': 'main', 'machine': 'Mill 1', 'in_use': True, 'users': sample_users.USER_CERTIFIED.name,
+                'start_time': server.LiveSite._datetime_as_time_string(
+                    machine_shop.current_machine_start_time(slots._MILL_1))} in changes
+
+
+class TestStatusChanges(object):
+
+    def _status(self, machine_shop):
+        return server.LiveSite.build_shop_status([machine_shop.snapshot()], machine_shop.occupancy_snapshot())
+
+    def test_open_and_close(self):
+        machine_shop = shop.Shop()
+        closed = self._status(machine_shop)
+        machine_shop.open_(sample_users.USER_POD)
+        opened = self._status(machine_shop)
+
+        opening = server.status_changes(closed, opened)
+        assert {'open': True} in opening
+        assert {'pods': sample_users.USER_POD.name} in opening
+        assert server.status_changes(opened, closed) == [{'open': False}]
+
+    def test_only_changes(self):
+        machine_shop = shop.Shop()
+        machine_shop.open_(sample_users.USER_POD)
+        before = self._status(machine_shop)
+        machine_shop.add_user_s_to_slot([sample_users.USER_CERTIFIED], 7)
+        after = self._status(machine_shop)
+
+        assert server.status_changes(before, before) == []
+        assert server.status_changes(before, after) == [{'sub_shop': 'wood',
+                                                         'limbo': [sample_users.USER_CERTIFIED.name],
+                                                         'occupant_count': 1}]
@@ -0,0 +1,107 @@
+import threading
+import Queue as queue
+
+DEFAULT_WORKER_COUNT = 2
+
+
+class UserLookup(object):
+    """ The pending result of resolving an ID number to a shop user.
+
+        Resolves either to a ShopUser or to a miss, in which case the error the
+        database raised is kept and re-raised by get_shop_user(). Lookups that
+        are resolved by an event loop are waited for by running that loop.
+    """
+
+    def __init__(self, id_number, loop=None):
+        self.id_number = id_number
+        self._loop = loop
+        self._done = threading.Event()
+        self._user = None
+        self._error = None
+
+    def is_resolved(self):
+        return self._done.is_set()
+
+    def is_miss(self):
+        return self.is_resolved() and self._error is not None
+
+    def get_shop_user(self, timeout=None):
+        """ Waits for the lookup to resolve and returns the user, raising the database's error on a miss. """
+        if self._loop is not None:
+            resolved = self._loop.run_until(self.is_resolved, timeout)
+        else:
+            resolved = self._done.wait(timeout)
+        if not resolved:
+            raise queue.Empty
+        if self._error is not None:
+            raise self._error
+        return self._user
+
+    def resolve(self, user):
+        self._user = user
+        self._done.set()
+
+    def resolve_miss(self, error):
+        self._error = error
+        self._done.set()
+
+
+class UserLookupPool(object):
+    """ Resolves swiped ID numbers against the shop user database on worker threads.
+
+        Lookups start as soon as an ID is decoded, so by the time the FSM handles
+        the swipe the (possibly networked) database round trip is usually done.
+        Swipes of an ID that is still being looked up share the pending lookup.
+
+        Given an event_loop.EventLoop, lookups run on the loop's executor
+        instead of the pool's own workers and resolve on the loop thread.
+    """
+
+    def __init__(self, shop_user_db, worker_count=DEFAULT_WORKER_COUNT, loop=None):
+        self._shop_user_db = shop_user_db
+        self._loop = loop
+        self._lookup_q = queue.Queue()
+        self._pending_lookups = {}
+        self._pending_lookups_lock = threading.Lock()
+
+        for ignored in xrange(worker_count if loop is None else 0):
+            worker = threading.Thread(target=self._resolve_lookups)
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, id_number):
+        with self._pending_lookups_lock:
+            lookup = self._pending_lookups.get(id_number)
+            if lookup is None:
+                lookup = UserLookup(id_number, self._loop)
+                self._pending_lookups[id_number] = lookup
+                if self._loop is None:
+                    self._lookup_q.put(lookup)
+                else:
+                    future = self._loop.run_in_executor(self._shop_user_db.get_shop_user, id_number)
+                    future.add_done_callback(lambda done: self._finish_lookup(lookup, done))
+        return lookup
+
+    def _finish_lookup(self, lookup, future):
+        try:
+            user = future.result()
+        except Exception as error:
+            lookup.resolve_miss(error)
+        else:
+            lookup.resolve(user)
+        finally:
+            with self._pending_lookups_lock:
+                del self._pending_lookups[lookup.id_number]
+
+    def _resolve_lookups(self):
+        while True:
+            lookup = self._lookup_q.get()
+            try:
+                user = self._shop_user_db.get_shop_user(lookup.id_number)
+            except Exception as error:
+                lookup.resolve_miss(error)
+            else:
+                lookup.resolve(user)
+            finally:
+                with self._pending_lookups_lock:
+                    del self._pending_lookups[lookup.id_number]
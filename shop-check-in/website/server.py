@@ -1,4 +1,7 @@
+import binascii
 import flask
+import latency_metrics
+import os
 import shop
 import shop_user
 import datetime
@@ -18,25 +21,84 @@ wood: {'machines': {'name':
                    'start time': '...'}
                   }
       'limbo': ['...', '...', ]
+      'occupant_count': 3
 },
 main:{...},
 sheet: {...}
 }
+
+The status page (and, for requests that Accept application/json, the status
+dictionary as JSON) is built and rendered once per change to the Shops and
+served with an ETag, so browsers refreshing an unchanged page get a 304.
+
+/api/status is the status dictionary as JSON. /api/stream is a stream of
+Server-Sent Events: a "status" event with the whole status dictionary when it
+connects, then a "changes" event listing what changed each time a board
+changes the shop (see status_changes()). Each event's id is the status's ETag.
 """
 
+JSON_MIMETYPE = 'application/json'
+STREAM_KEEPALIVE_SECONDS = 15  # A comment is sent this often on an idle stream, so dead clients are noticed.
+SUB_SHOPS = ('wood', 'main', 'sheet')
+
+# (slot, sub-shop, machine name if the slot is a specific machine) for each slot in a sub-shop
+_SLOT_LAYOUT = [(slot, slots.which_sub_shop(slot), slots.get_machine_name(slot) if slots.is_specific_machine(slot)
+                 else None)
+                for slot in slots.SLOTS if slots.which_sub_shop(slot)]
+
+
+class _RenderedStatus(object):
+    """ The status dictionary at one set of Shop versions, and the page and JSON made from it when first asked for. """
+
+    def __init__(self, versions, etag, status):
+        self.versions = versions
+        self.etag = etag
+        self.status = status
+        self._html = None
+        self._json = None
+
+    def html(self):
+        if self._html is None:
+            self._html = flask.render_template('status.html', status=self.status)
+        return self._html
+
+    def json(self):
+        if self._json is None:
+            self._json = flask.json.dumps(self.status)
+        return self._json
+
 
 class LiveSite(object):
-    def __init__(self, shop):
+    def __init__(self, shop_s):
+        """ shop_s is the Shop, or a list of the Shops of every station, sharing one Occupancy. """
         self._server = flask.Flask('website')
         self._server.config.from_pyfile('web.cfg')
-        self._shop = shop
-        self._shop_status = {}
+        self._shops = shop_s if isinstance(shop_s, list) else [shop_s]
+        self._shop = self._shops[0]  # Knows who is in every slot, whichever station owns it.
+        self._rendered = None  # _RenderedStatus, replaced whole so requests never see half of it
+        self._etag_prefix = binascii.hexlify(os.urandom(4))  # Versions start again when the board restarts.
         self.daemon = False
 
         @self._server.route('/')
         def basic():
-            self.build_shop_status()
-            return flask.render_template('status.html', status=self._shop_status)
+            rendered = self._rendered_status()
+            if flask.request.accept_mimetypes.best_match(['text/html', JSON_MIMETYPE]) == JSON_MIMETYPE:
+                return self._conditional_response(rendered.json(), JSON_MIMETYPE, rendered.etag + '-json')
+            return self._conditional_response(rendered.html(), 'text/html', rendered.etag)
+
+        @self._server.route('/api/status')
+        def api_status():
+            rendered = self._rendered_status()
+            return self._conditional_response(rendered.json(), JSON_MIMETYPE, rendered.etag + '-json')
+
+        @self._server.route('/api/stream')
+        def api_stream():
+            return flask.Response(self._status_events(), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache'})
+
+        @self._server.route('/metrics')
+        def metrics():
+            return flask.Response(latency_metrics.dump(), mimetype='text/plain')
 
     @staticmethod
     def _datetime_as_time_string(time_):
@@ -50,34 +112,73 @@ class LiveSite(object):
         start_time = LiveSite._datetime_as_time_string(start_time)
         return {'in_use': (users_names != ''), 'users': users_names, 'start_time': start_time}
 
-    def build_shop_status(self):
-        self._shop_status = {'open': self._shop.is_open()}
-        if self._shop.is_open():
-            pods = ', '.join([user.name for user in self._shop.pods()])
-            self._shop_status['pods'] = pods
-            self._add_machines_to_shop_status_dict()
-
-    def _add_machines_to_shop_status_dict(self):
-        self._shop_status['wood'] = {'machines': {}, 'limbo': []}
-        self._shop_status['main'] = {'machines': {}, 'limbo': []}
-        self._shop_status['sheet'] = {'machines': {}, 'limbo': []}
-
-        for slot in slots.SLOTS:
-            sub_shop = slots.which_sub_shop(slot)
-            if sub_shop:
-                self._add_machine_to_sub_shop_status(slot, sub_shop)
-
-    def _add_machine_to_sub_shop_status(self, slot, sub_shop):
-        if slots.is_specific_machine(slot):
-            machine_name = self._shop.machine_name(slot)
-            user_s = self._shop.current_machine_user_s(slot)
-            start_time = self._shop.current_machine_start_time(slot)
-            machine_status = self.build_machine_status_dict(user_s, start_time)
-            self._shop_status[sub_shop]['machines'][machine_name] = machine_status
-        else:
-            if self._shop.is_machine_in_use(slot):
-                user_s_names = [user.name for user in self._shop.current_machine_user_s(slot)]
-                self._shop_status[sub_shop]['limbo'] += user_s_names
+    def shop_status(self):
+        """ The status dictionary, built again only when a Shop has changed since it was last built.
+
+            Requests share it, so it must not be modified.
+        """
+        return self._rendered_status().status
+
+    def _rendered_status(self):
+        shop_snapshots = [shop_.snapshot() for shop_ in self._shops]
+        occupancy = self._shop.occupancy_snapshot()
+        versions = tuple(snapshot.version for snapshot in shop_snapshots) + (occupancy.version,)
+        rendered = self._rendered
+        if rendered is None or rendered.versions != versions:
+            etag = "%s-%s" % (self._etag_prefix, ".".join(str(version) for version in versions))
+            rendered = _RenderedStatus(versions, etag, self.build_shop_status(shop_snapshots, occupancy))
+            self._rendered = rendered
+        return rendered
+
+    def _status_events(self):
+        rendered = self._rendered_status()
+        yield _server_sent_event('status', rendered.json(), rendered.etag)
+        while True:
+            self._shop.wait_for_change(rendered.versions[-1], STREAM_KEEPALIVE_SECONDS)
+            latest = self._rendered_status()
+            if latest.versions == rendered.versions:
+                yield ": keepalive\n\n"
+                continue
+            changes = status_changes(rendered.status, latest.status)
+            if changes:
+                yield _server_sent_event('changes', flask.json.dumps(changes), latest.etag)
+            rendered = latest
+
+    @staticmethod
+    def _conditional_response(body, mimetype, etag):
+        response = flask.Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'  # Check back every time; unchanged pages cost a 304.
+        response.vary.add('Accept')
+        return response.make_conditional(flask.request)
+
+    @staticmethod
+    def build_shop_status(shop_snapshots, occupancy):
+        """ The status dictionary for the ShopSnapshots of every station and their OccupancySnapshot. """
+        open_shops = [snapshot for snapshot in shop_snapshots if snapshot.is_open]
+        shop_status = {'open': bool(open_shops)}
+        if open_shops:
+            pod_names = []
+            for snapshot in open_shops:
+                for user in snapshot.pods:
+                    if user.name not in pod_names:  # A POD may be on duty at several stations.
+                        pod_names.append(user.name)
+            shop_status['pods'] = ', '.join(pod_names)
+            LiveSite._add_machines_to_shop_status_dict(shop_status, occupancy)
+        return shop_status
+
+    @staticmethod
+    def _add_machines_to_shop_status_dict(shop_status, occupancy):
+        for sub_shop in SUB_SHOPS:
+            shop_status[sub_shop] = {'machines': {}, 'limbo': [],
+                                     'occupant_count': occupancy.sub_shop_counts[sub_shop]}
+
+        for slot, sub_shop, machine_name in _SLOT_LAYOUT:
+            if machine_name is not None:
+                machine_status = LiveSite.build_machine_status_dict(occupancy.user_s(slot), occupancy.start_time(slot))
+                shop_status[sub_shop]['machines'][machine_name] = machine_status
+            elif occupancy.is_machine_in_use(slot):
+                shop_status[sub_shop]['limbo'] += [user.name for user in occupancy.user_s(slot)]
 
     def start(self):
         if self.daemon:
@@ -87,5 +188,44 @@ class LiveSite(object):
             self._start()
 
     def _start(self):
+        # Each request, including every open /api/stream, gets its own thread.
         self._server.run(host='0.0.0.0',
-                         port=80)
+                         port=80,
+                         threaded=True)
+
+
+def status_changes(old_status, new_status):
+    """ What changed from one status dictionary to the next, as a list of
+        the smallest dictionaries that say so:
+
+            {'open': False}
+            {'pods': 'POD Joe, Proctor Joe'}
+            {'sub_shop': 'main', 'machine': 'Mill 1', 'in_use': True, 'users': '...', 'start_time': '...'}
+            {'sub_shop': 'wood', 'limbo': ['...'], 'occupant_count': 3}
+
+        While the shop is closed there are no machines to report.
+    """
+    changes = []
+    if old_status['open'] != new_status['open']:
+        changes.append({'open': new_status['open']})
+    if not new_status['open']:
+        return changes
+    if old_status.get('pods') != new_status['pods']:
+        changes.append({'pods': new_status['pods']})
+    for sub_shop in SUB_SHOPS:
+        old_sub_shop = old_status.get(sub_shop, {'machines': {}})
+        new_sub_shop = new_status[sub_shop]
+        for machine_name, machine_status in sorted(new_sub_shop['machines'].iteritems()):
+            if old_sub_shop['machines'].get(machine_name) != machine_status:
+                change = {'sub_shop': sub_shop, 'machine': machine_name}
+                change.update(machine_status)
+                changes.append(change)
+        if (old_sub_shop.get('limbo') != new_sub_shop['limbo'] or
+                old_sub_shop.get('occupant_count') != new_sub_shop['occupant_count']):
+            changes.append({'sub_shop': sub_shop, 'limbo': new_sub_shop['limbo'],
+                            'occupant_count': new_sub_shop['occupant_count']})
+    return changes
+
+
+def _server_sent_event(event_type, data, event_id):
+    return "id: %s\nevent: %s\ndata: %s\n\n" % (event_id, event_type, data)